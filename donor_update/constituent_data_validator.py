@@ -389,31 +389,9 @@ class ConstituentDataValidator:
         input_address += address_data[INPUT_ADDRESS_KEY][cc.LGL_POSTAL_CODE]
         return lgl_address, input_address
 
-    # This method will take a full name and split it into a first and last name.  If there is only one name,
-    # it is returned in the first name.
-    #
-    # Args -
-    #   full_name - the full name of the person separated by spaces.
-    #
-    # Returns - an array in the form (first_name, last_name)
-    #TODO: Make names with "and" work properly.  It needs to handle:
-    #      <fn> <ln> and <fn> <ln> as well as <fn> and <fn> <ln>
-    #      There may also be middle names.
-    #      Since the presence of "and" implies multiple names, callers will have to handle multiple names returned.
-    def _normalize_full_name(self, full_name):
-        log.debug('Entering with name "{}"'.format(full_name))
-        full_name = full_name.replace('.', '')
-        full_name = full_name.lower()
-        noise_words = [' and ', ' or ', '&', '.', 'jr', 'sr', ' i', ' ii', ' iii']
-        for word in noise_words:
-            full_name.replace(word, ' ')
-        (first_name, middle_name, last_name) = ' '.split(full_name.title())
-        if middle_name and not last_name:
-            last_name = middle_name
-        return first_name, last_name
-
     # This private method will make a call to get constituent detail data from LGL.  If the data
-    # has already been retrieved, then it simply returns what it already knows.
+    # has already been retrieved, then it simply returns what it already knows.  The local mirror of LGL is used
+    # instead of a call if it has the constituent's addresses and they are fresh (see LglMirror.is_fresh).
     #
     # Args -
     #   constituent_id - the LGL ID of the constituent whose address is being validated
@@ -424,9 +402,14 @@ class ConstituentDataValidator:
         log.debug('Entering for ID {}.'.format(constituent_id))
         if constituent_id == self._constituent_id:
             return self._constituent_data
-        # Make the call and save the data.
-        lgl = lgl_api.LglApi()
-        lgl_data = lgl.get_constituent_info(constituent_id=constituent_id)
+        lgl = lgl_api.get_lgl_api()
+        lgl_data = None
+        if lgl.mirror.is_fresh(constituent_id=constituent_id):
+            lgl_data = lgl.mirror.get_constituent(constituent_id=constituent_id)
+        if not lgl_data or cc.LGL_API_ADDRESS not in lgl_data or cc.LGL_API_EMAIL not in lgl_data:
+            # Make the call and save the data.
+            lgl_data = lgl.get_constituent_info(constituent_id=constituent_id)
+            lgl.mirror.store_constituent(constituent=lgl_data)
         self._constituent_id = constituent_id
         self._constituent_data = lgl_data
         return lgl_data
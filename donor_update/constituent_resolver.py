@@ -0,0 +1,191 @@
+# This class resolves the LGL constituent IDs for all the donors in an input file.  The file readers used to look up
+# their donors one after another, which left most of LGL's call budget (300 calls every 5 minutes) unused while each
+# call waited on the network.  The resolver instead:
+#
+#   1. collects the unique name/email keys for the whole file up front,
+#   2. looks them up at the same time using a bounded pool of worker threads (the LglRateLimiter keeps all the
+#      threads under LGL's call limit),
+#   3. shares a lookup that is already running (or done) for the same key and source instead of starting a second
+#      one.  A lookup that failed is forgotten so that the next file tries again, and
+#   4. puts the IDs back into the {index: id} format that map_fields expects.
+#
+# Donors that have an ID from their source (an "external key", like a Stripe customer ID) are looked up by that ID
+# in the cache first.  Once a donor has been found, their external keys are saved so that next time no search is
+# needed.  They are only saved if the donor matched exactly one constituent.  A donor whose ID was picked from
+# several matches (or from a fuzzy match) could be wrong, and a saved external key would keep using that ID.
+#
+# The number of worker threads can be set in the optional "resolver" section of the donor_etl.properties file:
+#
+# [resolver]
+# max_workers: 4
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import column_constants as cc
+import lgl_api
+import lgl_cache
+
+DEFAULT_MAX_WORKERS = 4
+
+log = logging.getLogger()
+_resolver_instance = None
+_resolver_lock = threading.Lock()
+
+
+# This function returns the ConstituentResolver that is shared by the whole program.  Sharing it means that a donor
+# who appears in more than one input file is only looked up once.
+#
+# Returns - the shared ConstituentResolver object
+def get_resolver():
+    global _resolver_instance
+    with _resolver_lock:
+        if _resolver_instance is None:
+            lgl = lgl_api.get_lgl_api()
+            max_workers = lgl.config.getint('resolver', 'max_workers', fallback=DEFAULT_MAX_WORKERS)
+            _resolver_instance = ConstituentResolver(lgl=lgl, max_workers=max_workers)
+    return _resolver_instance
+
+
+class ConstituentResolver:
+
+    def __init__(self, lgl, max_workers=DEFAULT_MAX_WORKERS):
+        self._lgl = lgl
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='resolver')
+        self._lookups = {}  # The lookups started so far in the form {(source, key): Future}
+        self._lock = threading.Lock()
+
+    # This method will find the LGL IDs for the donors in an input file.
+    #
+    # Args -
+    #   lookups - a dict of the donors to look up in the form {index: (name, email)}.  The email may be None.
+    #   file_name - the name of the file that contains the donors for error messages
+    #   source - the source of the file, like "Benevity".  It is used to choose the order of the LGL searches.
+    #   external_keys - (opt) the source's IDs for the donors in the form {index: [external_key, ...]}.  The keys
+    #       are made by lgl_cache.make_external_key.
+    #
+    # Returns - a dict of LGL IDs in the format: {0: id_1, 1: id_2, ...}.  The keys are the same as the lookups keys.
+    #   The ID is an empty string if the donor was not found.
+    def resolve(self, lookups, file_name=None, source=None, external_keys=None):
+        log.debug('Entering with {} lookups for "{}".'.format(len(lookups), file_name))
+        external_keys = external_keys or {}
+        index_keys = {}
+        futures = {}
+        lgl_ids = {}
+        for index, (name, email) in lookups.items():
+            cid = self._find_external_id(external_keys=external_keys.get(index, []))
+            if cid:
+                lgl_ids[index] = cid
+                continue
+            if not _has_value(name) and not _has_value(email):
+                index_keys[index] = None
+                continue
+            key = lgl_cache.make_key(name=name, email=email)
+            index_keys[index] = key
+            if key not in futures:
+                futures[key] = self._start_lookup(key=key, name=name, email=email, file_name=file_name,
+                                                  source=source)
+        log.debug('{} unique donors will be looked up for "{}".'.format(len(futures), file_name))
+
+        for index, key in index_keys.items():
+            lgl_ids[index] = futures[key].result() if key else ''
+            if not external_keys.get(index) or not self._is_exact_match(lookup=lookups[index], cid=lgl_ids[index]):
+                continue
+            for external_key in external_keys[index]:
+                self._lgl.cache.put_external_id(external_key=external_key, constituent_id=lgl_ids[index])
+        return {index: lgl_ids[index] for index in lookups.keys()}
+
+    # This method will estimate the calls to LGL needed to resolve the donors in an input file without making any
+    # calls.  It is used to plan a run (see lgl_call_planner.py).  The donors are counted once for each unique key,
+    # the same way resolve looks them up.
+    #
+    # Args -
+    #   lookups - the same as for resolve
+    #   source - the same as for resolve
+    #   external_keys - the same as for resolve
+    #
+    # Returns - a dict in the form {key: (constituent_id, expected_calls)}.  The constituent ID is None if the donor
+    #   isn't known yet.  Donors found by an external key use "id|<constituent_id>" as the key.
+    def estimate(self, lookups, source=None, external_keys=None):
+        external_keys = external_keys or {}
+        donors = {}
+        for index, (name, email) in lookups.items():
+            cid = self._find_external_id(external_keys=external_keys.get(index, []), count_stats=False)
+            if cid:
+                donors['id|' + str(cid)] = (cid, 0.0)
+                continue
+            if not _has_value(name) and not _has_value(email):
+                continue
+            key = lgl_cache.make_key(name=name, email=email)
+            if key in donors:
+                continue
+            email = email if _has_value(email) else None
+            cid = self._lgl.cache.get_constituent_id(name=name, email=email, count_stats=False)
+            donors[key] = (cid, self._lgl.estimate_calls(name=name, email=email, source=source))
+        return donors
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method will find a donor by the IDs their source uses for them.
+    #
+    # Args -
+    #   external_keys - the donor's external keys
+    #   count_stats - (opt) False will not count a hit in the cache statistics
+    #
+    # Returns - the LGL constituent ID or None if none of the external keys has been saved
+    def _find_external_id(self, external_keys, count_stats=True):
+        for external_key in external_keys:
+            cid = self._lgl.cache.get_external_id(external_key=external_key, count_stats=count_stats)
+            if cid:
+                return cid
+        return None
+
+    # This private method will tell if a donor's ID is an exact match.  LglApi.find_constituent_id only saves an ID
+    # in the cache for the donor's name and email when exactly one constituent matched without leaving part of the
+    # name out, so the ID is exact if it is the one in the cache.
+    #
+    # Args -
+    #   lookup - the donor's (name, email)
+    #   cid - the LGL ID found for the donor
+    #
+    # Returns - True if the ID matched exactly
+    def _is_exact_match(self, lookup, cid):
+        (name, email) = lookup
+        if not cid:
+            return False
+        cached_id = self._lgl.cache.get_constituent_id(name=name, email=email if _has_value(email) else None,
+                                                       count_stats=False)
+        return str(cached_id) == str(cid)
+
+    # This private method will start looking up a donor unless a lookup for the same key and source was already
+    # started.  The source is part of the lookup key because the searches and the not-found cache depend on it.
+    #
+    # Returns - the Future for the lookup
+    def _start_lookup(self, key, name, email, file_name, source):
+        lookup_key = (source, key)
+        with self._lock:
+            if lookup_key in self._lookups:
+                return self._lookups[lookup_key]
+            future = self._executor.submit(self._lgl.find_constituent_id, name=name,
+                                           email=email if _has_value(email) else None,
+                                           file_name=file_name, source=source)
+            self._lookups[lookup_key] = future
+        # The callback runs right away if the lookup is already done, so it is added after the lock is released.
+        future.add_done_callback(lambda done: self._forget_failed_lookup(lookup_key=lookup_key, future=done))
+        return future
+
+    # This private method forgets a lookup that ended with an exception, so that a later file looks the donor up
+    # again instead of getting the same exception.
+    def _forget_failed_lookup(self, lookup_key, future):
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                if self._lookups.get(lookup_key) is future:
+                    del self._lookups[lookup_key]
+
+
+# This private function checks that a name or email actually has something in it.  Empty cells in the input files
+# can show up as None, '' or 'nan'.
+def _has_value(value):
+    return bool(value) and str(value).strip() != '' and str(value) != cc.EMPTY_CELL
@@ -4,17 +4,23 @@
 
 import getopt
 import logging
+import multiprocessing
 import sys
 import pandas
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import column_constants as cc
 import display_data
 import donor_gui
 import donor_file_reader_factory
+import donor_table
+import lgl_api
+import lgl_call_planner
+import lgl_csv_writer
 import sample_data as sample
 
-VERSION = "5.4"
+VERSION = "5.5"
 # Version History:
 # 1 - initial release
 # 1.1 - Bug fix where donor_etl.append_data did not properly append data that was in the input array, but not the
@@ -64,6 +70,58 @@ VERSION = "5.4"
 # 5.2 - Issue 21: Add new Stripe column "Taxes on Fee".
 # 5.3 - Issue 22: Stripe added 5 new metadata columns.
 # 5.4 - Issues 23 & 24: Correct QB title mgmt and new Stripe columns
+# 5.5 - Performance improvements for calls to LGL:
+#       - Constituent IDs are saved in a cache file so repeat donors don't need calls to LGL.  Use --clear_cache
+#         to empty it.
+#       - All calls to LGL share one keep-alive HTTP session and the properties file is only read once.
+#       - The donors in each file are looked up at the same time by a pool of threads (constituent_resolver.py).
+#       - A local copy of LGL's constituents can be made with --sync_mirror.  Names, emails, and addresses are then
+#         checked against it instead of calling LGL.  Later syncs only copy the constituents that changed.
+#       - Names that don't exactly match the mirror are matched with a fuzzy/phonetic name index (name_index.py).
+#         The best match, and the best of several constituents found by a search, are suggested in the messages.
+#         They are only used as the donor's ID if fuzzy_match is turned on in the search section.
+#       - Names are parsed once (name_parser.py) into the search terms most likely to find them in LGL, so fewer
+#         searches are made before one finds the donor.
+#       - The searches that find donors are counted for each source (lgl_search_stats.py).  The counts decide the
+#         order of the searches and which searches are skipped, and they are shown at the end of each run.  A skipped
+#         search is still tried for a few donors (explore_rate) in case it starts finding them again.
+#       - Donors that are not found in LGL are remembered for a few days, so they aren't searched for again in every
+#         file.  Use --clear_not_found (or the checkbox in the GUI) after adding them to LGL.  Donors are only
+#         remembered if every search for them worked.
+#       - Donors are also saved by the IDs their source uses for them (Stripe customer and user IDs, Fidelity giving
+#         account names, Benevity and YourCause emails), so repeat donors are found without a search.  Only
+#         donors that matched exactly one constituent are saved, and they are kept for external_ttl_days.
+#       - Calls to LGL that fail because LGL is busy are retried with a growing wait (lgl_retry.py).  If LGL keeps
+#         failing, the calls are paused instead of ending the program.
+#       - The LglCallTracker was replaced by a thread-safe sliding window rate limiter (lgl_rate_limiter.py) that only
+#         waits as long as needed to stay under LGL's call limit.
+#       - Copies of donor_etl that run at the same time (like the GUI and the command line) share LGL's call limit
+#         through a ledger file (lgl_call_ledger.py).
+#       - The calls made in the last 5 minutes are saved when the program ends, so a run that is started again right
+#         away doesn't go over LGL's call limit.
+#       - The calls to LGL and the time they should take are shown before the run starts (lgl_call_planner.py).  Use
+#         --dry-run (or the "Dry run" box in the GUI) to stop after the plan.
+#       - The output file is written as soon as the LGL IDs are found.  Stripe's recurring donation lookups and the
+#         variance checks are done afterwards and their calls wait for the searches (lgl_call_scheduler.py).
+#       - Benevity and YourCause files are loaded in one pass through a DataFrame instead of looking up every row and
+#         column.  Big files load much faster and rows that are exactly the same are no longer merged.
+#       - Stripe Excel and CSV files share one pass that skips failed and refunded rows, cleans up the description,
+#         and splits the mailing address while the donor data is built.
+#       - Only the first line of a CSV file is read to find its reader, and the reader gets the rows one at a time.
+#       - Excel files are read with openpyxl and only the columns that Fidelity and Stripe use are loaded.
+#       - QuickBooks deposit detail sheets are parsed a column at a time instead of a cell at a time.  A deposit that
+#         comes right after another one's checks is no longer skipped.
+#       - The mapped data is kept in a DonorTable (donor_table.py) backed by a pandas DataFrame instead of dicts of
+#         dicts.  Columns with only a few different values are stored as categories.  QuickBooks memos are no longer
+#         lost when the files are merged.
+#       - The output of all the files is merged in one pass (donor_table.merge) instead of two files at a time.
+#       - The input files are read at the same time by a pool of processes and their fields are mapped at the same
+#         time by threads that share the constituent resolver.  The pool is only used when the files add up to
+#         min_parallel_mb, and the log records of the processes are written to the same log file.  The "ingest"
+#         section of the properties file can turn this off.
+#       - The output file is written a chunk of rows at a time instead of as one big string.  It is synced to the disk
+#         and written to a temporary file that replaces the output file when it is done, so an error doesn't leave
+#         half a file.  See the "output" section of the properties file.
 
 # The log object needs to be created here for use in this module.  The setup_logger function can configure it later.
 log = logging.getLogger()
@@ -102,6 +160,12 @@ def usage():
     print('If -o is not specified, the output file will be "lgl.csv".')
     print('If -v is not specified, the physical and email address variance code will not run.')
     print('\nFor --test, the args are "fid", "ben", "stripe", "qb", or "yc".  "--testall" runs everything.')
+    print('--clear_cache empties the constituent ID cache before the input files are processed.')
+    print('--clear_not_found forgets the donors that were not found in LGL so they are searched for again.')
+    print('--sync_mirror copies the constituents that changed in LGL to the local mirror before the input files are ' +
+          'processed.')
+    print('--dry-run reads the input files and shows the number of LGL calls and the time the run should take, ' +
+          'without calling LGL or creating the output file.')
 
 
 # Get the input files, output file (if there is one), and variance_file (if there is one) from the command line
@@ -110,11 +174,16 @@ def main(argv):
     input_files = []
     output_file = ''
     variance_file = ''
+    clear_cache = False
+    clear_not_found = False
+    sync_mirror = False
+    dry_run = False
     # noinspection PyBroadException
     try:
         opts, args = getopt.getopt(argv,
                                    'hi:o:v:,',
-                                   ['input_file=', 'output_file=', 'variance_file=', 'test=', 'testall'])
+                                   ['input_file=', 'output_file=', 'variance_file=', 'test=', 'testall',
+                                    'clear_cache', 'clear_not_found', 'sync_mirror', 'dry-run'])
     except Exception:
         usage()
         sys.exit(2)
@@ -143,6 +212,14 @@ def main(argv):
             output_file = arg
         elif opt in ('-v', '--variance_file'):
             variance_file = arg
+        elif opt == '--clear_cache':
+            clear_cache = True
+        elif opt == '--clear_not_found':
+            clear_not_found = True
+        elif opt == '--sync_mirror':
+            sync_mirror = True
+        elif opt == '--dry-run':
+            dry_run = True
 
     # Default the output file to "lgl.csv" if it wasn't specified.
     if not output_file:
@@ -151,7 +228,17 @@ def main(argv):
     log.debug('The input files are "{}".'.format(input_files))
     log.debug('The output file is "{}".'.format(output_file))
     log.debug('The variance file is "{}".'.format(variance_file))
-    reformat_data(input_files=input_files, output_file=output_file, variance_file=variance_file)
+    if clear_cache:
+        log.info(dd.save('The constituent ID cache is being cleared.'))
+        lgl_api.get_lgl_api().cache.clear()
+    if clear_not_found:
+        log.info(dd.save('The donors that were not found in LGL will be searched for again.'))
+        lgl_api.get_lgl_api().cache.clear_not_found()
+    if sync_mirror:
+        lgl = lgl_api.get_lgl_api()
+        count = lgl.mirror.sync(lgl=lgl)
+        log.info(dd.save('{} constituent(s) were copied from LGL to the local mirror.'.format(count)))
+    reformat_data(input_files=input_files, output_file=output_file, variance_file=variance_file, dry_run=dry_run)
 
 
 # This function runs the donor GUI and calls the reformat_data function with the user input.
@@ -159,140 +246,188 @@ def run_gui():
     gui = donor_gui.DonorGui()
     values = gui.main_form(version=VERSION)
     input_files = values['input_files'].split('\n')
-    reformat_data(input_files=input_files, output_file=values['output_file'], variance_file=values['variance_file'])
+    if values['clear_not_found']:
+        log.info(dd.save('The donors that were not found in LGL will be searched for again.'))
+        lgl_api.get_lgl_api().cache.clear_not_found()
+    reformat_data(input_files=input_files, output_file=values['output_file'], variance_file=values['variance_file'],
+                  dry_run=values['dry_run'])
     gui.display_popup(dd.messages)
 
 
-# This function manages the reformatting process for the data.  It does this by looping through each input file,
-# getting the right DonorFileReader, mapping that file's data, merging it all into the final result, and writing
-# all the data to a CSV file.
+# This function manages the reformatting process for the data.  It does this by reading each input file with the
+# right DonorFileReader, planning the calls to LGL for all the files (see lgl_call_planner.py), mapping each file's
+# data, merging it all into the final result, and writing all the data to a CSV file.  The calls that the CSV file
+# doesn't need, like the recurring donation lookups and the variance checks, are made after the file is written.
+#
+# Args -
+#   input_files - a list of the input files
+#   output_file - the name of the CSV file to create
+#   variance_file - the name of the variance file.  If it is empty, the variances are not checked.
+#   dry_run - (opt) True will stop after the calls to LGL have been planned
 #
 # Returns - none
 # Side Effects - The output file is created and populated.
-def reformat_data(input_files, output_file, variance_file):
+def reformat_data(input_files, output_file, variance_file, dry_run=False):
     log.info('The input files are "{}"\nThe output file is "{}"\nThe variance file is "{}"'.
              format(', '.join(input_files), output_file, variance_file))
 
-    final_output = {}
-    donor_file_reader = None
-    for input_file in input_files:
-        try:
-            donor_file_reader = donor_file_reader_factory.get_file_reader(file_path=input_file)
-            if not donor_file_reader:
-                continue
-            donor_file_reader.variance_file = variance_file
-
-        except ValueError:
+    # The files are read at the same time by a pool of processes unless the "ingest" settings turn it off.
+    lgl = lgl_api.get_lgl_api()
+    max_processes = 1
+    if lgl.config.getboolean('ingest', 'parallel', fallback=True):
+        max_processes = lgl.config.getint('ingest', 'max_processes',
+                                          fallback=donor_file_reader_factory.DEFAULT_MAX_PROCESSES)
+    min_parallel_mb = lgl.config.getfloat('ingest', 'min_parallel_mb',
+                                          fallback=donor_file_reader_factory.DEFAULT_MIN_PARALLEL_MB)
+    donor_file_readers = []
+    for (input_file, donor_file_reader, error) in donor_file_reader_factory.get_file_readers(
+            file_paths=input_files, max_processes=max_processes, min_parallel_mb=min_parallel_mb):
+        if error:
             log.error(dd.error('The file "{}" can not be read.  Only "xlsx" and "csv" files can be used.\n' +
                                'Please note that Fidelity, Stripe, and QB are expected to be Excel files, ' +
                                'while Benevity and YourCause are expected to be CSV files.'.
                                format(input_file)))
             continue
-        try:
-            output = donor_file_reader.map_fields()
-        except NameError:
-            log.error(dd.error('No field containing a donor name was found in the file, "{}", so it is not possible '
-                               'to look up LGL IDs.  This may not be a valid input file.'.format(input_file)))
+        if not donor_file_reader:
             continue
-        final_output = append_data(input_data=output, current_data=final_output)
+        donor_file_reader.variance_file = variance_file
+        donor_file_readers.append(donor_file_reader)
+
+    # Show how many calls to LGL the run needs before any are made.
+    plan = lgl_call_planner.make_plan(file_readers=donor_file_readers, check_variances=bool(variance_file))
+    log.info(dd.save(plan.get_message()))
+    if dry_run:
+        log.info(dd.save('This is a dry run, so LGL was not called and the output file "{}" was not created.'.format(
+            output_file)))
+        return
 
-    if final_output == {}:
+    # First pass: find the LGL IDs and write the output file.  These are the calls the output file needs.
+    outputs = _map_fields(donor_file_readers=donor_file_readers)
+
+    if sum(len(output) for (_, output) in outputs) == 0:
         log.error(dd.error('No data was successfully processed.  The output file "{}" will not be created.'.
                            format(output_file)))
         return
+    _write_output_file(outputs=outputs, output_file=output_file)
+
+    # Second pass: add the information that needs more calls to LGL (like Stripe's recurring donations) and write
+    # the output file again if anything changed.
+    changed = False
+    for (donor_file_reader, output) in outputs:
+        changed = donor_file_reader.enrich_output(output_data=output) or changed
+    if changed:
+        _write_output_file(outputs=outputs, output_file=output_file)
+
+    # Match the addresses in the input files to what's in LGL.  This is the only step that needs the merged output.
+    donor_file_reader = outputs[-1][0]
+    donor_file_reader.verify_donor_info(donor_info=_merge_outputs(outputs=outputs))
+    if lgl_api.cache:
+        log.info(dd.save(lgl_api.cache.get_stats_message()))
+        log.info(dd.save(lgl_api.get_lgl_api().search_stats.get_report()))
+        log.info(dd.save(lgl_api.get_lgl_api().retry_policy.get_stats_message()))
+        log.info(dd.save(lgl_api.rate_limiter.get_stats_message()))
+        log.info(dd.save(lgl_api.scheduler.get_stats_message()))
 
-    # Make sure all the Gift Dates are Pandas Timestamps.
-    for data_key in final_output[cc.LGL_GIFT_DATE]:
-        gift_date = final_output[cc.LGL_GIFT_DATE][data_key]  # Just making the IF more readable
-        if gift_date and type(gift_date) != pandas.Timestamp:
-            final_output[cc.LGL_GIFT_DATE][data_key] = pandas.Timestamp(final_output[cc.LGL_GIFT_DATE][data_key])
-    # Write the CSV file.  Laziest way is to convert the output to a Pandas data frame especially since the dict
-    # format is based on the pandas data frame object.
-    output_df = pandas.DataFrame(final_output)
-    output_file = open(output_file, 'w')
-    output_file.write(output_df.to_csv(index=False, line_terminator='\n'))
-    # Match the addresses in the input files to what's in LGL.
-    donor_file_reader.verify_donor_info(donor_info=final_output)
-
-
-# This function will append the data from the last file read to the existing output data.  Both the input and current
-# data will be dicts with the same format:
-#
-#   {'label1': {0: 'l1value0', 1: 'l1value1', ...},
-#    'label2': {0: 'l2value0', 1: 'l2value1', ...},
-#    ...}
+
+# ----- P R I V A T E   M E T H O D S ----- #
+
+# This private method will map the fields of all the files at the same time, one thread for each file.  The threads
+# share the ConstituentResolver (see constituent_resolver.py), so a donor that is in more than one file is only looked
+# up once and all the calls to LGL share one call budget.  The outputs are in the same order as the files.
 #
-# Note that the number of items in the inner dict for each label will be the same -- if label1's inner dict has
-# 10 values, all labels' inner dicts will have 10 values.
+# Args -
+#   donor_file_readers - the DonorFileReader objects for the input files
 #
-# The goal here is that all of the labels will be included.  If the label is the same in both the input and current
-# data, then the input data will be appended to the end of the current data.  If the input label is not in the
-# current data, then empty values will be added for the current data and the input data will be appended under them.
+# Returns - a list of (donor_file_reader, output_data) tuples.  Files whose fields can't be mapped are left out.
+def _map_fields(donor_file_readers):
+    outputs = []
+    if not donor_file_readers:
+        return outputs
+    with ThreadPoolExecutor(max_workers=len(donor_file_readers), thread_name_prefix='map_fields') as executor:
+        futures = [(donor_file_reader, executor.submit(donor_file_reader.map_fields))
+                   for donor_file_reader in donor_file_readers]
+        for (donor_file_reader, future) in futures:
+            try:
+                outputs.append((donor_file_reader, future.result()))
+            except NameError:
+                log.error(dd.error('No field containing a donor name was found in the file, "{}", so it is not '
+                                   'possible to look up LGL IDs.  This may not be a valid input file.'.format(
+                                       donor_file_reader.input_file)))
+    return outputs
+
+
+# This private method will merge the output of each file into one set of output data (see donor_table.merge).  The
+# outputs aren't changed, so they can be merged again after they have been enriched.
 #
-# Args:
-#   input_data - the data from the last file read
-#   current_data - the merged data from prior files
+# Args -
+#   outputs - a list of (donor_file_reader, output_data) tuples
 #
-# Returns:
-#   a dict with all the input data correctly appended.  The format will be the same as described above.
-def append_data(input_data, current_data):
-    final_data = current_data
-    if not current_data:
-        return input_data  # Return the input data if this is the first time.
-
-    # Append the data from the input_data to the final_data.  For each new label in input_data, populate the
-    # existing inner dicts with empty values.
-    current_count = _get_data_len(data=current_data)
-    input_count = _get_data_len(data=input_data)
-    total_count = current_count + input_count
-
-    current_labels = current_data.keys()
-    input_labels = input_data.keys()
-    # Make dicts of empty values that are the length of the current data and the input data.
-    current_extra_keys = list(range(0, current_count))
-    current_empty_data = {}.fromkeys(current_extra_keys, '')
-    input_extra_keys = list(range(current_count, current_count + input_count))
-    input_empty_data = {}.fromkeys(input_extra_keys, '')
-
-    for input_label in input_labels:
-        if input_label not in current_labels:
-            # Got a new label, so populate existing rows with blanks.
-            final_data[input_label] = {}
-            final_data[input_label].update(current_empty_data)
-
-        # Append the input_data to final_data.  Remember that we're extending the inner dict, not a list.
-        new_index = current_count
-        input_data_keys = input_data[input_label]
-        for input_data_key in input_data_keys:
-            final_data[input_label][new_index] = input_data[input_label][input_data_key]
-            new_index += 1
-
-    # Make sure any labels in the final dict, but not in the input dict, have the correct number of values.
-    for label in final_data.keys():
-        value_count = len(final_data[label].keys())
-        if value_count != total_count:
-            final_data[label].update(input_empty_data)
-    return final_data
-
+# Returns - the merged DonorTable.  It is empty if there are no outputs.
+def _merge_outputs(outputs):
+    return donor_table.merge(tables=[output for (_, output) in outputs])
 
-# ----- P R I V A T E   M E T H O D S ----- #
 
-# This private method will find the length of a set of input data.  The input data is expected to be in the format:
+# This private method will write the output data to the CSV file that is imported into LGL.  The output of each file
+# is written straight from its table, a chunk of rows at a time, in the same order and with the same columns as the
+# merged output (see lgl_csv_writer.py).  The settings in the optional "output" section of the properties file decide
+# whether the file is written to a temporary file first and how many rows are in each chunk.
 #
-#   {'label1': {0: 'l1value0', 1: 'l1value1', ...},
-#    'label2': {0: 'l2value0', 1: 'l2value1', ...},
-#    ...}
+# Args -
+#   outputs - a list of (donor_file_reader, output_data) tuples
+#   output_file - the name of the CSV file
 #
-# Args - data - the input_data as defined above
+# Side Effects - The output file is created or replaced.  The gift dates in the outputs are changed to Timestamps.
+def _write_output_file(outputs, output_file):
+    tables = [output for (_, output) in outputs]
+    config = lgl_api.get_lgl_api().config
+    with lgl_csv_writer.LglCsvWriter(output_file=output_file, columns=donor_table.get_merged_columns(tables=tables),
+                                     atomic=config.getboolean('output', 'atomic', fallback=True),
+                                     chunk_rows=config.getint('output', 'chunk_rows',
+                                                              fallback=lgl_csv_writer.CHUNK_ROWS)) as writer:
+        for table in tables:
+            _convert_gift_dates(table=table)
+            writer.write_table(table=table)
+
+
+# This private method will make sure all the gift dates in a table are pandas Timestamps.  Each different date is only
+# converted once.  The column is kept as datetime64 so that the CSV file gets just the date (2022-01-18), not the
+# date and time.  Empty dates stay empty.
 #
-# Returns - the length of the data
-def _get_data_len(data):
-    first_label = next(iter(data))  # Get the first label from data
-    data_count = len(data[first_label].keys())  # Number of values in data
-    return data_count
-
+# Args -
+#   table - the DonorTable from map_fields for one file.  It is changed in place.
+def _convert_gift_dates(table):
+    if cc.LGL_GIFT_DATE not in table:
+        return
+    gift_dates = table.get_column(column=cc.LGL_GIFT_DATE)
+    timestamps = {gift_date: pandas.Timestamp(gift_date) for gift_date in gift_dates.unique()
+                  if gift_date and type(gift_date) != pandas.Timestamp}
+    gift_dates = gift_dates.map(lambda date: timestamps.get(date, date) if date else pandas.NaT)
+    table.set_column(column=cc.LGL_GIFT_DATE, values=pandas.to_datetime(gift_dates), dtype=None)
+
+
+# Test that the gift dates are written to the CSV file without a time.
+def run_convert_gift_dates_test():
+    import os
+    import tempfile
+    table = donor_table.DonorTable.from_columns({cc.LGL_GIFT_DATE: {0: '1/18/2022', 1: pandas.Timestamp('2022-01-20'),
+                                                                    2: ''},
+                                                 'Gift note': {0: 'a', 1: 'b', 2: 'c'}})
+    _convert_gift_dates(table=table)
+    output_file = os.path.join(tempfile.mkdtemp(), 'lgl.csv')
+    with lgl_csv_writer.LglCsvWriter(output_file=output_file, columns=table.get_columns()) as writer:
+        writer.write_table(table=table)
+    with open(output_file) as csv_file:
+        lines = csv_file.read().splitlines()
+    expected = [cc.LGL_GIFT_DATE + ',Gift note', '2022-01-18,a', '2022-01-20,b', ',c']
+    if lines == expected:
+        log.debug('The gift dates were written as {}.'.format(lines[1:]))
+    else:
+        log.error('The gift dates were written as {} instead of {}.'.format(lines, expected))
 
 if __name__ == '__main__':
+    # The input files are read by a pool of processes.  This has to come first so that the processes started by the
+    # exe made by pyinstaller (see build.bat) read their file instead of starting the program again.
+    multiprocessing.freeze_support()
     setup_logger()
     log.info(dd.save("{} Version: {}".format(sys.argv[0], VERSION)))
 
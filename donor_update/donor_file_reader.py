@@ -6,11 +6,15 @@ import logging
 import os
 import time
 
+import pandas
 from configparser import ConfigParser
 
 import column_constants as cc
 import constituent_data_validator as cdv_module
+import constituent_resolver
 import display_data
+import donor_table
+import lgl_cache
 
 SAMPLE_FILE_BENEVITY = 'sample_files\\benevity.csv'
 SAMPLE_FILE_FIDELITY = 'sample_files\\2022fidelity.xlsx'
@@ -34,6 +38,14 @@ class DonorFileReader:
 
     # ---------- Start code ---------- #
 
+    # The name of the source of the donor files read by this class.  It is used to keep statistics about which LGL
+    # searches find the donors from each source (see lgl_search_stats.py).  Each subclass sets its own name.
+    SOURCE_NAME = 'Unknown'
+    # Readers of Excel files can load only the columns they use (see get_input_columns).  The columns in the map
+    # that aren't ignored are always loaded.  EXTRA_INPUT_COLUMNS are the ignored columns that the reader still uses.
+    LOAD_USED_COLUMNS_ONLY = False
+    EXTRA_INPUT_COLUMNS = []
+
     def __init__(self):
         self._input_data = {}
         self.donor_data = {}
@@ -80,27 +92,84 @@ class DonorFileReader:
     def get_map(self):
         raise NotImplementedError
 
-    # This method will get the LGL ID based on the name of the constituent.
+    # This method will get the columns to load from an Excel file.  Columns that are marked IGNORE_FIELD in the map
+    # are skipped unless they are in EXTRA_INPUT_COLUMNS.
+    #
+    # Returns - a list of column names or None to load every column
+    def get_input_columns(self):
+        if not self.LOAD_USED_COLUMNS_ONLY:
+            return None
+        used_columns = [column for (column, lgl_column) in self.get_map().items() if lgl_column != cc.IGNORE_FIELD]
+        return used_columns + list(self.EXTRA_INPUT_COLUMNS)
+
+    # This method will get the names and email addresses used to find the LGL IDs of the donors.
     # This method must be implemented by each subclass.
     #
-    # Returns - a dict of LGL IDs.  The keys of the dict will match the names found by get_donor_names and will
+    # Returns - a dict in the format: {0: (name_1, email_1), 1: (name_2, email_2), ...}.  The email may be None.
+    def get_constituent_lookups(self):
+        raise NotImplementedError
+
+    # This method will get the IDs that the source uses for its donors, like a Stripe customer ID.  Once a donor is
+    # found in LGL, these IDs are saved so that the donor can be found without a search next time.  Subclasses whose
+    # files have IDs for the donors should override this method.
+    #
+    # Returns - a dict in the format: {0: [external_key_1, ...], 1: [...], ...}.  The keys are made by
+    #   lgl_cache.make_external_key.  Rows without IDs can be left out.
+    def get_external_keys(self):
+        return {}
+
+    # This method will count the extra calls to LGL that map_fields makes after the donors have been found, like the
+    # calls Stripe makes to look for recurring donations.  It is used to plan a run (see lgl_call_planner.py).
+    # Subclasses that make extra calls should override this method.
+    #
+    # Returns - the number of calls
+    def count_extra_lgl_calls(self):
+        return 0
+
+    # This method will get the LGL ID based on the name of the constituent.  The names and emails come from
+    # get_constituent_lookups and they are all looked up together by the ConstituentResolver.  Donors with saved
+    # external keys (see get_external_keys) are found without a search.
+    #
+    # Returns - a dict of LGL IDs.  The keys of the dict will match the keys from get_constituent_lookups and will
     #   be in the format: {0: id_1, 1: id_2, ...}
     def get_lgl_constituent_ids(self):
-        raise NotImplementedError
+        log.debug('Entering')
+        resolver = constituent_resolver.get_resolver()
+        return resolver.resolve(lookups=self.get_constituent_lookups(), file_name=self.input_file,
+                                source=self.SOURCE_NAME, external_keys=self.get_external_keys())
+
+    # This method will make the external keys for the donors from columns in self.donor_data.  It is used by the
+    # subclasses to implement get_external_keys.
+    #
+    # Args -
+    #   columns - the names of the columns that have IDs for the donors.  Columns that aren't in the file are skipped.
+    #
+    # Returns - a dict in the format: {0: [external_key_1, ...], 1: [...], ...}
+    def _get_external_keys_from_columns(self, columns):
+        external_keys = {}
+        for column in columns:
+            for index, value in self.donor_data.get(column, {}).items():
+                external_key = lgl_cache.make_external_key(source=self.SOURCE_NAME, key_name=column, value=value)
+                if external_key:
+                    external_keys.setdefault(index, []).append(external_key)
+        return external_keys
 
     # This method will map fields based on self.donor_data.
     #
     # The goal is to modify the names of the outer keys.  In the self.donor_data sample data, "Recommended By" is
     # ignored (it is not included in the final output) and "Grant Id" is changed to "External gift ID".  The inner dict
-    # (with keys 0, 1, ...) is unchanged.
+    # (with keys 0, 1, ...) becomes the row indexes of the table.
     #
-    # Returns - a dict in the form:
+    # Returns - a DonorTable (see donor_table.py) with the columns:
     #   {'External gift ID': {0: 17309716, 1: 17319469, ...},
     #    'Gift date': {0: '1/18/2022', 1: '1/20/2022', ...}, ...
     def map_fields(self):
         log.debug('Entering')
+        # The IDs are found first because finding them can fill in missing names in self.donor_data (like Fidelity's
+        # giving account name), and the table below is a copy of it.
+        constituent_ids = self.get_lgl_constituent_ids()
         input_keys = self.donor_data.keys()
-        output_data = {}
+        output_columns = {}
         field_map = self.get_map()
         for input_key in input_keys:
             if input_key not in field_map.keys():
@@ -111,26 +180,37 @@ class DonorFileReader:
                 log.debug('Ignoring key "{}".'.format(input_key))
                 continue
             log.debug('The input key "{}" is being replaced by "{}"'.format(input_key, output_key))
-            output_data[output_key] = self.donor_data[input_key]
-        # Clean up campaign names if they are there.
-        if cc.LGL_CAMPAIGN_NAME in output_data.keys():
-            campaigns = output_data[cc.LGL_CAMPAIGN_NAME]
-            for index in campaigns.keys():
-                campaign = self._clean_campaign(description=str(campaigns[index]))
-                output_data[cc.LGL_CAMPAIGN_NAME][index] = campaign
-        constituent_ids = self.get_lgl_constituent_ids()
-        output_data[cc.LGL_CONSTITUENT_ID] = constituent_ids
+            output_columns[output_key] = self.donor_data[input_key]
+        output_data = donor_table.DonorTable.from_columns(columns=output_columns)
+        # Clean up campaign names if they are there.  Each different description is only cleaned once.
+        if cc.LGL_CAMPAIGN_NAME in output_data:
+            descriptions = output_data.get_column(column=cc.LGL_CAMPAIGN_NAME).map(str)
+            campaigns = {description: self._clean_campaign(description=description)
+                         for description in descriptions.unique()}
+            output_data.set_column(column=cc.LGL_CAMPAIGN_NAME, values=descriptions.map(campaigns))
+        output_data.set_column(column=cc.LGL_CONSTITUENT_ID, values=constituent_ids)
         # Fill out the gift type and category
-        indexes = output_data[cc.LGL_CONSTITUENT_ID].keys()
-        output_data[cc.LGL_GIFT_TYPE] = dict.fromkeys(indexes, 'Gift')
-        output_data[cc.LGL_GIFT_CATEGORY] = dict.fromkeys(indexes, 'Donation')
+        output_data.set_column(column=cc.LGL_GIFT_TYPE, values='Gift')
+        output_data.set_column(column=cc.LGL_GIFT_CATEGORY, values='Donation')
         return output_data
 
+    # This method will add information to the mapped data that needs more calls to LGL after the donors have been
+    # found, like Stripe's recurring donations.  It is called after the output file has been written the first time
+    # so that the calls the output file needs are made first (see lgl_call_scheduler.py).  Subclasses that add
+    # information should override this method.
+    #
+    # Args -
+    #   output_data - the DonorTable from map_fields for this file.  It is changed in place.
+    #
+    # Returns - True if output_data was changed
+    def enrich_output(self, output_data):
+        return False
+
     # This method will call the donor verification method or addresses, names, and any other info being verified
     # for all the donors in the input files.
     #
     # Args -
-    #   donor_info - the output from map_fields (from all input files)
+    #   donor_info - the DonorTable from map_fields (from all input files)
     #
     # Properties -
     #   Uses the verify_names property to determine if names will be verified.
@@ -142,14 +222,16 @@ class DonorFileReader:
         if not self.variance_file:
             log.info(dd.save('No variance file was given, so no variance checking will be done.'))
             return
-        lgl_ids = donor_info[cc.LGL_CONSTITUENT_ID]
-        address_1 = self._get_value(key=cc.LGL_ADDRESS_LINE_1_DNI, donor_info=donor_info, key_list=lgl_ids.keys())
-        address_2 = self._get_value(key=cc.LGL_ADDRESS_LINE_2_DNI, donor_info=donor_info, key_list=lgl_ids.keys())
-        address_3 = self._get_value(key=cc.LGL_ADDRESS_LINE_3_DNI, donor_info=donor_info, key_list=lgl_ids.keys())
-        city = self._get_value(key=cc.LGL_CITY_DNI, donor_info=donor_info, key_list=lgl_ids.keys())
-        state = self._get_value(key=cc.LGL_STATE_DNI, donor_info=donor_info, key_list=lgl_ids.keys())
-        postal_code = self._get_value(key=cc.LGL_POSTAL_CODE_DNI, donor_info=donor_info, key_list=lgl_ids.keys())
-        email = self._get_value(key=cc.LGL_EMAIL_ADDRESS_DNI, donor_info=donor_info, key_list=lgl_ids.keys())
+        lgl_ids = donor_info.get_column(column=cc.LGL_CONSTITUENT_ID).fillna('')
+        address_1 = donor_info.get_column(column=cc.LGL_ADDRESS_LINE_1_DNI)
+        address_2 = donor_info.get_column(column=cc.LGL_ADDRESS_LINE_2_DNI)
+        address_3 = donor_info.get_column(column=cc.LGL_ADDRESS_LINE_3_DNI)
+        city = donor_info.get_column(column=cc.LGL_CITY_DNI)
+        state = donor_info.get_column(column=cc.LGL_STATE_DNI)
+        postal_code = donor_info.get_column(column=cc.LGL_POSTAL_CODE_DNI)
+        email = donor_info.get_column(column=cc.LGL_EMAIL_ADDRESS_DNI)
+        first_name = donor_info.get_column(column=cc.LGL_FIRST_NAME_DNI)
+        last_name = donor_info.get_column(column=cc.LGL_LAST_NAME_DNI)
         variance_count = 0
         cdv = cdv_module.ConstituentDataValidator()
         for index in lgl_ids.keys():
@@ -170,8 +252,8 @@ class DonorFileReader:
                                                 input_address=input_data)
             if self.verify_names:
                 success_name = cdv.validate_name_data(constituent_id=lgl_ids[index],
-                                                      first_name=str(donor_info[cc.LGL_FIRST_NAME_DNI][index]),
-                                                      last_name=str(donor_info[cc.LGL_LAST_NAME_DNI][index]))
+                                                      first_name=str(first_name[index]),
+                                                      last_name=str(last_name[index]))
                 success = success and success_name
             if not success:
                 variance_count += 1
@@ -183,21 +265,34 @@ class DonorFileReader:
         else:
             log.info(dd.save('No variances were found in the addresses.'))
 
-    # This private method will either retrieve data for a key from the donor info or it will return a
-    # dict with all the keys, but empty values.
+    # This private method separates the labels in a CSV file from the rows of data.  self.input_data is the row
+    # iterator from donor_file_reader_factory.read_csv_rows (or a list of rows), so the rows are only read as they
+    # are used.
     #
     # Args -
-    #   key - the key for which we are searching
-    #   donor_info - the donor_info from check_address
-    #   key_list - the list of keys used to make the default dict if the key is not in donor_info
-    #
-    # Returns - the dict value for the key
-    def _get_value(self, key, donor_info, key_list):
-        if key in donor_info:
-            value = donor_info[key]
-        else:
-            value = dict.fromkeys(key_list, '')  # Create a dict with the same keys and empty values
-        return value
+    #   label_row - (opt) the row that has the labels.  The rows before it are skipped.  Defaults to 0.
+    #
+    # Returns - a (column_labels, donor_rows) tuple.  donor_rows is an iterator of the rows after the labels.
+    def _get_csv_labels_and_rows(self, label_row=0):
+        rows = iter(self.input_data)
+        for _ in range(label_row):
+            next(rows, None)
+        column_labels = next(rows, [])
+        return column_labels, rows
+
+    # This private method will put the rows read from a CSV file into a pandas DataFrame with one column for each
+    # label.  It is done in one pass over the rows, so it takes the same time for each row no matter how big the file
+    # is.  Values past the last label are dropped and short rows are filled out with empty strings.
+    #
+    # Args -
+    #   column_labels - the labels of the columns
+    #   donor_rows - an iterable of rows.  Each row is a list of values in the same order as the labels.
+    #
+    # Returns - a DataFrame.  The index of each row is its position in donor_rows.
+    def _make_data_frame(self, column_labels, donor_rows):
+        label_count = len(column_labels)
+        donor_df = pandas.DataFrame([row[:label_count] for row in donor_rows], columns=column_labels, dtype=object)
+        return donor_df.fillna('')
 
     # This private method will take the description and clean it up for the campaign field.  The rules are:
     #   - Eliminate any description that is just the word, "donation".
@@ -236,12 +331,12 @@ def run_map_fields_test():
     abs_script_path = os.path.abspath(__file__)
     working_dir = os.path.dirname(abs_script_path)
     os.chdir(working_dir)
-    file_reader = DonorFileReader()
-    df = file_reader.read_file(file_path=SAMPLE_FILE)
+    import donor_file_reader_factory  # The factory imports the subclasses of this module.
+    file_reader = donor_file_reader_factory.get_file_reader(file_path=SAMPLE_FILE)
     output = file_reader.map_fields()
-    print('output dict:\n{}'.format(output.to_string()))
+    print('output table:\n{}'.format(output.frame.to_string()))
     output_file = open('lgl.csv', 'w')
-    output_file.write(output.to_csv(index=False, line_terminator='\n'))
+    output_file.write(output.frame.to_csv(index=False, line_terminator='\n'))
 
 
 if __name__ == '__main__':
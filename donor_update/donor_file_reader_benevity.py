@@ -6,14 +6,14 @@ import column_constants as cc
 import logging
 
 import donor_file_reader
-import lgl_api
 
 SAMPLE_FILE = 'sample_files\\benevity.csv'
 log = logging.getLogger()
 
 class DonorFileReaderBenevity(donor_file_reader.DonorFileReader):
-    # self.input_data is declared by the __init__ module of donor_file_reader.  In this module, it will be a list
-    # similar to the sample below:
+    # self.input_data is declared by the __init__ module of donor_file_reader.  In this module, it will be the rows of
+    # the CSV file, read one at a time (see donor_file_reader_factory.read_csv_rows).  The rows are similar to the
+    # sample below:
     #
     #
     # NOTE: In the latest Benevity report, the Donations section at the top and the totals at the bottom have been
@@ -57,6 +57,8 @@ class DonorFileReaderBenevity(donor_file_reader.DonorFileReader):
 
     # ----- Code Starts -----
 
+    SOURCE_NAME = 'Benevity'
+
     # The initialize_donor_data method will separate the donation data from the input_data and store it in a dict
     # called self.donor_data.  The format of the dict will be:
     #
@@ -67,44 +69,29 @@ class DonorFileReaderBenevity(donor_file_reader.DonorFileReader):
     # [['Some Company', 'DANIELS TABLE INC', '2022-01-25T19:48:48Z', 'LastName1', 'FirstName1',...],  <-- this is the
     #  ['Some Company', 'DANIELS TABLE INC', '2022-01-30T06:12:53Z', 'LastName2', 'FirstName2',...]]      data
     #
-    # To convert the input data to the final dict, we will:
-    #   1. loop through each of the data rows
-    #   2. loop through each label
-    #   3. take the index of the entire data row.  That will be the key of the row data (0, 1, 2, ...)
-    #   4. use the index of the column label.  That will be the index of the row value we are adding.
+    # The rows are put into a DataFrame with the labels as the columns (see _make_data_frame), and the DataFrame is
+    # turned into the dict.  The key of each row is its position in the data rows (0, 1, 2, ...), so for the first row
+    # of data (['Some Company', 'DANIELS TABLE INC',...) and the second label (Project):
+    #                  self.donor_data['Project'][0] = 'DANIELS TABLE INC'
     #
-    # 1. data row: ['Some Company', 'DANIELS TABLE INC', '2022-01-25T19:48:48Z', 'LastName1', 'FirstName1',...]
-    # 2. label: 'Company', 'Project', ...
-    # 3. Index of entire data row = 0
-    # 4. Index of label = 0, 1, 2...
-    # You want to set: self.donor_data[label][row_index] = row[label_index]
-    # For the first row of data (['Some Company', 'DANIELS TABLE INC',...) and the second label (Project), the row
-    # index would be 0 (first row) and the label index would be 1 (second label).  The assignment would be:
-    #                  self.donor_data['Project'][0] = row[1]
+    # This used to look up the position of every row and label with list.index(), which took longer and longer as the
+    # file got bigger and put rows that were exactly the same in the same place.
     #
     # Returns - none
     # Side Effect - the self.data_donor property is populated.
     def initialize_donor_data(self):
         log.debug('Entering')
-        # Separate the donor data from everything else (exclude the labels).
-        donor_rows = []
-        for i in range(cc.BEN_DATA_START_ROW, len(self.input_data)-1):
-            donor_rows.append(self.input_data[i])
+        # Separate the donor data from everything else (exclude the labels).  The labels are in row 0 of the
+        # input_data (row 12 in the old format).  The last row isn't donor data.
+        (column_labels, donor_rows) = self._get_csv_labels_and_rows(label_row=cc.BEN_LABEL_ROW)
+        donor_rows = _skip_last_row(rows=donor_rows)
 # These rows are for the old format where the data started at line 12 and there were totals at the end.
         # i = cc.BEN_DATA_START_ROW
         # while self.input_data[i][0] != 'Totals':
         #     donor_rows.append(self.input_data[i])
         #     i += 1
-        # Initialize the dict from labels (row 12 of the input_data).
-        column_labels = self.input_data[cc.BEN_LABEL_ROW]
-        for label in column_labels:
-            self.donor_data[label] = {}
-        # Add the donor rows to the data.
-        for row in donor_rows:  # Start with a row of donor data e.g. ['Liberty Mutual', 'DANIELS TABLE INC', ...]
-            for label in column_labels:  # Now get a label e.g. 'Company'
-                row_index = donor_rows.index(row)
-                label_index = column_labels.index(label)
-                self.donor_data[label][row_index] = row[label_index]
+        donor_df = self._make_data_frame(column_labels=column_labels, donor_rows=donor_rows)
+        self.donor_data = donor_df.to_dict()
 
     # Return the map to be used by map_keys.
     def get_map(self):
@@ -116,31 +103,45 @@ class DonorFileReaderBenevity(donor_file_reader.DonorFileReader):
     # Returns - same as original
     def map_fields(self):
         output_data = super(DonorFileReaderBenevity, self).map_fields()
-        for index in output_data[cc.LGL_GIFT_NOTE].keys():
-            if output_data[cc.LGL_GIFT_NOTE][index] and str(output_data[cc.LGL_GIFT_NOTE][index]) != 'nan':
-                output_data[cc.LGL_GIFT_NOTE][index] = 'Employer/Organization: ' + output_data[cc.LGL_GIFT_NOTE][index]
-            else:
-                output_data[cc.LGL_GIFT_NOTE][index] = ''  # Just being sure it's not "nan"
+        gift_notes = output_data.get_column(column=cc.LGL_GIFT_NOTE).fillna('').map(str)
+        has_note = (gift_notes != '') & (gift_notes != cc.EMPTY_CELL)
+        # Notes that are empty are set to '' just to be sure they're not "nan".
+        output_data.set_column(column=cc.LGL_GIFT_NOTE,
+                               values=('Employer/Organization: ' + gift_notes).where(has_note, ''))
         return output_data
 
-    # This method will get the LGL IDs based on the name of the constituent.
+    # This method will get the names and email addresses used to find the LGL IDs of the donors.
     #
-    # Returns - a dict of LGL IDs.  The keys of the dict will be in the format: {0: id_1, 1: id_2, ...}
-    def get_lgl_constituent_ids(self):
+    # Returns - a dict in the format: {0: (name_1, email_1), 1: (name_2, email_2), ...}
+    def get_constituent_lookups(self):
         log.debug('Entering')
-        lgl = lgl_api.LglApi()
         donor_first_names = self.donor_data[cc.BEN_DONOR_FIRST_NAME]
         donor_last_names = self.donor_data[cc.BEN_DONOR_LAST_NAME]
         email_addresses = self.donor_data[cc.BEN_EMAIL]
-        lgl_ids = {}
-        names_found = {}  # This is to make the loop more efficient by remembering the IDs of names already found.
+        lookups = {}
         for index in donor_first_names.keys():
             name = donor_first_names[index] + ' ' + donor_last_names[index]
-            # If the name is found names_found, then retrieve the ID from the dict instead of making a call.
-            if name in names_found.keys():
-                cid = names_found[name]
-            else:
-                cid = lgl.find_constituent_id(name=name, email=email_addresses[index], file_name=self.input_file)
-            lgl_ids[index] = cid
-            names_found[name] = cid
-        return lgl_ids
+            lookups[index] = (name, email_addresses[index])
+        return lookups
+
+    # This method overrides the get_external_keys method in the parent class.  Benevity donors are identified by
+    # their email addresses.
+    #
+    # Returns - same as parent method
+    def get_external_keys(self):
+        return self._get_external_keys_from_columns(columns=[cc.BEN_EMAIL])
+
+
+# This private function passes on every row but the last one.  It reads one row ahead, so the rows can still be read
+# one at a time.
+#
+# Args -
+#   rows - an iterator of rows
+#
+# Returns - a generator of the rows without the last one
+def _skip_last_row(rows):
+    previous_row = None
+    for row in rows:
+        if previous_row is not None:
+            yield previous_row
+        previous_row = row
@@ -4,10 +4,39 @@
 #
 # This module uses the pandas module to read Excel files.  More can be found about pandas at the URL below.
 # https://pandas.pydata.org/pandas-docs/stable/user_guide/dsintro.html
+#
+# Excel files are read with the openpyxl engine in read only mode.  The column labels are read first to find the
+# right reader, and then only the columns that the reader uses are loaded (see DonorFileReader.get_input_columns).
+# Stripe exports have more than 80 columns, but only about a dozen of them are used.
+#
+# CSV files are not read all at once.  Only the first line (the column labels) is read to find the right reader, so a
+# file that isn't recognized is turned away right away.  The reader is then given the rows one at a time as it reads
+# them (see read_csv_rows), so a big export doesn't have to fit in memory as a list of rows.
+#
+# Reading a file and building its donor data doesn't need LGL, so several files can be read at the same time by a
+# pool of processes (see get_file_readers).  Each process reads one file at a time and sends the file reader back
+# without its raw input data.  The messages saved for the user (see display_data.py) in a process are sent back with
+# the file reader, and the log records are sent to this program's log handlers through a queue, so they end up in the
+# same log file.  Starting the processes takes a few seconds, so the pool is only used when the files add up to at
+# least min_parallel_mb megabytes.  The settings are in the optional "ingest" section of the donor_etl.properties
+# file.  An example is below:
+#
+# [ingest]
+# parallel: yes
+# max_processes: 4
+# min_parallel_mb: 20
 
+import csv
+import itertools
 import logging
+import logging.handlers
+import multiprocessing
+import os
 import pandas
-import csv
+import pickle
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import column_constants as cc
 import display_data
@@ -20,32 +49,71 @@ import donor_file_reader_yourcause as yc_reader
 
 log = logging.getLogger()
 ml = display_data.DisplayData()
+EXCEL_ENGINE = 'openpyxl'  # pandas opens the workbook read only with this engine.
+DEFAULT_MAX_PROCESSES = 4
+DEFAULT_MIN_PARALLEL_MB = 20
+BYTES_PER_MB = 1024 * 1024
 
 
-# This function reads the data from an donor data file and returns a dict of the data.  This
-# method requires the Pandas module to be installed.
+# This function reads the column labels of an Excel file without reading any of the rows.
 #
-# #### IMPORTANT NOTE: Everytime a new map and class is added, this method must be updated.
+# Args:
+#   file_path = path to the file being read
+#
+# Returns - a list of the column labels
+def read_excel_header(file_path):
+    log.debug('Entering with "{}"'.format(file_path))
+    df = pandas.read_excel(file_path, engine=_get_excel_engine(file_path=file_path), nrows=0)
+    return list(df.columns)
+
+
+# This function reads the data from an Excel file.  Only the columns that are asked for are loaded, which is much
+# faster for files with a lot of columns that aren't used.  The types of the values (numbers, dates, ...) are worked
+# out once by pandas while it reads the file.
 #
 # Args:
 #   file_path = path to the file being read
+#   columns = (opt) a list of the columns to load.  Columns that aren't in the file are skipped.  None (the default)
+#       loads every column.
 #
-# Returns - a dict containing the data from the file
-def read_file(file_path):
+# Returns - a dict in the form {column_name_1 {0: <row data>, 1: <row data>, ...}, column_name_2 ...}
+def read_excel(file_path, columns=None):
     log.debug('Entering with "{}"'.format(file_path))
-    file_path_lower = file_path.lower()
-    if file_path_lower.endswith("xlsx") or file_path_lower.endswith("xls"):
-        df = pandas.read_excel(file_path)
-        data = df.to_dict()
-    elif file_path_lower.endswith("csv"):
-        data = []
-        with open(file_path, newline='') as csvfile:
-            csv_reader = csv.reader(csvfile)
-            for row in csv_reader:
-                data.append(row)
-    else:
-        raise ValueError('The file "{}" could not be read.'.format(file_path))
-    return data
+    usecols = None
+    if columns is not None:
+        usecols = set(columns).__contains__
+    df = pandas.read_excel(file_path, engine=_get_excel_engine(file_path=file_path), usecols=usecols)
+    return df.to_dict()
+
+
+# This function reads the first rows of a CSV file without reading the rest of it.  They have the column labels that
+# are used to find the right reader.
+#
+# Args:
+#   file_path = path to the file being read
+#   row_count = (opt) the number of rows to read.  Defaults to 1.
+#
+# Returns - a list of row_count rows.  Each row is a list of strings.  If the file is shorter, the missing rows are
+#   empty lists.
+def read_csv_header(file_path, row_count=1):
+    log.debug('Entering with "{}"'.format(file_path))
+    with open(file_path, newline='') as csvfile:
+        header_rows = list(itertools.islice(csv.reader(csvfile), row_count))
+    return header_rows + [[]] * (row_count - len(header_rows))
+
+
+# This function reads the rows of a CSV file one at a time.  The file is opened when the first row is asked for and
+# closed after the last row, so only one row is in memory at a time.
+#
+# Args:
+#   file_path = path to the file being read
+#
+# Returns - a generator of rows, starting with the labels.  Each row is a list of strings.
+def read_csv_rows(file_path):
+    log.debug('Entering with "{}"'.format(file_path))
+    with open(file_path, newline='') as csvfile:
+        for row in csv.reader(csvfile):
+            yield row
 
 
 # This function will find which of the donor_file_reader classes to use.  It will use the data from the donor input
@@ -64,19 +132,46 @@ def read_file(file_path):
 def get_file_reader(file_path):
     log.debug('-------------------- Reading file, "{}" --------------------'.format(file_path))
     file_reader = ''
-    input_data = read_file(file_path=file_path)
-    # If the input file was an Excel file, the return data will be in a dict.
-    # If the input file is a CSV file, the return data will be a list.
-    # We then need to evaluate the input_data to determine the exact source of the data.  We do that by finding the
-    # column names in the input_data and comparing them to the keys of the MAP dicts in column_constants.
-    if type(input_data) == dict:
-        input_keys = input_data.keys()
+    if file_path.lower().endswith('csv'):
+        # Only the labels are read to find the reader.  The reader gets the rows as it reads them.
+        header_rows = read_csv_header(file_path=file_path,
+                                      row_count=max(cc.BEN_LABEL_ROW, cc.STRIPE_LABEL_ROW, cc.YC_LABEL_ROW) + 1)
+        input_data = read_csv_rows(file_path=file_path)
+    elif file_path.lower().endswith('xlsx') or file_path.lower().endswith('xls'):
+        # Only the labels are read to find the reader.  The columns the reader uses are read after that.
+        header_rows = None
+        input_data = None
+        input_keys = read_excel_header(file_path=file_path)
+    else:
+        raise ValueError('The file "{}" could not be read.'.format(file_path))
+    # We need to evaluate the labels to determine the exact source of the data.  We do that by comparing the column
+    # names to the keys of the MAP dicts in column_constants.
+    if header_rows is not None:
+        benevity_keys = header_rows[cc.BEN_LABEL_ROW]
+        stripe_keys = header_rows[cc.STRIPE_LABEL_ROW]
+        yc_keys = header_rows[cc.YC_LABEL_ROW]
+        if benevity_keys and set(benevity_keys) <= set(cc.BENEVITY_MAP.keys()):
+            file_reader = benevity_reader.DonorFileReaderBenevity()
+        elif stripe_keys and set(stripe_keys) <= set(cc.STRIPE_MAP.keys()):
+            file_reader = stripe_reader_csv.DonorFileReaderStripeCsv()
+        elif yc_keys and set(yc_keys) <= set(cc.YC_MAP.keys()):
+            file_reader = yc_reader.DonorFileReaderYourCause()
+        else:
+            # If we get here, then we didn't match any input.  For diagnostic purposes, compare each of the map
+            # keys to the input keys.
+            log.debug('------------------------- Benevity Comparison')
+            debug_key_compare(input_keys=benevity_keys, map_keys=cc.BENEVITY_MAP.keys())
+            log.debug('------------------------- Stripe Comparison')
+            debug_key_compare(input_keys=stripe_keys, map_keys=cc.STRIPE_MAP.keys())
+            log.debug('------------------------- YourCause Comparison')
+            debug_key_compare(input_keys=yc_keys, map_keys=cc.YC_MAP.keys())
+    else:
         if set(input_keys) <= set(cc.FIDELITY_MAP.keys()):
             file_reader = fidelity_reader.DonorFileReaderFidelity()
         elif set(input_keys) <= set(cc.STRIPE_MAP.keys()):
             file_reader = stripe_reader.DonorFileReaderStripe()
         # elif "Daniel's Table dba The Foodie Cafe" in input_keys:
-        elif "Daniel's Table" in list(input_keys)[0]:
+        elif input_keys and "Daniel's Table" in str(input_keys[0]):
             file_reader = qb_reader.DonorFileReaderQuickbooks()
         else:
             # If we get here, then we didn't match any input.  For diagnostic purposes, compare each of the map
@@ -87,30 +182,8 @@ def get_file_reader(file_path):
             debug_key_compare(input_keys=input_keys, map_keys=cc.STRIPE_MAP.keys())
             log.debug('------------------------- Quickbooks Comparison')
             debug_key_compare(input_keys=input_keys, map_keys=cc.QB_MAP.keys())
-    elif type(input_data) == list:
-        benevity_keys = input_data[cc.BEN_LABEL_ROW]
-        stripe_keys = input_data[cc.STRIPE_LABEL_ROW]
-        yc_keys = input_data[cc.YC_LABEL_ROW]
-        if set(benevity_keys) <= set(cc.BENEVITY_MAP.keys()):
-            file_reader = benevity_reader.DonorFileReaderBenevity()
-        elif set(stripe_keys) <= set(cc.STRIPE_MAP.keys()):
-            file_reader = stripe_reader_csv.DonorFileReaderStripeCsv()
-        elif set(yc_keys) <= set(cc.YC_MAP.keys()):
-            file_reader = yc_reader.DonorFileReaderYourCause()
-        else:
-            # If we get here, then we didn't match any input.  For diagnostic purposes, compare each of the map
-            # keys to the input keys.
-            log.debug('------------------------- Benevity Comparison')
-            debug_key_compare(input_keys=benevity_keys, map_keys=cc.BENEVITY_MAP.keys())
-            log.debug('------------------------- Benevity Comparison')
-            debug_key_compare(input_keys=stripe_keys, map_keys=cc.STRIPE_MAP.keys())
-            log.debug('------------------------- YourCause Comparison')
-            debug_key_compare(input_keys=yc_keys, map_keys=cc.YC_MAP.keys())
-    else:
-        error_msg = 'The data read from the file "{}" was not recognized.  This is a serious error.'.format(file_path)
-        error_msg += 'Please save this file for evaluation and contact the developer.'
-        error_msg += '\n\nYou can continue to use this program with other files.'
-        log.error(ml.error(error_msg))
+        if file_reader:
+            input_data = read_excel(file_path=file_path, columns=file_reader.get_input_columns())
 
     if file_reader:
         file_reader.input_file = file_path
@@ -124,6 +197,112 @@ def get_file_reader(file_path):
     return file_reader
 
 
+# This function will read several files and find their file readers.  If there is more than one file, max_processes
+# is more than 1, and the files add up to at least min_parallel_mb, the files are read at the same time by a pool of
+# processes, so reading several big files takes about as long as reading the biggest one.  Small files are read one at
+# a time, since that is faster than starting the processes.  The file readers are returned in the same order as the
+# files no matter which file finishes first.  If the pool can't be used, the files are read one at a time instead.
+#
+# The processes are started fresh (not forked), so they don't get a copy of the threads and open database
+# connections of this program.  The program must call multiprocessing.freeze_support() first when it is built into
+# an exe (see donor_etl.py).
+#
+# Args:
+#   file_paths = a list of the paths of the files to read
+#   max_processes = (opt) the most processes to use.  Defaults to DEFAULT_MAX_PROCESSES.
+#   min_parallel_mb = (opt) the total size of the files, in megabytes, needed to use the pool.  Defaults to
+#       DEFAULT_MIN_PARALLEL_MB.
+#
+# Returns: a list of (file_path, file_reader, error) tuples in the same order as file_paths.  file_reader is the
+#   same as for get_file_reader.  error is the ValueError raised for a file that can't be read, otherwise None.
+def get_file_readers(file_paths, max_processes=DEFAULT_MAX_PROCESSES, min_parallel_mb=DEFAULT_MIN_PARALLEL_MB):
+    log.debug('Entering with {} file(s) and up to {} process(es).'.format(len(file_paths), max_processes))
+    if len(file_paths) > 1 and max_processes > 1 and _get_total_size(file_paths=file_paths) >= \
+            min_parallel_mb * BYTES_PER_MB:
+        try:
+            results = _read_files_in_processes(file_paths=file_paths, max_processes=max_processes)
+            return [(file_path, file_reader, error) for (file_path, (file_reader, error)) in zip(file_paths, results)]
+        except (BrokenProcessPool, OSError, pickle.PicklingError) as e:
+            log.warning('The files could not be read at the same time ({}).  They will be read one at a time.'.
+                        format(e))
+    return [(file_path,) + _read_file(file_path=file_path) for file_path in file_paths]
+
+
+# This private function reads the files in a pool of processes.  The messages for the user from each process are
+# saved in the same order as the files.  The log records from the processes are given to the handlers of this
+# program's logger by a QueueListener while the pool is running.
+#
+# Returns - a list of (file_reader, error) tuples in the same order as file_paths
+def _read_files_in_processes(file_paths, max_processes):
+    process_count = min(max_processes, len(file_paths))
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *log.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(max_workers=process_count, mp_context=context, initializer=_init_process,
+                                 initargs=(log_queue, log.getEffectiveLevel())) as executor:
+            process_results = list(executor.map(_read_file_in_process, file_paths))
+    finally:
+        listener.stop()
+    results = []
+    for (file_reader, error, messages) in process_results:
+        ml.messages.extend(messages)
+        results.append((file_reader, error))
+    return results
+
+
+# This private function is run once in each process of the pool when it starts.  The process's log records are put
+# on the queue so that the QueueListener in this program writes them to its log file and console.
+def _init_process(log_queue, level):
+    process_log = logging.getLogger()
+    for handler in list(process_log.handlers):
+        process_log.removeHandler(handler)
+    process_log.addHandler(logging.handlers.QueueHandler(log_queue))
+    process_log.setLevel(level)
+
+
+# This private function adds up the size of the files.  A file that can't be found counts as empty.  It will get an
+# error when it is read.
+def _get_total_size(file_paths):
+    total_size = 0
+    for file_path in file_paths:
+        try:
+            total_size += os.path.getsize(file_path)
+        except OSError:
+            pass
+    return total_size
+
+
+# This private function is run in a process from the pool to read one file.  The raw input data isn't sent back.  It
+# has already been turned into the donor data, and the rows of a CSV file are a generator that can't be sent.
+#
+# Returns - a (file_reader, error, messages) tuple.  messages are the messages for the user saved while the file was
+#   read.
+def _read_file_in_process(file_path):
+    first_message = len(ml.messages)
+    (file_reader, error) = _read_file(file_path=file_path)
+    if file_reader:
+        file_reader.input_data = None
+    return file_reader, error, ml.messages[first_message:]
+
+
+# This private function reads one file with get_file_reader.
+#
+# Returns - a (file_reader, error) tuple.  error is the ValueError raised if the file can't be read.
+def _read_file(file_path):
+    try:
+        return get_file_reader(file_path=file_path), None
+    except ValueError as e:
+        return None, e
+
+
+# This private function picks the pandas engine for an Excel file.  openpyxl can only read the newer xlsx files, so
+# pandas picks the engine for older xls files.
+def _get_excel_engine(file_path):
+    return EXCEL_ENGINE if file_path.lower().endswith('xlsx') else None
+
+
 # This is a debugging function used to compare keys from the file input data to the map keys to see what
 # the differences are.
 #
@@ -2,9 +2,9 @@
 
 import column_constants as cc
 import logging
+import pandas
 
 import donor_file_reader
-import lgl_api
 
 SAMPLE_FILE = 'sample_files\\2022fidelity.xlsx'
 log = logging.getLogger()
@@ -19,6 +19,11 @@ class DonorFileReaderFidelity(donor_file_reader.DonorFileReader):
     # {'Recommended By': {0: 'Online at FC', 1: 'Online at FC', 2: 'Online at FC'},
     #  'Grant Id': {0: 17309716, 1: 17319469, 2: 17401868}, ...
 
+    SOURCE_NAME = 'Fidelity'
+    LOAD_USED_COLUMNS_ONLY = True
+    # These columns are ignored by the map, but they are used for the gift note and the donor's name.
+    EXTRA_INPUT_COLUMNS = [cc.FID_GRANT_ID, cc.FID_ACH_GROUP_ID, cc.FID_GIVING_ACCOUNT_NAME]
+
     # Return the map to be used by map_keys.
     def get_map(self):
         return cc.FIDELITY_MAP
@@ -30,38 +35,34 @@ class DonorFileReaderFidelity(donor_file_reader.DonorFileReader):
     def map_fields(self):
         log.debug('Entering')
         output_data = super().map_fields()
-        output_data[cc.LGL_CAMPAIGN_NAME] = {}
-        output_data[cc.LGL_PAYMENT_TYPE] = {}
-        output_data[cc.LGL_GIFT_NOTE] = {}
-        indexes = output_data[cc.LGL_CONSTITUENT_ID].keys()
-        for index in indexes:
-            output_data[cc.LGL_CAMPAIGN_NAME][index] = 'General'
-            output_data[cc.LGL_PAYMENT_TYPE][index] = 'ACH (Automated Clearing House)'
-            output_data[cc.LGL_GIFT_NOTE][index] = 'Via Fidelity Charitable.  Grant ID # ' +\
-                                                   str(self.donor_data[cc.FID_GRANT_ID][index]) +\
-                                                   '; ACH# ' +\
-                                                   str(self.donor_data[cc.FID_ACH_GROUP_ID][index])
+        output_data.set_column(column=cc.LGL_CAMPAIGN_NAME, values='General')
+        output_data.set_column(column=cc.LGL_PAYMENT_TYPE, values='ACH (Automated Clearing House)')
+        grant_ids = pandas.Series(self.donor_data[cc.FID_GRANT_ID], dtype=object).map(str)
+        ach_group_ids = pandas.Series(self.donor_data[cc.FID_ACH_GROUP_ID], dtype=object).map(str)
+        output_data.set_column(column=cc.LGL_GIFT_NOTE,
+                               values='Via Fidelity Charitable.  Grant ID # ' + grant_ids + '; ACH# ' + ach_group_ids)
         return output_data
 
-    # This method will get the LGL IDs based on the name of the constituent.
+    # This method will get the names used to find the LGL IDs of the donors.  If there is no addressee name, the
+    # giving account name is used instead.
     #
-    # Returns - a dict of LGL IDs.  The keys of the dict will be in the format: {0: id_1, 1: id_2, ...}
-    def get_lgl_constituent_ids(self):
+    # Returns - a dict in the format: {0: (name_1, None), 1: (name_2, None), ...}
+    # Side Effect - the giving account name is copied into the addressee name if the addressee name is empty.
+    def get_constituent_lookups(self):
         log.debug('Entering')
-        lgl = lgl_api.LglApi()
         donor_names = self.donor_data[cc.FID_ADDRESSEE_NAME]
-        lgl_ids = {}
-        names_found = {}  # This is to make the loop more efficient by remembering the IDs of names already found.
+        lookups = {}
         for index in donor_names.keys():
             name = str(donor_names[index]).strip()
             if not name and self.donor_data[cc.FID_GIVING_ACCOUNT_NAME][index]:
                 name = self.donor_data[cc.FID_GIVING_ACCOUNT_NAME][index]
                 self.donor_data[cc.FID_ADDRESSEE_NAME][index] = name  # Add the giving acct name into the results
-            # If the name is found names_found, then retrieve the ID from the dict instead of making a call.
-            if name in names_found.keys():
-                cid = names_found[name]
-            else:
-                cid = lgl.find_constituent_id(name=name, file_name=self.input_file)
-            lgl_ids[index] = cid
-            names_found[name] = cid
-        return lgl_ids
+            lookups[index] = (name, None)
+        return lookups
+
+    # This method overrides the get_external_keys method in the parent class.  Each Fidelity donor gives from their
+    # own giving account, so the giving account name identifies the donor.
+    #
+    # Returns - same as parent method
+    def get_external_keys(self):
+        return self._get_external_keys_from_columns(columns=[cc.FID_GIVING_ACCOUNT_NAME])
@@ -11,13 +11,12 @@
 
 import column_constants as cc
 import logging
-import re
+import pandas
 
 from configparser import ConfigParser
 
 import display_data
 import donor_file_reader
-import lgl_api
 
 SAMPLE_FILE = 'sample_files\\quickbooks.xlsx'
 COLUMN_NAME_INDEX = 3
@@ -30,6 +29,10 @@ NAME_KEY = 'Unnamed: 4'
 VENDOR_KEY = 'Unnamed: 5'
 DESC_KEY = 'Unnamed: 6'
 AMT_KEY = 'Unnamed: 8'
+DATE_PATTERN = r'\d{2}/\d{2}/\d{4}'
+# Rows with these words in the description are ignored.  The words are matched the same way str.split() finds them.
+IGNORE_WORDS = ['benevity', 'fidelity', 'stripe', 'yourcause']
+IGNORE_PATTERN = r'(?:^|\s)(?:{})(?=\s|$)'.format('|'.join(IGNORE_WORDS))
 
 log = logging.getLogger()
 ml = display_data.DisplayData()
@@ -112,6 +115,8 @@ ml = display_data.DisplayData()
 # following columns have the actual data.
 #
 class DonorFileReaderQuickbooks(donor_file_reader.DonorFileReader):
+    SOURCE_NAME = 'QuickBooks'
+
     def __init__(self):
         super().__init__()
         self.campaigns = {}
@@ -124,64 +129,49 @@ class DonorFileReaderQuickbooks(donor_file_reader.DonorFileReader):
     #
     # The format of the input data is described above in the class comments.
     #
-    # The procedure will be:
-    #   - The self.donor_data key names come from the 'Unnamed' columns index 3 (COLUMN_NAME_INDEX).
-    #   - Start index at 5 (INITIAL_DATE_INDEX).
-    #   - Loop through 'Unnamed 1' until you get to a date.
-    #   - Check in 'Unnamed 3' (check num) at index+1 for a number.
-    #       - If no number, continue looping through 'Unnamed 1' for another date
-    #       - If there is a number, gather info from other columns at that index+1:
-    #           - Date is from 'Unnamed: 1' (prior index)
-    #           - Check number is gathered from 'Unnamed: 3'
-    #           - name from 'Unnamed: 4' or 'Unnamed: 5'
-    #           - desc/campaign from 'Unnamed: 6'
-    #           - amount is from 'Unnamed: 8'
+    # The whole sheet is handled as a DataFrame, one column at a time, instead of one cell at a time:
+    #   - A deposit starts on a row with a date in 'Unnamed: 1' (DATE_KEY).  Its checks are the rows right after it
+    #     that have a number in 'Unnamed: 3' (CHECK_NUM_KEY).  The first row without a number ends the deposit.
+    #   - The deposit dates are carried down (forward filled) to the check rows.  Rows that end a deposit carry down
+    #     an empty date, so rows after them aren't part of any deposit.
+    #   - For each check row:
+    #       - the check number comes from 'Unnamed: 3' (numbers are kept, text is cleaned down to digits and hyphens)
+    #       - the name comes from 'Unnamed: 4' or, if that's empty, 'Unnamed: 5'
+    #       - the desc/campaign comes from 'Unnamed: 6'
+    #       - the amount comes from 'Unnamed: 8'
+    #   - Rows with one of the IGNORE_WORDS in the description are dropped.  Those donations come in through their
+    #     own files.
     #
     # Returns - none
     # Side Effect - the self.data_donor property is populated.
     def initialize_donor_data(self):
         log.debug('Entering')
+        sheet = pandas.DataFrame(self.input_data).iloc[INITIAL_DATE_INDEX:]
+        check_nums = sheet[CHECK_NUM_KEY]
+        dates = sheet[DATE_KEY].map(str)
+        is_date = dates.str.match(DATE_PATTERN)
+        is_check = _has_value(check_nums) & ~is_date
+        deposit_dates = dates.where(is_date).where(is_date | is_check, '').ffill()
+        is_check = is_check & deposit_dates.notna() & (deposit_dates != '')
+        desc = sheet[DESC_KEY].map(str).str.strip()
+        is_ignored = desc.str.lower().str.contains(IGNORE_PATTERN)
+        for (client_name, ignored_desc) in zip(sheet.loc[is_check & is_ignored, NAME_KEY], desc[is_check & is_ignored]):
+            log.debug('Ignoring line for: "{}": "{}"'.format(client_name, ignored_desc))
+        donations = sheet[is_check & ~is_ignored].reset_index(drop=True)
+        desc = desc[is_check & ~is_ignored].reset_index(drop=True)
+        names = donations[NAME_KEY].where(_has_value(donations[NAME_KEY]), donations[VENDOR_KEY])
+        names = names.where(_has_value(names), '')
+        for check_num in donations.loc[names == '', CHECK_NUM_KEY]:
+            # Not sure what to do if no name is found yet, so just tell the user.
+            log.error(ml.error('No name was found for check number {} in file "{}".'.format(check_num,
+                                                                                         self.input_file)))
         self.donor_data = {}
-        self.donor_data[cc.QB_DATE] = {}
-        self.donor_data[cc.QB_NUM] = {}
-        self.donor_data[cc.QB_DONOR] = {}
-        self.donor_data[cc.QB_MEMO_DESCRIPTION] = {}
-        self.donor_data[cc.LGL_CAMPAIGN_NAME] = {}
-        self.donor_data[cc.QB_AMOUNT] = {}
-        index = INITIAL_DATE_INDEX
-        num_of_elements = len(self.input_data[DATE_KEY])
-        donor_index = 0
-        ignore_words = ['benevity', 'fidelity', 'stripe', 'yourcause']  # Ignore any rows with these words in the desc.
-        while index < num_of_elements:
-            donor_date = str(self.input_data[DATE_KEY][index])
-            if re.match(r'\d{2}/\d{2}/\d{4}', donor_date):
-                index = index + 1
-                while self.input_data[CHECK_NUM_KEY][index] and \
-                        str(self.input_data[CHECK_NUM_KEY][index]) != cc.EMPTY_CELL and \
-                        index < num_of_elements:
-                    client_name = self.input_data[NAME_KEY][index]
-                    desc = str(self.input_data[DESC_KEY][index]).strip()
-                    if set(ignore_words).intersection(desc.lower().split()):
-                        index += 1
-                        log.debug('Ignoring line for: "{}": "{}"'.format(client_name, desc))
-                        continue
-                    self.donor_data[cc.QB_DATE][donor_index] = donor_date
-                    check_num = self.input_data[CHECK_NUM_KEY][index]
-                    if check_num:
-                        if type(check_num) == int:
-                            self.donor_data[cc.QB_NUM][donor_index] = check_num
-                        elif (type(check_num) == str) and (check_num != cc.EMPTY_CELL):  # Note that this keeps hyphens
-                            num = str(''.join(x for x in check_num if (x.isdigit()) or x == '-'))
-                            self.donor_data[cc.QB_NUM][donor_index] = num
-                    self.donor_data[cc.QB_DONOR][donor_index] = self._find_donor_name(index=index)
-                    self.donor_data[cc.QB_AMOUNT][donor_index] = self.input_data[AMT_KEY][index]
-                    # Clean up the desc and campaign.
-                    self.donor_data[cc.LGL_CAMPAIGN_NAME][donor_index] = desc
-                    if desc != 'donation' and desc != cc.EMPTY_CELL:
-                        self.donor_data[cc.QB_MEMO_DESCRIPTION][donor_index] = desc
-                    donor_index += 1
-                    index += 1
-            index += 1  # This is outside the if bool block.
+        self.donor_data[cc.QB_DATE] = deposit_dates[is_check & ~is_ignored].reset_index(drop=True).to_dict()
+        self.donor_data[cc.QB_NUM] = self._clean_check_nums(check_nums=donations[CHECK_NUM_KEY])
+        self.donor_data[cc.QB_DONOR] = names.to_dict()
+        self.donor_data[cc.QB_MEMO_DESCRIPTION] = desc[(desc != 'donation') & (desc != cc.EMPTY_CELL)].to_dict()
+        self.donor_data[cc.LGL_CAMPAIGN_NAME] = desc.to_dict()
+        self.donor_data[cc.QB_AMOUNT] = donations[AMT_KEY].to_dict()
 
     # Return the map to be used by map_keys.
     def get_map(self):
@@ -194,52 +184,41 @@ class DonorFileReaderQuickbooks(donor_file_reader.DonorFileReader):
     def map_fields(self):
         log.debug('Entering')
         output_data = super().map_fields()
-        output_data[cc.LGL_PAYMENT_TYPE] = {}
-        indexes = output_data[cc.LGL_CONSTITUENT_ID].keys()
-        for index in indexes:
-            output_data[cc.LGL_CAMPAIGN_NAME][index] = 'General'
-            output_data[cc.LGL_PAYMENT_TYPE][index] = 'Check'
+        output_data.set_column(column=cc.LGL_CAMPAIGN_NAME, values='General')
+        output_data.set_column(column=cc.LGL_PAYMENT_TYPE, values='Check')
         return output_data
 
-    # This method will get the LGL IDs based on the name of the constituent.
+    # This method will get the names used to find the LGL IDs of the donors.
     #
-    # Returns - a dict of LGL IDs.  The keys of the dict will be in the format: {0: id_1, 1: id_2, ...}
-    def get_lgl_constituent_ids(self):
+    # Returns - a dict in the format: {0: (name_1, None), 1: (name_2, None), ...}
+    def get_constituent_lookups(self):
         log.debug('Entering')
-        lgl = lgl_api.LglApi()
         donor_names = self.donor_data[cc.QB_DONOR]
-        lgl_ids = {}
-        names_found = {}  # This is to make the loop more efficient by remembering the IDs of names already found.
+        lookups = {}
         for index in donor_names.keys():
-            name = donor_names[index]
-            # If the name is found names_found, then retrieve the ID from the dict instead of making a call.
-            if name in names_found.keys():
-                cid = names_found[name]
-            else:
-                cid = lgl.find_constituent_id(name, file_name=self.input_file)
-            lgl_ids[index] = cid
-            names_found[name] = cid
-        return lgl_ids
+            lookups[index] = (donor_names[index], None)
+        return lookups
 
     # -------------------- P R I V A T E   M E T H O D S -------------------- #
 
-    # This private method will figure out the name.
+    # This private method will clean up the check numbers.  Numbers are kept as they are.  Text has everything but
+    # the digits and hyphens taken out.  Anything else (like a check number that Excel turned into a decimal) is
+    # left out.
     #
     # Args -
-    #   index - The index in the NAME_KEY and VENDOR_KEY fields to use for the name.
+    #   check_nums - a Series with the check numbers
     #
-    # Returns - The name as a string or '' if none is found.
-    # Side effects - an error message is logged if no name is found.  No exception is thrown.
-    def _find_donor_name(self, index):
-        log.debug('Entering for index {}.'.format(index))
-        name = ''
-        if self.input_data[NAME_KEY][index] and str(self.input_data[NAME_KEY][index]) != cc.EMPTY_CELL:
-            name = self.input_data[NAME_KEY][index]
-        elif self.input_data[VENDOR_KEY][index] and str(self.input_data[VENDOR_KEY][index]) != cc.EMPTY_CELL:
-            name = self.input_data[VENDOR_KEY][index]
-        else:
-            # Not sure what to do if no name is found yet, so just tell the user.
-            check_num = self.input_data[CHECK_NUM_KEY][index]
-            log.error(ml.error('No name was found for check number {} in file "{}".'.
-                               format(check_num, self.input_file)))
-        return name
+    # Returns - a dict in the form {<row index>: <check number>, ...}
+    def _clean_check_nums(self, check_nums):
+        is_int = check_nums.map(type) == int
+        is_text = (check_nums.map(type) == str) & (check_nums != cc.EMPTY_CELL)
+        text_nums = check_nums[is_text].str.replace(r'[^\d-]', '', regex=True)  # Note that this keeps hyphens
+        return pandas.concat([check_nums[is_int], text_nums]).sort_index().to_dict()
+
+
+# This private function tells which cells in a column have a value.  Empty cells are read as NaN, which is 'nan' as a
+# string (cc.EMPTY_CELL).
+#
+# Returns - a boolean Series
+def _has_value(column):
+    return column.notna() & (column.map(str) != cc.EMPTY_CELL) & (column.map(str) != '')
@@ -2,6 +2,7 @@
 
 import column_constants as cc
 import datetime
+import itertools
 import logging
 import time
 
@@ -10,6 +11,10 @@ import donor_file_reader
 import lgl_api
 
 SAMPLE_FILE = 'sample_files\\stripe.xlsx'
+SKIPPED_STATUSES = ['failed', 'refunded']
+# The columns added to the donor data for the parts of the mailing address.
+ADDRESS_KEYS = [cc.LGL_ADDRESS_LINE_1_DNI, cc.LGL_ADDRESS_LINE_2_DNI, cc.LGL_CITY_DNI, cc.LGL_STATE_DNI,
+                cc.LGL_POSTAL_CODE_DNI]
 log = logging.getLogger()
 dd = display_data.DisplayData()
 
@@ -25,6 +30,13 @@ class DonorFileReaderStripe(donor_file_reader.DonorFileReader):
     #  'Grant Id': {0: 17309716, 1: 17319469, 2: 17401868}, ...
     #
 
+    SOURCE_NAME = 'Stripe'
+    LOAD_USED_COLUMNS_ONLY = True
+    # These columns are ignored by the map, but they are used to skip rows, split the address, and find the donors.
+    EXTRA_INPUT_COLUMNS = [cc.STRIPE_STATUS, cc.STRIPE_STATUS_2, cc.STRIPE_MAILING_ADDRESS_META,
+                           cc.STRIPE_CUSTOMER_DESCRIPTION, cc.STRIPE_CUSTOMER_DESCRIPTION_2, cc.STRIPE_CUSTOMER_ID,
+                           cc.STRIPE_CUSTOMER_ID_2, cc.STRIPE_USER_ID_META]
+
     def __init__(self):
         super(DonorFileReaderStripe, self).__init__()
         self.verify_names = True
@@ -41,28 +53,23 @@ class DonorFileReaderStripe(donor_file_reader.DonorFileReader):
     #   - Clean up the description
     #   - Handle the "RoundUp" users (the name needs to be copied into the proper fields.
     #
+    # The work is done by _ingest_rows, which is shared with the CSV reader.  The Excel data is in the form
+    # {column_name_1 {0: <row data>, 1: <row data>, ...}, column_name_2 ...}, so it is handed over one row at a time.
+    #
     # Side Effects: self.donor_data is populated
     def initialize_donor_data(self):
         log.debug('Entering')
-        self._copy_input_keys_to_donor_keys()
-
-        # Now loop through the rest of the rows and decide what data to keep.  For the data we do keep,
-        # we need to properly break up the STRIPE_MAILING_ADDRESS_META into separate address components
-        # and clean up the description.
-        status_key = self._get_key(key1=cc.STRIPE_STATUS, key2=cc.STRIPE_STATUS_2)
-        for input_row_key in self.input_data[status_key]:
-            if self.input_data[status_key][input_row_key].lower() in ['failed', 'refunded']:
-                continue
-            self._copy_data_row_to_donor_data(row_key=input_row_key)
-            self._update_description(row_key=input_row_key)
-            self._update_address(row_key=input_row_key)
+        column_labels = list(self.input_data.keys())
+        row_keys = self.input_data[column_labels[0]].keys() if column_labels else []
+        rows = ((row_key, [self.input_data[label][row_key] for label in column_labels]) for row_key in row_keys)
+        self._ingest_rows(column_labels=column_labels, rows=rows)
 
-    # This method will get the LGL IDs based on the name of the constituent.
+    # This method will get the names and email addresses used to find the LGL IDs of the donors.  If there is no
+    # customer description, the first and last name fields are used for the name.
     #
-    # Returns - a dict of LGL IDs.  The keys of the dict will be in the format: {0: id_1, 1: id_2, ...}
-    def get_lgl_constituent_ids(self):
+    # Returns - a dict in the format: {0: (name_1, email_1), 1: (name_2, email_2), ...}
+    def get_constituent_lookups(self):
         log.debug('Entering')
-        lgl = lgl_api.LglApi()
         customer_description_key = self._get_key(key1=cc.STRIPE_CUSTOMER_DESCRIPTION,
                                                  key2=cc.STRIPE_CUSTOMER_DESCRIPTION_2)
         customer_email_key = self._get_key(key1=cc.STRIPE_CUSTOMER_EMAIL, key2=cc.STRIPE_CUSTOMER_EMAIL_2)
@@ -70,8 +77,7 @@ class DonorFileReaderStripe(donor_file_reader.DonorFileReader):
         donor_first_names = self.donor_data[cc.STRIPE_USER_FIRST_NAME_META]
         donor_last_names = self.donor_data[cc.STRIPE_USER_LAST_NAME_META]
         email_addresses = self.donor_data[customer_email_key]
-        lgl_ids = {}
-        ids_found = {}  # This is to make the loop more efficient by remembering the IDs of names already found.
+        lookups = {}
         for index in donor_names.keys():
             # If there is no name, you get a float not_a_number (nan) value, so cast everything to string.
             name = str(donor_names[index])
@@ -81,51 +87,72 @@ class DonorFileReaderStripe(donor_file_reader.DonorFileReader):
                 first_name = str(donor_first_names[index])
                 if len(first_name) > 1 and first_name != cc.EMPTY_CELL:  # Does first_name have a value?
                     name = first_name + ' ' + str(donor_last_names[index])
-            cid = ''
-            # Make sure we have either a name or email address.
-            if (name and name != cc.EMPTY_CELL) or (email and email != cc.EMPTY_CELL):
-                # If the name is found ids_found, then retrieve the ID from the dict instead of making a call.
-                if name in ids_found.keys():
-                    cid = ids_found[name]
-                elif email in ids_found.keys():
-                    cid = ids_found[email]
-                else:
-                    cid = lgl.find_constituent_id(name=name, email=email, file_name=self.input_file)
-                if name and name != cc.EMPTY_CELL:
-                    ids_found[name] = cid
-                else:
-                    ids_found[email] = cid
-            lgl_ids[index] = cid
-        return lgl_ids
+            lookups[index] = (name, email)
+        return lookups
+
+    # This method overrides the get_external_keys method in the parent class.  Stripe donors have a customer ID and
+    # donations from the website also have the donor's user ID in the metadata.
+    #
+    # Returns - same as parent method
+    def get_external_keys(self):
+        customer_id_key = self._get_key(key1=cc.STRIPE_CUSTOMER_ID, key2=cc.STRIPE_CUSTOMER_ID_2)
+        return self._get_external_keys_from_columns(columns=[customer_id_key, cc.STRIPE_USER_ID_META])
 
-    # This method overrides the map_fields method in the parent class.  In addition to mapping fields based on
-    # self.donor_data, it will look for users that are repeat donors.
+    # This method overrides the count_extra_lgl_calls method in the parent class.  enrich_output gets the donations of
+    # every donor whose gift is for the general campaign to see if the gift is recurring.  It isn't known yet which
+    # donors will be found, so every general campaign row is counted.
+    #
+    # Returns - same as parent method
+    def count_extra_lgl_calls(self):
+        field_map = self.get_map()
+        count = 0
+        for (input_key, output_key) in field_map.items():
+            if output_key != cc.LGL_CAMPAIGN_NAME or input_key not in self.donor_data:
+                continue
+            for description in self.donor_data[input_key].values():
+                if self._clean_campaign(description=str(description)) == cc.GENERAL:
+                    count += 1
+        return count
+
+    # This method overrides the map_fields method in the parent class.  Donations without a campaign are for the
+    # general campaign.  The repeat donors are found later by enrich_output.
     #
     # Returns - same as parent method
     def map_fields(self):
         log.debug('Entering')
         output_data = super().map_fields()
-        constituent_ids = output_data[cc.LGL_CONSTITUENT_ID]
-        lgl = lgl_api.LglApi()
+        campaigns = output_data.get_column(column=cc.LGL_CAMPAIGN_NAME)
+        no_campaign = campaigns.map(str).isin(['', cc.EMPTY_CELL])
+        output_data.set_column(column=cc.LGL_CAMPAIGN_NAME, values=campaigns.where(~no_campaign, cc.GENERAL))
+        return output_data
+
+    # This method overrides the enrich_output method in the parent class.  It looks for donors who give to the
+    # general campaign every month.  Their campaign is changed to the general recurring campaign.
+    #
+    # Returns - same as parent method
+    def enrich_output(self, output_data):
+        log.debug('Entering')
+        constituent_ids = output_data.get_column(column=cc.LGL_CONSTITUENT_ID)
+        campaigns = output_data.get_column(column=cc.LGL_CAMPAIGN_NAME)
+        lgl = lgl_api.get_lgl_api()
+        changed = False
         for index in constituent_ids.keys():
             constituent_id = str(constituent_ids[index])
-            campaign = str(output_data[cc.LGL_CAMPAIGN_NAME][index])
+            campaign = str(campaigns[index])
             # Skip if no ID or there is a campaign name.
             if not constituent_id or campaign != cc.GENERAL:
-                if not campaign or campaign == cc.EMPTY_CELL:
-                    output_data[cc.LGL_CAMPAIGN_NAME][index] = cc.GENERAL
                 continue
             donations = lgl.get_donations(constituent_id=constituent_id)
-            output_data[cc.LGL_CAMPAIGN_NAME][index] = cc.GENERAL
             if not donations:
                 continue
-            gift_date = output_data[cc.LGL_GIFT_DATE][index]
-            gift_amount = output_data[cc.LGL_GIFT_AMOUNT][index]
+            gift_date = output_data.get_value(index=index, column=cc.LGL_GIFT_DATE)
+            gift_amount = output_data.get_value(index=index, column=cc.LGL_GIFT_AMOUNT)
             recurring = self._is_recurring(gift_date=gift_date, gift_amount=gift_amount,
                                            donations=donations, constituent_id=constituent_id)
             if recurring:
-                output_data[cc.LGL_CAMPAIGN_NAME][index] = cc.STRIPE_GENERAL_RECURRING
-        return output_data
+                output_data.set_value(index=index, column=cc.LGL_CAMPAIGN_NAME, value=cc.STRIPE_GENERAL_RECURRING)
+                changed = True
+        return changed
 
     # This private method is a helper that allows an easy switch from one method to another.
     def _is_recurring(self, gift_date, gift_amount, donations, constituent_id):
@@ -181,36 +208,34 @@ class DonorFileReaderStripe(donor_file_reader.DonorFileReader):
 
     # ----- P R I V A T E   M E T H O D S ----- #
 
-    # This private method copies the keys from the input_data to the donor_data and assign empty dicts and add keys
-    # for the rest of the address.
-    #
-    # Side effect: self.donor_data is initialized with the same keys as self.input_data and a few extra
-    def _copy_input_keys_to_donor_keys(self):
-        log.debug('Entering')
-        for key in self.input_data:
-            self.donor_data[key] = {}
-        self.donor_data[cc.LGL_ADDRESS_LINE_1_DNI] = {}
-        self.donor_data[cc.LGL_ADDRESS_LINE_2_DNI] = {}
-        self.donor_data[cc.LGL_CITY_DNI] = {}
-        self.donor_data[cc.LGL_STATE_DNI] = {}
-        self.donor_data[cc.LGL_POSTAL_CODE_DNI] = {}
-        self.donor_data[cc.LGL_PAYMENT_TYPE] = {}
-
-    # This private method will copy a row of data from input_data to donor_data.
+    # This private method builds self.donor_data from the Stripe rows in one pass.  Each row is read once: rows that
+    # failed or were refunded are skipped, and for the rest the description is cleaned up, the mailing address is
+    # split into its parts, and the values are written straight into the donor data.  The Excel and CSV readers both
+    # use it, so the data isn't copied into another dict of dicts first.
     #
     # Args:
-    #   row_key - the key of the row to copy.
+    #   column_labels - the labels of the columns in the order of the values in each row
+    #   rows - an iterable of (row_key, values) tuples.  values is a list in the same order as column_labels.  Values
+    #       past the last label are dropped and short rows are filled out with empty strings.
     #
-    # Side Effect: a new row is added to self.donor_data
-    def _copy_data_row_to_donor_data(self, row_key):
+    # Side Effect: self.donor_data is populated
+    def _ingest_rows(self, column_labels, rows):
         log.debug('Entering')
-        for label_key in self.input_data.keys():
-            self.donor_data[label_key][row_key] = self.input_data[label_key][row_key]
-        self.donor_data[cc.LGL_ADDRESS_LINE_1_DNI][row_key] = ''
-        self.donor_data[cc.LGL_ADDRESS_LINE_2_DNI][row_key] = ''
-        self.donor_data[cc.LGL_CITY_DNI][row_key] = ''
-        self.donor_data[cc.LGL_STATE_DNI][row_key] = ''
-        self.donor_data[cc.LGL_POSTAL_CODE_DNI][row_key] = ''
+        self.donor_data = {label: {} for label in column_labels}
+        for key in ADDRESS_KEYS + [cc.LGL_PAYMENT_TYPE]:
+            self.donor_data[key] = {}
+        status_key = self._get_key(key1=cc.STRIPE_STATUS, key2=cc.STRIPE_STATUS_2)
+        description_key = self._get_key(key1=cc.STRIPE_DESCRIPTION, key2=cc.STRIPE_DESCRIPTION_2)
+        label_count = len(column_labels)
+        for (row_key, values) in rows:
+            record = dict(itertools.zip_longest(column_labels, values[:label_count], fillvalue=''))
+            if str(record[status_key]).lower() in SKIPPED_STATUSES:
+                continue
+            record.update(dict.fromkeys(ADDRESS_KEYS, ''))
+            self._update_description(record=record, description_key=description_key)
+            self._update_address(record=record, row_key=row_key)
+            for (label, value) in record.items():
+                self.donor_data.setdefault(label, {})[row_key] = value
 
     # This private method will clean up the description:
     # - Delete description unless it says "In Memory of", "In Honor of", or "Roundup"
@@ -218,27 +243,27 @@ class DonorFileReaderStripe(donor_file_reader.DonorFileReader):
     # - Add the "seller_message" column to description if it doesn't say "Payment Complete".
     # - Set the "Payment Type" field to "Credit Card Stripe"
     #
-    # Side Effect: the description and payment type in self.donor_data are modified.
-    def _update_description(self, row_key):
-        log.debug('Entering for row_key "{}"'.format(row_key))
+    # Args:
+    #   record - the row being ingested in the form {label: value}
+    #   description_key - the label of the description column
+    #
+    # Side Effect: the description and payment type in the record are modified.
+    def _update_description(self, record, description_key):
         # Do the payment type first.  They're simple.
-        self.donor_data[cc.LGL_PAYMENT_TYPE][row_key] = 'Credit Card Stripe'
+        record[cc.LGL_PAYMENT_TYPE] = 'Credit Card Stripe'
 
-        description_key = cc.STRIPE_DESCRIPTION
-        if cc.STRIPE_DESCRIPTION_2 in self.donor_data.keys():
-            description_key = cc.STRIPE_DESCRIPTION_2
-        desc = self.donor_data[description_key][row_key]
+        desc = str(record.get(description_key, ''))
         # If the description doesn't contain "In Memory of", "In Honor of", or "Roundup:", clear it.
         if (desc.find(cc.STRIPE_DESC_MEMORY) == -1) and\
             (desc.find(cc.STRIPE_DESC_HONOR) == -1) and\
             (desc.find(cc.STRIPE_DESC_ROUNDUP) == -1):
-            self.donor_data[description_key][row_key] = ''
+            record[description_key] = ''
         # If the description contains "RoundUp", copy the name to the first and last name fields.
         if desc.find(cc.STRIPE_DESC_ROUNDUP) > -1:
             label_len = len(cc.STRIPE_DESC_ROUNDUP) + 1  # We want to remove "RoundUp: " from the desc
             [first_name, last_name] = desc[label_len:].strip().split(' ')  # Get just the name and split on the space.
-            self.donor_data[cc.STRIPE_USER_FIRST_NAME_META][row_key] = first_name
-            self.donor_data[cc.STRIPE_USER_LAST_NAME_META][row_key] = last_name
+            record[cc.STRIPE_USER_FIRST_NAME_META] = first_name
+            record[cc.STRIPE_USER_LAST_NAME_META] = last_name
 
     # This private method will put the address into the correct fields.  Stripe puts the entire address into a
     # field called "Mailing Address (metadata)".  LGL wants to store the the address in separate fields (address 1-3,
@@ -246,32 +271,35 @@ class DonorFileReaderStripe(donor_file_reader.DonorFileReader):
     # the various pieces of data is simple.  The bad news is that we need to determine whether there are address 2
     # or address 3 fields.
     #
-    # Side Effects: the self.donor_data's address fields are modified
-    def _update_address(self, row_key):
-        log.debug('Entering for row_key "{}"'.format(row_key))
+    # Args:
+    #   record - the row being ingested in the form {label: value}
+    #   row_key - the key of the row for error messages
+    #
+    # Side Effects: the address fields in the record are modified
+    def _update_address(self, record, row_key):
+        address = str(record.get(cc.STRIPE_MAILING_ADDRESS_META, ''))
         # If there are no commas in the mailing address field, do nothing.
-        if str(self.donor_data[cc.STRIPE_MAILING_ADDRESS_META][row_key]).find(',') == -1:
+        if address.find(',') == -1:
             return
 
-        address_fields = self.donor_data[cc.STRIPE_MAILING_ADDRESS_META][row_key].split(',')
+        address_fields = address.split(',')
 
         # We know how many fields are used based on the length of address_fields.
         # If there are less than 4 address fields, we don't know what they are.
         if len(address_fields) < 4 or len(address_fields) > 6:
-            address = self.donor_data[cc.STRIPE_MAILING_ADDRESS_META][row_key]  # Just keeping code readable
             log.error(dd.error('Less than four or more than six address lines were found for ' +
                                'row {} - "{}" in the file "{}".'.format(row_key, address, self.input_file)))
             return
 
-        self.donor_data[cc.LGL_ADDRESS_LINE_1_DNI][row_key] = address_fields[0]
+        record[cc.LGL_ADDRESS_LINE_1_DNI] = address_fields[0]
 
         address_index = 1  # Note that address_index is incremented on the same line as the assignment.
         if len(address_fields) == 5:
-            self.donor_data[cc.LGL_ADDRESS_LINE_2_DNI][row_key] = address_fields[address_index]; address_index += 1
+            record[cc.LGL_ADDRESS_LINE_2_DNI] = address_fields[address_index]; address_index += 1
         # Add city, state, and zip.
-        self.donor_data[cc.LGL_CITY_DNI][row_key] = address_fields[address_index]; address_index += 1
-        self.donor_data[cc.LGL_STATE_DNI][row_key] = address_fields[address_index]; address_index += 1
-        self.donor_data[cc.LGL_POSTAL_CODE_DNI][row_key] = address_fields[address_index]
+        record[cc.LGL_CITY_DNI] = address_fields[address_index]; address_index += 1
+        record[cc.LGL_STATE_DNI] = address_fields[address_index]; address_index += 1
+        record[cc.LGL_POSTAL_CODE_DNI] = address_fields[address_index]
 
     # There are several keys in the Stripe data that may appear in more than one form.  For example, the
     # "customer_description" key may also be "Customer Description".  This is fixed by having both keys in the
@@ -1,24 +1,25 @@
 # This class will read excel input files, retrieve info from them, and create a CSV file with the new format.
 # The purpose of this class is to correctly interpret Stripe data if it is pass as a CSV file instead of an Excel
-# file.  It will reformat the input data so that it looks as if it came from an Excel file and allow the base
-# class to do its job.
+# file.
 #
 # When the initial Stripe file reader was written, it expected the input data would be in Excel format (in an XSLX
-# file).  However, it turns out that Stripe data is natively put into CSV format.  This class acts as a preprocessor
-# to convert data from a CSV file to look like it came from an Excel file.  It only operates on self.input_data.
-# The self.donor_data processing takes place in the base class.
+# file).  However, it turns out that Stripe data is natively put into CSV format.  This class used to convert the data
+# from a CSV file to look like it came from an Excel file.  Now the CSV rows are given to the same single pass ingest
+# as the Excel rows (see DonorFileReaderStripe._ingest_rows), so the data is only copied once.
 #
 
 import logging
 
+import column_constants as cc
 import donor_file_reader_stripe
 
 log = logging.getLogger()
 
 
 # This class will process donations from YourCause.
-# self.input_data is declared by the __init__ module of donor_file_reader.  In this module, it will be a list
-# similar to the sample below:
+# self.input_data is declared by the __init__ module of donor_file_reader.  In this module, it will be the rows of
+# the CSV file, read one at a time (see donor_file_reader_factory.read_csv_rows).  The rows are similar to the
+# sample below:
 #
 #   [["id","Description","Seller Message","Created (UTC)","Amount","Amount Refunded","Currency",
 #     "Converted Amount","Converted Amount Refunded","Fee","Tax","Converted Currency","Status",
@@ -46,53 +47,19 @@ log = logging.getLogger()
 #
 
 class DonorFileReaderStripeCsv(donor_file_reader_stripe.DonorFileReaderStripe):
-    # This initialize_donor_data method will store the donation will reformat the data in self.input_data so that
-    # it can be properly processed by the initialize_donor_data method in the base class.  When this is complete,
-    # the base class' initialize_donor_data method will properly load the self.donor_data property.
+    # This initialize_donor_data method hands the CSV rows straight to the _ingest_rows method in the base class,
+    # which builds self.donor_data in one pass.  The CSV data used to be reshaped into the Excel format first, which
+    # copied every value twice and looked up the position of every row and label with list.index().
     #
     # The input data is in the format:
     #   ["id","Description","Seller Message","Created (UTC)", ... ]  <-- these are the labels
     #   [ch_3MLExtBBufDV5ZOl1nHV2DSn,Give Lively,Payment complete.,12/31/2022 23:59, ...],  <-- this is the data
     #
-    # To convert the input data to the final dict, we will:
-    #   1. loop through each of the data rows
-    #   2. loop through each label
-    #   3. take the index of the entire data row.  That will be the key of the row data (0, 1, 2, ...)
-    #   4. use the index of the column label.  That will be the index of the row value we are adding.
-    #
-    # In pictures, it looks like:
-    # input labels = [c1, c2, c3]
-    # input values = [[c1v1, c1v2, c1v3], [c2v1, c2v2, c2v3], [c3v1, c3v2, c3v3]]
-    #
-    # Transform
-    # input_data = {c1:{}, c2:{}, c3{}}
-    # to
-    # input_data = {c1: {0: c1v1, 1: c1v2, 2: c1v3},
-    #               c2: {0: c2v1, 1: c2v2, 2: c2v3},
-    #               c3: {0: c3v1, 1: c3v2, 2: c3v3}}
+    # The key of each row is its position after the labels (0, 1, 2, ...), the same as in the Excel format.
     #
     # Returns - none
     # Side Effect - the self.data_donor property is populated.
     def initialize_donor_data(self):
         log.debug('Entering')
-        new_input_data = {}
-        # Separate the donor data from everything else (exclude the labels).
-        donor_rows = self.input_data[1:]
-
-        # Initialize the dict from labels (row 0 of the input_data).
-        column_labels = self.input_data[0]
-        for label in column_labels:
-            new_input_data[label] = {}
-            # self.donor_data[label] = {}
-
-        # Add the donor rows to the data.
-        for row in donor_rows:  # Start with a row of donor data e.g. [ch_3MLExtBBufDV5ZOl1nHV2DSn,Give Lively, ...]
-            for label in column_labels:  # Now loop through the labels e.g. "id","Description",...
-                # For each label, add the value from the data row to it.
-                row_index = donor_rows.index(row)
-                label_index = column_labels.index(label)
-                new_input_data[label][row_index] = row[label_index]
-                # self.donor_data[label][row_index] = row[label_index]
-
-        self.input_data = new_input_data
-        super().initialize_donor_data()
+        (column_labels, donor_rows) = self._get_csv_labels_and_rows(label_row=cc.STRIPE_LABEL_ROW)
+        self._ingest_rows(column_labels=column_labels, rows=enumerate(donor_rows))
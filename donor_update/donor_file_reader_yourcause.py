@@ -6,7 +6,6 @@ import column_constants as cc
 import logging
 
 import donor_file_reader
-import lgl_api
 
 SAMPLE_FILE = 'sample_files\\benevity.csv'
 log = logging.getLogger()
@@ -15,8 +14,9 @@ GOOD_PAYMENT_STATUS = 'Cleared'
 
 
 # This class will process donations from YourCause.
-# self.input_data is declared by the __init__ module of donor_file_reader.  In this module, it will be a list
-# similar to the sample below:
+# self.input_data is declared by the __init__ module of donor_file_reader.  In this module, it will be the rows of
+# the CSV file, read one at a time (see donor_file_reader_factory.read_csv_rows).  The rows are similar to the
+# sample below:
 #
 #   [['Id', 'Amount', 'GrossAmount', 'CheckFeeDetails CheckFee', 'CheckFeeDetails PercentWithheld',
 #     'CheckFeeDetails CapApplied', 'Currency', 'IsAch', 'DateCreated', 'PaymentNumber', 'PaymentStatus',
@@ -42,6 +42,8 @@ GOOD_PAYMENT_STATUS = 'Cleared'
 # Payment Status MUST say "Cleared" to be included in the donor data.
 #
 class DonorFileReaderYourCause(donor_file_reader.DonorFileReader):
+    SOURCE_NAME = 'YourCause'
+
     # The initialize_donor_data method will store the donation in a dict called self.donor_data.  This is very similar
     # to the process used in DonorFileReaderBenevity.  The format of the dict will be:
     #
@@ -52,33 +54,22 @@ class DonorFileReaderYourCause(donor_file_reader.DonorFileReader):
     #   ['12192042', '650', '650', ...],  <-- this is the data
     #   ['12192043', '50', '50', ...]
     #
-    # To convert the input data to the final dict, we will:
-    #   1. loop through each of the data rows
-    #   2. loop through each label
-    #   3. take the index of the entire data row.  That will be the key of the row data (0, 1, 2, ...)
-    #   4. use the index of the column label.  That will be the index of the row value we are adding.
+    # The rows are put into a DataFrame with the labels as the columns (see _make_data_frame).  The rows whose
+    # Payment Status isn't "Cleared" are dropped all at once with a mask, and the DataFrame is turned into the dict.
+    # The key of each row is its position in the data rows (0, 1, 2, ...).
     #
     # Returns - none
     # Side Effect - the self.data_donor property is populated.
     def initialize_donor_data(self):
         log.debug('Entering')
-        # Separate the donor data from everything else (exclude the labels).
-        donor_rows = self.input_data[1:]
-
-        # Initialize the dict from labels (row 0 of the input_data).
-        column_labels = self.input_data[0]
-        for label in column_labels:
-            self.donor_data[label] = {}
+        # Separate the donor data from the labels (row 0 of the input_data).
+        (column_labels, donor_rows) = self._get_csv_labels_and_rows(label_row=cc.YC_LABEL_ROW)
+        donor_df = self._make_data_frame(column_labels=column_labels, donor_rows=donor_rows)
 
-        # Add the donor rows to the data.
-        payment_status_index = column_labels.index(cc.YC_PAYMENT_STATUS)
-        for row in donor_rows:  # Start with a row of donor data e.g. ['Liberty Mutual', 'DANIELS TABLE INC', ...]
-            if row[payment_status_index] != GOOD_PAYMENT_STATUS:
-                continue
-            for label in column_labels:  # Now get a label e.g. 'Company'
-                row_index = donor_rows.index(row)
-                label_index = column_labels.index(label)
-                self.donor_data[label][row_index] = row[label_index]
+        # Only keep the rows that have cleared.  The rows keep their positions as their keys, so the keys of the rows
+        # that are dropped are skipped.
+        cleared = donor_df[cc.YC_PAYMENT_STATUS] == GOOD_PAYMENT_STATUS
+        self.donor_data = donor_df[cleared].to_dict()
 
     # Return the map to be used by map_keys.
     def get_map(self):
@@ -91,30 +82,24 @@ class DonorFileReaderYourCause(donor_file_reader.DonorFileReader):
     def map_fields(self):
         log.debug('Entering')
         output_data = super().map_fields()
-        output_data[cc.LGL_CAMPAIGN_NAME] = {}
-        indexes = output_data[cc.LGL_CONSTITUENT_ID].keys()
-        for index in indexes:
-            output_data[cc.LGL_CAMPAIGN_NAME][index] = 'General'
+        output_data.set_column(column=cc.LGL_CAMPAIGN_NAME, values='General')
         return output_data
 
-    # This method will get the LGL IDs based on the name of the constituent.
+    # This method will get the names and email addresses used to find the LGL IDs of the donors.
     #
-    # Returns - a dict of LGL IDs.  The keys of the dict will be in the format: {0: id_1, 1: id_2, ...}
-    def get_lgl_constituent_ids(self):
+    # Returns - a dict in the format: {0: (name_1, email_1), 1: (name_2, email_2), ...}
+    def get_constituent_lookups(self):
         log.debug('Entering')
-        lgl = lgl_api.LglApi()
         donor_names = self.donor_data[cc.YC_DONOR_FULL_NAME]
         donor_emails = self.donor_data[cc.YC_DONOR_EMAIL_ADDRESS]
-        lgl_ids = {}
-        names_found = {}  # This is to make the loop more efficient by remembering the IDs of names already found.
+        lookups = {}
         for index in donor_names.keys():
-            name = donor_names[index]
-            email = donor_emails[index]
-            # If the name is found names_found, then retrieve the ID from the dict instead of making a call.
-            if name in names_found.keys():
-                cid = names_found[name]
-            else:
-                cid = lgl.find_constituent_id(name=name, email=email, file_name=self.input_file)
-            lgl_ids[index] = cid
-            names_found[name] = cid
-        return lgl_ids
+            lookups[index] = (donor_names[index], donor_emails[index])
+        return lookups
+
+    # This method overrides the get_external_keys method in the parent class.  YourCause donors are identified by
+    # their email addresses.
+    #
+    # Returns - same as parent method
+    def get_external_keys(self):
+        return self._get_external_keys_from_columns(columns=[cc.YC_DONOR_EMAIL_ADDRESS])
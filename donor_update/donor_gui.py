@@ -30,6 +30,10 @@ class DonorGui:
                                       'the variance file should be ".csv".', text_color='black', pad=PADDING)
     VARIANCE_FILE_TEXT = sg.Text('What is the name of the address variance output file?', text_color='yellow')
     VARIANCE_FILE_INPUT = sg.Input(key='variance_file', size=(40, 1))
+    DRY_RUN_CHECKBOX = sg.Checkbox('Dry run: only show the number of LGL calls and the time the run should take',
+                                   key='dry_run', default=False, pad=PADDING)
+    CLEAR_NOT_FOUND_CHECKBOX = sg.Checkbox('Search LGL again for the donors that were not found on an earlier run',
+                                           key='clear_not_found', default=False, pad=PADDING)
 
     # This method will display the form that will collect the input files, output file name, and variance file
     # name from the user.  If no input files are chosen when the user clicks the Submit button, the program will end.
@@ -52,6 +56,8 @@ class DonorGui:
                   [sg.HorizontalSeparator(pad=self.PADDING)],
                   [self.VARIANCE_FILE_TEXT, self.VARIANCE_FILE_INPUT],
                   [self.VARIANCE_FILE_HELP_TEXT],
+                  [self.DRY_RUN_CHECKBOX],
+                  [self.CLEAR_NOT_FOUND_CHECKBOX],
                   [sg.Submit(), sg.Quit()]]
 
         window = sg.Window('Donor Information Updater ' + version, layout)
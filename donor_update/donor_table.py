@@ -0,0 +1,181 @@
+# This class holds the donor data that the DonorFileReader objects create for the output file.  The data used to be
+# passed from map_fields to the merge, verify_donor_info, and the CSV writer as dicts in the form:
+#
+#   {column_name_1 {0: <row data>, 1: <row data>, ...}, column_name_2 ...}
+#
+# Every cell of a dict of dicts is a Python object with its own dict entry, and each step made another full copy of
+# the data cell by cell.  A DonorTable keeps the same columns and rows in a pandas DataFrame instead, so the steps work
+# on whole columns.  Columns with only a few different values (like the gift type, payment type, campaign name, and
+# gift date) are stored as categories (see compact), so each value is only kept once.
+#
+# The row labels are the same row indexes used by donor_data and get_constituent_lookups, so the constituent IDs line
+# up with the rows they were found for.  An example is below:
+#
+#   table = DonorTable.from_columns({'Gift amount': {0: 10, 1: 20}, 'LGL Constituent ID': {0: 123, 1: ''}})
+#   table.set_column(column='Gift type', values='Gift')
+#   table.get_value(index=1, column='Gift amount')  # 20
+
+import logging
+
+import pandas
+
+EMPTY_VALUE = ''  # The value used for rows that don't have a column.
+CATEGORY_RATIO = 0.5  # A column is stored as a category when it has fewer different values than this share of rows.
+
+log = logging.getLogger()
+
+
+class DonorTable:
+
+    def __init__(self, frame=None):
+        self.frame = pandas.DataFrame() if frame is None else frame  # The columns and rows of the table.
+
+    # This method will make a table from columns in the dict of dicts format described above.  The rows are put in
+    # the order of their row indexes.  A row that isn't in every column is left empty (NaN) in the other columns.
+    #
+    # Args -
+    #   columns - a dict in the form {column_name_1 {0: <row data>, 1: <row data>, ...}, column_name_2 ...}.  The
+    #       values can also be pandas Series.
+    #
+    # Returns - a DonorTable object
+    @classmethod
+    def from_columns(cls, columns):
+        series = {column: pandas.Series(values, dtype=object) for (column, values) in columns.items()}
+        frame = pandas.DataFrame(series) if series else pandas.DataFrame()
+        try:
+            frame = frame.sort_index()
+        except TypeError:
+            log.debug('The row indexes can not be sorted, so the rows are left in the order they were found.')
+        return cls(frame=frame)
+
+    # The number of rows in the table.
+    def __len__(self):
+        return len(self.frame.index)
+
+    # This tells if the table has a column (eg: "Gift note" in table).
+    def __contains__(self, column):
+        return column in self.frame.columns
+
+    # This method gets the names of the columns in the order they will be written.
+    def get_columns(self):
+        return list(self.frame.columns)
+
+    # This method gets the row indexes of the table.
+    def get_index(self):
+        return list(self.frame.index)
+
+    # This method gets a column.  Category columns are turned back into plain values so they can be changed freely.
+    #
+    # Args -
+    #   column - the name of the column
+    #   default - (opt) the value for every row if the table doesn't have the column.  Defaults to ''.
+    #
+    # Returns - a pandas Series with one value for each row
+    def get_column(self, column, default=EMPTY_VALUE):
+        if column not in self.frame.columns:
+            return pandas.Series(default, index=self.frame.index, dtype=object)
+        values = self.frame[column]
+        if isinstance(values.dtype, pandas.CategoricalDtype):
+            values = values.astype(object)
+        return values
+
+    # This method adds or replaces a column.
+    #
+    # Args -
+    #   column - the name of the column
+    #   values - one value for every row, or a dict or pandas Series of values by row index.  Rows that aren't in
+    #       the table yet are added.
+    #   dtype - (opt) the dtype of the column.  None keeps the dtype of a Series (like the datetime64 of dates) or
+    #       lets pandas choose it.  Defaults to object.
+    def set_column(self, column, values, dtype=object):
+        if isinstance(values, (dict, pandas.Series)):
+            values = pandas.Series(values, dtype=dtype)
+            new_rows = values.index.difference(self.frame.index)
+            if len(new_rows) > 0:
+                self.frame = self.frame.reindex(self.frame.index.append(new_rows))
+            values = values.reindex(self.frame.index)
+        else:
+            values = pandas.Series(values, index=self.frame.index, dtype=dtype)
+        self.frame[column] = values
+
+    # This method gets the value in one cell.
+    def get_value(self, index, column):
+        return self.frame.at[index, column]
+
+    # This method changes the value in one cell.  A new value for a category column is added to its categories.
+    def set_value(self, index, column, value):
+        values = self.frame[column]
+        if isinstance(values.dtype, pandas.CategoricalDtype) and value not in values.cat.categories:
+            self.frame[column] = values.cat.add_categories([value])
+        self.frame.at[index, column] = value
+
+    # This method will store the columns of text that have only a few different values as categories.  Columns with
+    # numbers or dates, or with mostly different values (like names) are left as they are.
+    #
+    # Returns - the table, so it can be chained
+    def compact(self):
+        row_count = len(self)
+        for column in self.frame.columns:
+            values = self.frame[column]
+            if not pandas.api.types.is_string_dtype(values.dtype) or row_count == 0:
+                continue
+            try:
+                if values.nunique(dropna=False) <= row_count * CATEGORY_RATIO:
+                    self.frame[column] = values.astype('category')
+            except TypeError:
+                log.debug('The column "{}" has values that can not be compared, so it is not compacted.'.format(column))
+        return self
+
+
+# This function will merge the tables from all the input files into one table in a single pass.  It replaces
+# donor_etl.append_data, which merged the files two at a time and copied every row again for each new file.
+#
+# The columns of all the tables are put together once (see get_merged_columns), in the order they are first seen:
+# the columns of the first table, then the new columns of the second table, and so on.  This is the same order
+# append_data used.  Each table is then filled out to those columns (rows from a table that doesn't have a column get
+# EMPTY_VALUE), and all the rows are put together with one pandas.concat.  The rows are numbered 0, 1, ... in the new
+# table, in the order of the tables.
+#
+# Args -
+#   tables - a list of DonorTable objects.  None of them are changed.
+#
+# Returns - a new DonorTable object.  It is empty if there are no tables.
+def merge(tables):
+    if not tables:
+        return DonorTable()
+    columns = get_merged_columns(tables=tables)
+    frames = [table.frame.reindex(columns=columns, fill_value=EMPTY_VALUE) for table in tables]
+    return DonorTable(frame=pandas.concat(frames, ignore_index=True)).compact()
+
+
+# This function gets the columns of the table that merge makes from the tables, in the same order.
+#
+# Args -
+#   tables - a list of DonorTable objects
+#
+# Returns - a list of column names
+def get_merged_columns(tables):
+    return list(dict.fromkeys(column for table in tables for column in table.get_columns()))
+
+
+# Test that tables with different columns are merged and compacted.
+def run_donor_table_test():
+    first = DonorTable.from_columns({'Gift amount': {0: 10, 1: 20, 2: 30}, 'Campaign name': {0: 'General',
+                                                                                          1: 'General', 2: 'General'}})
+    first.set_column(column='Gift type', values='Gift')
+    second = DonorTable.from_columns({'Gift amount': {0: 40}, 'Gift note': {0: 'Via Fidelity Charitable.'}})
+    second.set_column(column='Gift type', values='Gift')
+    table = merge(tables=[first, second])
+    table.set_value(index=3, column='Campaign name', value='General Recurring')
+    log.debug('The merged table has the columns {} and the dtypes:\n{}\n{}'.format(
+        table.get_columns(), table.frame.dtypes, table.frame.to_string()))
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_donor_table_test()
@@ -8,29 +8,96 @@
 #
 # [lgl]
 # API_TOKEN: YOUR_TOKEN_HERE
+#
+# The constituent ID cache (see lgl_cache.py) is configured in the optional "cache" section of the same file, the
+# statistics used to order the name searches (see lgl_search_stats.py) are configured in the "search" section, and the
+# local copy of LGL's constituents (see lgl_mirror.py) is configured in the optional "mirror" section.  The names in
+# the mirror are also loaded into a NameIndex (see name_index.py) so that names that are written differently than in
+# LGL can be matched without searching LGL.
+#
+# A donor only gets an ID when exactly one constituent matches them.  The NameIndex's best match, and the best of
+# several constituents returned by an LGL search, are only suggested in the message about the donor, so that someone
+# can check them.  They are used as the donor's ID only if fuzzy_match is turned on in the "search" section:
+#
+# [search]
+# fuzzy_match: no
+#
+# The calls to LGL are counted in a ledger that is shared with any other copy of this program that is running at the
+# same time (see lgl_call_ledger.py), so that together they stay under LGL's call limit.  The ledger is configured in
+# the optional "rate_limit" section.  The calls in the current window are also saved to a state file so that a run
+# that is restarted knows how many calls are left.
+#
+# Calls that fail because LGL is busy or can't be reached are retried (see lgl_retry.py).  The retries are configured
+# in the optional "retry" section.  When calls are waiting for the call limit, the searches for constituent IDs are
+# made before the calls for donations and constituent details (see lgl_call_scheduler.py).
+#
+# All calls to LGL share one HTTP session so that the TCP and TLS connections are kept alive and reused instead of
+# being set up again for every call.  The session can be tuned in the optional "http" section.  The timeouts are
+# in seconds and pool_size is the maximum number of connections that are kept open to LGL:
+#
+# [http]
+# connect_timeout: 10
+# read_timeout: 60
+# pool_size: 10
+#
+# Use get_lgl_api() to get the LglApi object instead of creating a new one.  The properties file is only read once
+# and the connections are shared by everything that calls LGL.
 
 import logging
 import os
-import re
+import sqlite3
 import sys
 import requests
+import threading
 import time
 
 import column_constants as cc
 import display_data
-import lgl_call_tracker
+import lgl_cache
+import lgl_call_ledger
+import lgl_call_scheduler
+import lgl_mirror
+import lgl_rate_limiter
+import lgl_retry
+import lgl_search_stats
+import name_index
+import name_parser
 import sample_data as sample
 
 from configparser import ConfigParser
+from requests.adapters import HTTPAdapter
 
 PROPERTY_FILE = 'donor_etl.properties'
 URL_SEARCH_CONSTITUENT = 'https://api.littlegreenlight.com/api/v1/constituents/search'
 URL_CONSTITUENT_DETAILS = 'https://api.littlegreenlight.com/api/v1/constituents/'
 URL_CONSTITUENT_DONATIONS = 'https://api.littlegreenlight.com/api/v1/constituents/{}/gifts.json?limit=10'
+URL_CONSTITUENTS = 'https://api.littlegreenlight.com/api/v1/constituents.json'
+URL_LGL = 'https://api.littlegreenlight.com'
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_POOL_SIZE = 10
+STEP_EMAIL = 'email'  # The search step name for the email search (see lgl_search_stats.py).
 
 log = logging.getLogger()
 ml = display_data.DisplayData()
-call_tracker = lgl_call_tracker.LglCallTracker()
+rate_limiter = lgl_rate_limiter.LglRateLimiter()  # All calls to LGL share one call budget.
+scheduler = lgl_call_scheduler.LglCallScheduler(limiter=rate_limiter)  # The searches get the budget first.
+cache = None  # The constituent ID cache is shared by all LglApi objects.  The first LglApi object creates it.
+_lgl_api_instance = None
+_lgl_api_lock = threading.Lock()
+
+
+# This function returns the LglApi object that is shared by the whole program.  It is created the first time this
+# function is called.
+#
+# Returns - the shared LglApi object
+def get_lgl_api():
+    global _lgl_api_instance
+    with _lgl_api_lock:
+        if _lgl_api_instance is None:
+            _lgl_api_instance = LglApi()
+    return _lgl_api_instance
+
 
 class LglApi:
 
@@ -53,53 +120,75 @@ class LglApi:
             sys.exit(1)
 
         c.read(conf_file)
+        self.config = c  # Other classes that work with LGL (like the ConstituentResolver) read their settings here.
         self.lgl_api_token = c.get('lgl', 'api_token')
+        self.cache = self._get_cache(config=c, application_path=application_path)
+        self.search_stats = self._get_search_stats(config=c)
+        self.fuzzy_match = c.getboolean('search', 'fuzzy_match', fallback=False)  # Use suggested matches as IDs.
+        self.mirror = self._get_mirror(config=c, application_path=application_path)
+        self.timeout = (c.getfloat('http', 'connect_timeout', fallback=DEFAULT_CONNECT_TIMEOUT),
+                        c.getfloat('http', 'read_timeout', fallback=DEFAULT_READ_TIMEOUT))
+        self.session = self._create_session(pool_size=c.getint('http', 'pool_size', fallback=DEFAULT_POOL_SIZE))
+        state_file = c.get('rate_limit', 'state_file', fallback=lgl_rate_limiter.DEFAULT_STATE_FILE)
+        rate_limiter.set_state_file(state_file=os.path.join(application_path, state_file))
+        if c.getboolean('rate_limit', 'shared', fallback=True):
+            ledger_file = os.path.join(application_path, c.get('rate_limit', 'ledger_file',
+                                                               fallback=lgl_call_ledger.DEFAULT_LEDGER_FILE))
+            try:
+                rate_limiter.set_ledger(lgl_call_ledger.LglCallLedger(ledger_file=ledger_file,
+                                                                      api_token=self.lgl_api_token))
+            except sqlite3.Error as e:
+                log.warning('The call ledger "{}" can not be used ({}).  Only the calls made by this program will be '
+                            'counted.'.format(ledger_file, e))
+        self.retry_policy = lgl_retry.RetryPolicy(
+            max_retries=c.getint('retry', 'max_retries', fallback=lgl_retry.DEFAULT_MAX_RETRIES),
+            base_delay=c.getfloat('retry', 'base_delay', fallback=lgl_retry.DEFAULT_BASE_DELAY),
+            max_delay=c.getfloat('retry', 'max_delay', fallback=lgl_retry.DEFAULT_MAX_DELAY),
+            breaker_threshold=c.getint('retry', 'breaker_threshold', fallback=lgl_retry.DEFAULT_BREAKER_THRESHOLD),
+            breaker_pause=c.getfloat('retry', 'breaker_pause', fallback=lgl_retry.DEFAULT_BREAKER_PAUSE),
+            max_pauses=c.getint('retry', 'max_pauses', fallback=lgl_retry.DEFAULT_MAX_PAUSES))
+        self._name_index = None  # The NameIndex is built from the mirror the first time it is needed.
+        self._name_index_sync = None  # The mirror's last_sync when the NameIndex was built.
+        self._name_index_lock = threading.Lock()
 
-    # This method will search for a name in LGL's database.
+    # This method will search for a name in LGL's database.  The email is searched first.  If it isn't found, the
+    # search variants for the name (see name_parser.py) are searched until one of them finds something.  The order
+    # of the variants, and whether the email is searched at all, depends on what has worked for the source before
+    # (see lgl_search_stats.py).
     #
     # Args:
     #   name - the name of the constituent
     #   email - the email address of the constituent (optional)
+    #   source - the source of the input file, like "Benevity" (optional)
+    #   status_codes - (opt) a list that the HTTP status code of each search is added to.  If any of them isn't 200,
+    #       the donor may be in LGL even though nothing was found.
+    #   found_steps - (opt) a list that the search step that found something (like STEP_EMAIL or one of the steps in
+    #       name_parser.py) is added to.
     #
     # Returns - a dict containing the name information from LGL
-    def find_constituent(self, name, email=None):
+    def find_constituent(self, name, email=None, source=None, status_codes=None, found_steps=None):
         log.debug('Entering with name: "{}"'.format(name))
         if not name and not email:
             return {}
         data = {}
         # Try email first if it's there.  That will save a lot of extra calls trying to get the name right.
-        if email and str(email) != cc.EMPTY_CELL:
+        if email and str(email) != cc.EMPTY_CELL and not self.search_stats.should_skip(source=source, step=STEP_EMAIL):
             # Try the search by email if possible.
-            data = self._lgl_email_search(email=email)
-        # If the whole string is upper case, make it title case (first letter of every word is capital).
-        if name.isupper():
-            name = name.title()
-        # Remove noise words from the search terms.
-        noise_words = ['and', 'or', 'fund', '&']
-        # This list of words will be used to avoid the last couple tests as there can be errors otherwise.
-        middle_words = ['bank', 'jr', 'sr', ' i', ' ii', ' iii']
-        query_words = name.split(' ')
-        name_words = [word.replace('.', '') for word in query_words if word.lower() not in noise_words]
-        search_terms = ' '.join(name_words)
-        # search_terms = re.sub(r'([A-Z])([A-Z])', r'\1 \2', search_terms)  # Put spaces between consecutive capitals
-        # search_terms = re.sub(r'\B[A-Z]', r' \g<0>', search_terms)  # Handle caps without a space prior
-        # Search for the name.
-        if 'items' not in data or not data['items']:
-            data = self._lgl_name_search(name=search_terms)
-        # If that fails, try to remove any initials.
-        if 'items' not in data or not data['items']:
-            search_terms = re.sub(r'([A-Z])([A-Z])', r'\1 \2', search_terms)  # Put spaces between consecutive capitals
-            data = self._lgl_name_search(name=search_terms)
-        if ('items' not in data or not data['items']) and ('bank' not in search_terms.lower()):
-            search_terms = re.sub(r'\B[A-Z]', r' \g<0>', search_terms)  # Handle caps without a space prior
-            data = self._lgl_name_search(name=search_terms)
-        if ('items' not in data or not data['items']) and any(word in search_terms.lower() for word in middle_words):
-            search_terms = re.sub(r'(\w*)\b[a-zA-Z]\b(\w*)', r'\1\2', search_terms)  # Remove single letter initials
-            data = self._lgl_name_search(name=search_terms)
-        if ('items' not in data or not data['items']) and any(word in search_terms.lower() for word in middle_words):
-            # Try to remove middle names by removing every second word (Mary Louise Parker becomes Mary Parker).
-            search_terms = re.sub(r'(\b\w+) \b\w+ (\b\w+)', r'\1 \2', search_terms)
-            data = self._lgl_name_search(name=search_terms)
+            data = self._lgl_email_search(email=email, status_codes=status_codes)
+            self.search_stats.record(source=source, step=STEP_EMAIL, hit=_is_single_match(data))
+        if 'items' in data and data['items']:
+            if found_steps is not None:
+                found_steps.append(STEP_EMAIL)
+            return data
+        step_order = self.search_stats.get_step_order(source=source, steps=name_parser.STEP_ORDER)
+        for (step, search_terms) in name_parser.get_search_variants(name=name, step_order=step_order):
+            data = self._lgl_name_search(name=search_terms, status_codes=status_codes)
+            self.search_stats.record(source=source, step=step, hit=_is_single_match(data))
+            if 'items' in data and data['items']:
+                log.debug('The "{}" search for "{}" found {} match(es).'.format(step, name, len(data['items'])))
+                if found_steps is not None:
+                    found_steps.append(step)
+                break
         return data
 
     # This method will find the ID of a constituent based on the name.
@@ -108,33 +197,97 @@ class LglApi:
     #   name - the name of the constituent
     #   email - the email address of the constituent (optional)
     #   file_name - the name of the file that contains the data for error messages (optional)
+    #   source - the source of the input file, like "Benevity" (optional)
     #
     # Returns - the LGL constituent ID
-    def find_constituent_id(self, name, email=None, file_name=None):
+    def find_constituent_id(self, name, email=None, file_name=None, source=None):
         log.debug('Entering for "{}"'.format(name))
         if not file_name:
             file_name = 'Input File Unknown'
-        data = self.find_constituent(name=name, email=email)
+        cid = self.cache.get_constituent_id(name=name, email=email)
+        if cid:
+            return cid
+        cid = self._find_constituent_id_in_mirror(name=name, email=email)
+        if cid:
+            self.cache.put_constituent_id(name=name, email=email, constituent_id=cid)
+            return cid
+        if self.fuzzy_match:
+            cid = self._find_similar_constituent_id(name=name)
+            if cid:
+                return cid
+        if self.cache.is_not_found(name=name, email=email, source=source):
+            log.info(ml.save('The constituent "{}" from the file "{}" was not found (on an earlier search).'.format(
+                name, file_name)))
+            return ''
+        status_codes = []
+        found_steps = []
+        data = self.find_constituent(name=name, email=email, source=source, status_codes=status_codes,
+                                     found_steps=found_steps)
         if 'items' in data.keys() and data['items']:
-            cid = ''
-            if len(data['items']) > 1:
-                msg = 'The name "{}"'.format(name)
-                if email:
-                    msg += ', email "{}"'.format(email)
-                msg += ' matches {} accounts'.format(str(len(data['items'])))
-                sep = ':'
-                for constituent in data['items']:
-                    msg += sep + ' "' + constituent['addressee'] + '" (' + str(constituent['id']) + ')'
-                    sep = ','
-                log.info(ml.save(msg))
-            else:
+            if len(data['items']) == 1:
                 cid = data['items'][0]['id']
                 log.debug('The constituent ID is {}.'.format(cid))
+                # A search that left part of the name out may have found someone else, so the ID isn't saved.  That
+                # also keeps the donor's external keys from being saved (see constituent_resolver.py).
+                if not any(step in name_parser.REDUCED_STEPS for step in found_steps):
+                    self.cache.put_constituent_id(name=name, email=email, constituent_id=cid)
+                return cid
+            cid = self._pick_best_item(name=name, items=data['items'])
+            if cid and self.fuzzy_match:
+                return cid
+            msg = 'The name "{}"'.format(name)
+            if email:
+                msg += ', email "{}"'.format(email)
+            msg += ' matches {} accounts'.format(str(len(data['items'])))
+            sep = ':'
+            for constituent in data['items']:
+                msg += sep + ' "' + constituent['addressee'] + '" (' + str(constituent['id']) + ')'
+                sep = ','
+            if cid:
+                best = [constituent for constituent in data['items'] if constituent['id'] == cid][0]
+                msg += '.  The closest match is "{}" ({}).'.format(best['addressee'], cid)
+            log.info(ml.save(msg))
+            cid = ''
         else:
             cid = ""
-            log.info(ml.save('The constituent "{}" from the file "{}" was not found.'.format(name, file_name)))
+            msg = 'The constituent "{}" from the file "{}" was not found.'.format(name, file_name)
+            suggestion = self._find_similar_constituent_id(name=name)
+            if suggestion:
+                msg += '  The closest name in the mirror is {}.'.format(self._describe_constituent(suggestion))
+            log.info(ml.save(msg))
+            # A search that failed (like a 401 for a bad token) doesn't mean the donor isn't in LGL.
+            if all(status_code == 200 for status_code in status_codes):
+                self.cache.put_not_found(name=name, email=email, source=source)
         return cid
 
+    # This method will estimate the number of calls to LGL that find_constituent_id will make for a donor, without
+    # making any calls.  Donors that are in the cache, in the mirror, or were not found on an earlier search don't
+    # need any calls.  Otherwise each search step is counted by the chance that it will be tried (see
+    # LglSearchStats.get_expected_calls).  The cache statistics are not changed.
+    #
+    # Args:
+    #   name - the name of the constituent
+    #   email - the email address of the constituent (optional)
+    #   source - the source of the input file, like "Benevity" (optional)
+    #
+    # Returns - the expected number of calls
+    def estimate_calls(self, name, email=None, source=None):
+        if self.cache.get_constituent_id(name=name, email=email, count_stats=False):
+            return 0.0
+        if self._find_constituent_id_in_mirror(name=name, email=email):
+            return 0.0
+        if self.fuzzy_match and self._find_similar_constituent_id(name=name):
+            return 0.0
+        if self.cache.is_not_found(name=name, email=email, source=source, count_stats=False):
+            return 0.0
+        steps = []
+        if email and str(email) != cc.EMPTY_CELL and \
+                not self.search_stats.should_skip(source=source, step=STEP_EMAIL, explore=False):
+            steps.append(STEP_EMAIL)
+        step_order = self.search_stats.get_step_order(source=source, steps=name_parser.STEP_ORDER, explore=False)
+        steps += [step for (step, _) in name_parser.get_search_variants(name=name, step_order=step_order)]
+        return self.search_stats.get_expected_calls(source=source, steps=steps)
+
     # This method makes the call to retrieve constituent details from LGL.
     #
     # Args -
@@ -166,7 +319,7 @@ class LglApi:
     #    'updated_at': '2019-06-18T15:50:34Z'}]}], 'groups': [], 'memberships': [], 'custom_attrs': []}
     def get_constituent_info(self, constituent_id):
         id_url = URL_CONSTITUENT_DETAILS + str(constituent_id)
-        data = self._lgl_api(url=id_url)
+        data = self._lgl_api(url=id_url, priority=lgl_call_scheduler.VERIFICATION)
         return data
 
     # This method gets the gifts history of the constituent.
@@ -187,63 +340,277 @@ class LglApi:
     #   ]
     def get_donations(self, constituent_id):
         url = URL_CONSTITUENT_DONATIONS.format(constituent_id)
-        data = self._lgl_api(url=url)
+        data = self._lgl_api(url=url, priority=lgl_call_scheduler.ENRICHMENT)
         if 'items' in data.keys():
             return data['items']
         else:
             return []
 
+    # This method gets one page of LGL's list of constituents.  It is used to fill the constituent mirror.
+    #
+    # Args -
+    #   offset - the number of constituents to skip
+    #   limit - the number of constituents to return
+    #
+    # Returns - a dict in the format:
+    #   {'api_version': '1.0', 'items_count': n, 'total_items': n, 'limit': n, 'offset': n,
+    #    'item_type': 'constituent', 'items': [{...}, ...]}
+    #   The items have the same format as get_constituent_info.
+    def get_constituents(self, offset=0, limit=lgl_mirror.PAGE_SIZE):
+        return self._lgl_api(url=URL_CONSTITUENTS, url_params={'offset': offset, 'limit': limit})
+
+    # This method gets one page of the constituents that were updated in LGL on or after a date.  It is used to keep
+    # the constituent mirror up to date.
+    #
+    # Args -
+    #   updated_from - the date in the format 'YYYY-MM-DD'
+    #   offset - the number of constituents to skip
+    #   limit - the number of constituents to return
+    #
+    # Returns - the same format as get_constituents
+    def get_updated_constituents(self, updated_from, offset=0, limit=lgl_mirror.PAGE_SIZE):
+        return self._lgl_search(search_terms='updated_from=' + updated_from, offset=offset, limit=limit)
+
     # ----- P R I V A T E   M E T H O D S ----- #
 
+    # This private method will look for a constituent in the local mirror of LGL.  The email is tried first and then
+    # the name.  An ID is only returned if exactly one constituent matches.
+    #
+    # Args -
+    #   name - the name of the constituent
+    #   email - the email address of the constituent (optional)
+    #
+    # Returns - the LGL constituent ID or '' if the mirror can't answer.  LGL should be searched in that case.
+    def _find_constituent_id_in_mirror(self, name, email=None):
+        if not self.mirror.available:
+            return ''
+        for cids in (self.mirror.find_ids_by_email(email=email), self.mirror.find_ids_by_name(name=name)):
+            if len(cids) == 1:
+                log.debug('The constituent ID {} was found in the mirror.'.format(cids[0]))
+                return cids[0]
+        return ''
+
+    # This private method will ask the NameIndex of the names in the mirror for a clear best match for a name that
+    # doesn't exactly match any constituent.  The match is a suggestion (see the comment at the top of the file).
+    #
+    # Args -
+    #   name - the name of the constituent
+    #
+    # Returns - the LGL constituent ID or '' if there is no clear best match
+    def _find_similar_constituent_id(self, name):
+        if not self.mirror.available or not name or str(name) == cc.EMPTY_CELL:
+            return ''
+        cid = self._get_name_index().find_best_match(name=name)
+        if cid:
+            log.debug('The constituent ID {} was found in the name index for "{}".'.format(cid, name))
+        return cid
+
+    # This private method describes a constituent in the mirror for a message, like: "Carolyn & Andy Limeri" (956522)
+    def _describe_constituent(self, constituent_id):
+        constituent = self.mirror.get_constituent(constituent_id=constituent_id) or {}
+        name = constituent.get('addressee') or constituent.get('sort_name') or constituent.get('org_name')
+        return '"{}" ({})'.format(name, constituent_id) if name else '({})'.format(constituent_id)
+
+    # This private method will get the NameIndex of the names in the mirror.  It is built the first time it is
+    # needed and again whenever the mirror has been synced since it was built.
+    #
+    # Returns - the NameIndex object
+    def _get_name_index(self):
+        last_sync = self.mirror.get_info(key='last_sync')
+        with self._name_index_lock:
+            if self._name_index is None or self._name_index_sync != last_sync:
+                index = name_index.NameIndex()
+                for (constituent_id, name) in self.mirror.get_names():
+                    index.add(constituent_id=constituent_id, name=name)
+                log.debug('The name index was built with {} constituents.'.format(len(index)))
+                self._name_index = index
+                self._name_index_sync = last_sync
+            return self._name_index
+
+    # This private method will choose between the constituents returned by an LGL search by ranking how well their
+    # names match the name being looked for.
+    #
+    # Args -
+    #   name - the name of the constituent
+    #   items - the constituents returned by the search
+    #
+    # Returns - the LGL constituent ID or '' if no constituent is a clear best match
+    def _pick_best_item(self, name, items):
+        if not name or str(name) == cc.EMPTY_CELL:
+            return ''
+        candidates = []
+        for constituent in items:
+            for key in ['addressee', 'sort_name', 'org_name']:
+                if constituent.get(key):
+                    candidates.append((constituent['id'], constituent[key]))
+        # Each constituent only counts once, with the score of its best name.
+        scores = []
+        for (score, constituent_id) in name_index.NameIndex().rank(name=name, candidates=candidates):
+            if constituent_id not in [scored_id for (_, scored_id) in scores]:
+                scores.append((score, constituent_id))
+        cid = name_index.pick_best_match(scores)
+        if cid:
+            log.debug('The constituent ID {} is the best of {} matches for "{}".'.format(cid, len(items), name))
+        return cid
+
+    # This private method will get the constituent ID cache, creating it the first time it is needed.  If the cache
+    # file can't be used (it is locked, read-only or corrupt), the cache is turned off for this run.
+    #
+    # Args -
+    #   config - the ConfigParser with the contents of the properties file
+    #   application_path - the directory with the properties file.  The cache file is relative to it.
+    #
+    # Returns - the LglCache object
+    def _get_cache(self, config, application_path):
+        global cache
+        if cache is None:
+            cache_file = os.path.join(application_path, config.get('cache', 'cache_file',
+                                                                   fallback=lgl_cache.DEFAULT_CACHE_FILE))
+            ttl_days = config.getint('cache', 'ttl_days', fallback=lgl_cache.DEFAULT_TTL_DAYS)
+            not_found_ttl_days = config.getint('cache', 'not_found_ttl_days',
+                                               fallback=lgl_cache.DEFAULT_NOT_FOUND_TTL_DAYS)
+            external_ttl_days = config.getint('cache', 'external_ttl_days',
+                                              fallback=lgl_cache.DEFAULT_EXTERNAL_TTL_DAYS)
+            try:
+                cache = lgl_cache.LglCache(cache_file=cache_file, ttl_days=ttl_days,
+                                           not_found_ttl_days=not_found_ttl_days, external_ttl_days=external_ttl_days)
+            except sqlite3.Error as e:
+                log.warning('The cache "{}" can not be used ({}).  Constituent IDs will not be cached.'.format(
+                    cache_file, e))
+                cache = lgl_cache.LglCache(cache_file=cache_file, ttl_days=0)
+        return cache
+
+    # This private method will create the search statistics.  They are kept in the cache file.  If it can't be used,
+    # the statistics are only kept in memory for this run.
+    #
+    # Args -
+    #   config - the ConfigParser with the contents of the properties file
+    #
+    # Returns - the LglSearchStats object
+    def _get_search_stats(self, config):
+        settings = {'adaptive': config.getboolean('search', 'adaptive', fallback=True),
+                    'min_attempts': config.getint('search', 'min_attempts',
+                                                  fallback=lgl_search_stats.DEFAULT_MIN_ATTEMPTS),
+                    'explore_rate': config.getfloat('search', 'explore_rate',
+                                                    fallback=lgl_search_stats.DEFAULT_EXPLORE_RATE)}
+        try:
+            return lgl_search_stats.LglSearchStats(stats_file=self.cache.cache_file, **settings)
+        except sqlite3.Error as e:
+            log.warning('The search statistics in "{}" can not be used ({}).  They will only be kept for this '
+                        'run.'.format(self.cache.cache_file, e))
+            return lgl_search_stats.LglSearchStats(stats_file=':memory:', **settings)
+
+    # This private method will create the local copy of LGL's constituents.  If the mirror file can't be used, the
+    # mirror is turned off for this run and LGL is searched instead.
+    #
+    # Args -
+    #   config - the ConfigParser with the contents of the properties file
+    #   application_path - the directory with the properties file.  The mirror file is relative to it.
+    #
+    # Returns - the LglMirror object
+    def _get_mirror(self, config, application_path):
+        mirror_file = os.path.join(application_path, config.get('mirror', 'mirror_file',
+                                                                 fallback=lgl_mirror.DEFAULT_MIRROR_FILE))
+        try:
+            return lgl_mirror.LglMirror(mirror_file=mirror_file,
+                                        enabled=config.getboolean('mirror', 'enabled', fallback=True),
+                                        full_sync_days=config.getint('mirror', 'full_sync_days',
+                                                                     fallback=lgl_mirror.DEFAULT_FULL_SYNC_DAYS),
+                                        max_age_days=config.getint('mirror', 'max_age_days',
+                                                                   fallback=lgl_mirror.DEFAULT_MAX_AGE_DAYS))
+        except sqlite3.Error as e:
+            log.warning('The mirror "{}" can not be used ({}).  LGL will be searched instead.'.format(mirror_file, e))
+            return lgl_mirror.LglMirror(mirror_file=mirror_file, enabled=False)
+
+    # This private method will create the HTTP session used for all calls to LGL.  The session keeps the connections
+    # to LGL open (keep-alive), so the TCP and TLS handshakes are only done when a new connection is needed.
+    #
+    # Args -
+    #   pool_size - the maximum number of connections to keep open to LGL
+    #
+    # Returns - a requests.Session object
+    def _create_session(self, pool_size):
+        session = requests.Session()
+        # pool_block keeps the number of connections at pool_size even if more threads than that are making calls.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        session.mount(URL_LGL, adapter)
+        return session
+
     # This private method is a convenience method for _lgl_search.  It just adds "name=" to the search target.
-    def _lgl_name_search(self, name):
+    def _lgl_name_search(self, name, status_codes=None):
         if not name or name == cc.EMPTY_CELL:
             return {}
-        return self._lgl_search(search_terms='name=' + name)
+        return self._lgl_search(search_terms='name=' + name, status_codes=status_codes)
 
     # This private method is a convenience method for _lgl_search.  It just adds "eaddr=" to the search target.
-    def _lgl_email_search(self, email):
+    def _lgl_email_search(self, email, status_codes=None):
         if not email or email == cc.EMPTY_CELL:
             return {}
-        return self._lgl_search(search_terms='eaddr=' + email)
+        return self._lgl_search(search_terms='eaddr=' + email, status_codes=status_codes)
 
     # This private method makes the call to search LGL.
     #
     # Args -
     #   search_terms - a string with the search term (name='xxx')
+    #   offset - (opt) the first result to return
+    #   limit - (opt) the number of results to return
+    #   status_codes - (opt) a list that the HTTP status code of the call is added to
     #
     # Returns - a dict with the response object in json format:
     #   {'api_version': '1.0', 'items_count': n, 'total_items': n, 'limit': n, 'offset': n,
     #    'item_type': 'constituent', 'items': {...}}
-    def _lgl_search(self, search_terms):
+    def _lgl_search(self, search_terms, offset=None, limit=None, status_codes=None):
         search_params = {'q': search_terms}
-        data = self._lgl_api(url=URL_SEARCH_CONSTITUENT, url_params=search_params)
+        if offset is not None:
+            search_params['offset'] = offset
+        if limit is not None:
+            search_params['limit'] = limit
+        data = self._lgl_api(url=URL_SEARCH_CONSTITUENT, url_params=search_params, status_codes=status_codes)
         log.debug('The json response is: {}'.format(data))
         return data
 
-    # This private method makes a call to the LGL API so that error handling is consistent with all calls.
+    # This private method makes a call to the LGL API so that error handling is consistent with all calls.  Calls
+    # that fail because LGL is busy or can't be reached are retried by the RetryPolicy.  A call that still fails after
+    # its retries is reported and returns an empty dict.  The program only ends if LGL still can't be reached after
+    # the circuit breaker pauses.
+    #
     # Args -
     #   url - the URL
     #   params - the parameters
+    #   priority - (opt) the priority of the call (see lgl_call_scheduler.py).  Defaults to RESOLUTION.
+    #   status_codes - (opt) a list that the HTTP status code of the response is added to
     #
     # Returns - the response object in json format
-    def _lgl_api(self, url, url_params={}):
+    def _lgl_api(self, url, url_params=None, priority=lgl_call_scheduler.RESOLUTION, status_codes=None):
+        url_params = dict(url_params or {})  # Copy the parameters so the caller's dict is not changed.
         url_params['access_token'] = self.lgl_api_token
         log.debug('The URL is "{}" and the parameters are: "{}".'.format(url, url_params))
-        response = requests.get(url=url, params=url_params)
-        if response.status_code != 200:
-            self._handle_error(error_code=response.status_code, url=url, params=url_params)
-        if hasattr(self, 'status_code') and self.status_code and self.status_code == 429:
-            fatal_msg = 'Little Green Light has exceeded the number of calls it allows in a five minute period '\
-                        + 'and is not responding.  Please try again later.'
-            self._handle_error(error_code=self.status_code,
+
+        def request():
+            scheduler.acquire(priority=priority)  # This may pause the program if too many calls have been made.
+            return self.session.get(url=url, params=url_params, timeout=self.timeout)
+
+        try:
+            response = self.retry_policy.call(request=request)
+        except lgl_retry.LglUnavailableError as e:
+            fatal_msg = 'Little Green Light is not responding or has exceeded the number of calls it allows in a ' \
+                        'five minute period ({}).  Please try again later.'.format(e)
+            self._handle_error(error_code=e.status_code,
                                url=url,
                                params=url_params,
                                fatal=True,
                                fatal_error_msg=fatal_msg)
+        except lgl_retry.LglCallError as e:
+            if status_codes is not None:
+                status_codes.append(e.status_code)
+            self._handle_error(error_code=e.status_code, url=url, params=url_params)
+            return {}
+        if status_codes is not None:
+            status_codes.append(response.status_code)
+        if response.status_code != 200:
+            self._handle_error(error_code=response.status_code, url=url, params=url_params)
         data = response.json()
         log.debug('The json response is: {}'.format(data))
-        call_tracker.increment_call_count()
         return data
 
     # This private method is a generic error handler for calls to LGL.  It will document the error and stop
@@ -271,10 +638,16 @@ class LglApi:
             sys.exit(1)
 
 
+# This private function tells if an LGL search found exactly one constituent.  Only that gives the donor an ID, so it
+# is what counts as a hit in the search statistics.
+def _is_single_match(data):
+    return len(data.get('items') or []) == 1
+
+
 # Test that the find_constituent_by_name method is working.
 def run_find_constituent_test():
     import time
-    lgl = LglApi()
+    lgl = get_lgl_api()
     search_values = [
         {'name': 'Carolyn and Andy Limeri', 'email': ''},
         {'name': 'D.H. and A.G. Talamo', 'email': ''},
@@ -294,7 +667,7 @@ def run_find_constituent_test():
 
 # Test that the find_constituent_id_by_name method is working.
 def run_find_constituent_id_by_name_test():
-    lgl = LglApi()
+    lgl = get_lgl_api()
     # cid = lgl.find_constituent_id(name="Carolyn and Andy Limeri")
     cid = lgl.find_constituent_id(name="Fidelity")
     log.debug("The ID is: {}".format(cid))
@@ -302,7 +675,7 @@ def run_find_constituent_id_by_name_test():
 
 # Test that the get_constituent_info method is working.
 def run_get_constituent_info_test():
-    lgl = LglApi()
+    lgl = get_lgl_api()
     test_id = sample.ID_LIMERI
     data = lgl.get_constituent_info(constituent_id=test_id)
     log.debug('The data for {} is:\n{}'.format(test_id, data.__repr__()))
@@ -310,7 +683,7 @@ def run_get_constituent_info_test():
 
 # Test the get_donations method.
 def run_get_donations_test():
-    lgl = LglApi()
+    lgl = get_lgl_api()
     cid = sample.ID_LIMERI
     donations = lgl.get_donations(constituent_id=cid)
     log.debug('The donation data for "{}" is:\n{}'.format(cid, donations.__repr__()))
@@ -0,0 +1,305 @@
+# This class manages a persistent cache of LGL constituent IDs.  Every run of donor_etl used to resolve every donor
+# name from scratch, even though most of the donors in a monthly file gave the month before.  The cache stores the
+# name/email -> constituent ID results in a small SQLite database so that repeat donors cost zero calls to LGL.
+#
+# The cache settings are in the "cache" section of the donor_etl.properties file.  An example is below:
+#
+# [cache]
+# cache_file: lgl_cache.db
+# ttl_days: 30
+# not_found_ttl_days: 3
+# external_ttl_days: 180
+#
+# ttl_days is the number of days an entry is trusted before it is looked up again.  A value of 0 turns the cache off.
+#
+# Donors that were not found in LGL are saved too, so that a donor who isn't in LGL yet doesn't cost a full series of
+# searches every time they show up in a file.  These entries are kept for not_found_ttl_days, which should be short
+# because the donor will usually be added to LGL soon.  A value of 0 turns this off.  The entries are kept for each
+# source separately, since the same name can be found from one source (by its email) and not from another.
+#
+# Some sources have their own IDs for donors, like the Stripe customer ID or the Fidelity giving account name.  Once
+# a donor has been found, these "external keys" are saved with the constituent ID.  A donor with a saved external key
+# is found without searching, even if the name is written differently.  Only donors that matched exactly one
+# constituent are saved this way (see ConstituentResolver.resolve).  These entries are kept for external_ttl_days.
+# They are also removed with the rest of a constituent's entries by invalidate_constituent, and by clear.
+
+import logging
+import sqlite3
+import threading
+import time
+
+import column_constants as cc
+
+DEFAULT_CACHE_FILE = 'lgl_cache.db'
+DEFAULT_TTL_DAYS = 30
+DEFAULT_NOT_FOUND_TTL_DAYS = 3
+DEFAULT_EXTERNAL_TTL_DAYS = 180
+SECONDS_PER_DAY = 24 * 60 * 60
+NOT_SHARED_VALUES = ['not shared by donor', 'anonymous']  # Values that aren't really IDs.
+
+log = logging.getLogger()
+
+
+class LglCache:
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, ttl_days=DEFAULT_TTL_DAYS,
+                 not_found_ttl_days=DEFAULT_NOT_FOUND_TTL_DAYS, external_ttl_days=DEFAULT_EXTERNAL_TTL_DAYS):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_days * SECONDS_PER_DAY
+        self.not_found_ttl_seconds = not_found_ttl_days * SECONDS_PER_DAY
+        self.external_ttl_seconds = external_ttl_days * SECONDS_PER_DAY
+        self.hits = 0
+        self.misses = 0
+        self.not_found_hits = 0  # The number of lookups skipped because the donor was known not to be in LGL.
+        self.not_found_saved = 0  # The number of donors that were saved as not found in this run.
+        self.external_hits = 0  # The number of donors found by their external keys.
+        self._connection = None
+        self._lock = threading.RLock()  # The cache is used by all the threads resolving constituent IDs.
+        if self.enabled:
+            self._connection = sqlite3.connect(cache_file, check_same_thread=False)
+            self._create_tables()
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0
+
+    # This method will look up the constituent ID for a name and email.
+    #
+    # Args -
+    #   name - the name of the constituent
+    #   email - the email address of the constituent (optional)
+    #   count_stats - (opt) False will not count the lookup as a hit or miss.  This is used when planning a run.
+    #
+    # Returns - the LGL constituent ID or None if the name/email is not in the cache (or the entry has expired)
+    def get_constituent_id(self, name, email=None, count_stats=True):
+        if not self.enabled:
+            return None
+        key = make_key(name=name, email=email)
+        with self._lock:
+            row = self._connection.execute('SELECT constituent_id, updated FROM constituent_ids '
+                                           'WHERE lookup_key = ?', (key,)).fetchone()
+            if not row or (time.time() - row[1]) > self.ttl_seconds:
+                self.misses += 1 if count_stats else 0
+                log.debug('Cache miss for "{}".'.format(key))
+                return None
+            self.hits += 1 if count_stats else 0
+        log.debug('Cache hit for "{}": {}.'.format(key, row[0]))
+        return row[0]
+
+    # This method will save the constituent ID for a name and email.
+    #
+    # Args -
+    #   name - the name of the constituent
+    #   email - the email address of the constituent (optional)
+    #   constituent_id - the LGL constituent ID
+    def put_constituent_id(self, name, email, constituent_id):
+        if not self.enabled or not constituent_id:
+            return
+        key = make_key(name=name, email=email)
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO constituent_ids (lookup_key, constituent_id, updated) '
+                                     'VALUES (?, ?, ?)', (key, str(constituent_id), time.time()))
+
+    # This method will look up the constituent ID for an external key.
+    #
+    # Args -
+    #   external_key - the key made by make_external_key
+    #   count_stats - (opt) False will not count the lookup as a hit.  This is used when planning a run.
+    #
+    # Returns - the LGL constituent ID or None if the key has not been saved (or the entry has expired)
+    def get_external_id(self, external_key, count_stats=True):
+        if not self.enabled or not external_key:
+            return None
+        with self._lock:
+            row = self._connection.execute('SELECT constituent_id, updated FROM external_ids WHERE external_key = ?',
+                                           (external_key,)).fetchone()
+            if not row or (time.time() - row[1]) > self.external_ttl_seconds:
+                return None
+            self.external_hits += 1 if count_stats else 0
+        log.debug('External key hit for "{}": {}.'.format(external_key, row[0]))
+        return row[0]
+
+    # This method will save the constituent ID for an external key.
+    #
+    # Args -
+    #   external_key - the key made by make_external_key
+    #   constituent_id - the LGL constituent ID
+    def put_external_id(self, external_key, constituent_id):
+        if not self.enabled or not external_key or not constituent_id:
+            return
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO external_ids (external_key, constituent_id, updated) '
+                                     'VALUES (?, ?, ?)', (external_key, str(constituent_id), time.time()))
+
+    # This method will tell if a name and email were recently searched for in LGL and not found.
+    #
+    # Args -
+    #   name - the name of the constituent
+    #   email - the email address of the constituent (optional)
+    #   source - the source of the input file, like "Benevity" (optional)
+    #   count_stats - (opt) False will not count the lookup as skipped.  This is used when planning a run.
+    #
+    # Returns - True if the donor was not found in LGL less than not_found_ttl_days ago
+    def is_not_found(self, name, email=None, source=None, count_stats=True):
+        if not self.enabled or self.not_found_ttl_seconds <= 0:
+            return False
+        key = make_not_found_key(name=name, email=email, source=source)
+        with self._lock:
+            row = self._connection.execute('SELECT updated FROM not_found WHERE lookup_key = ?', (key,)).fetchone()
+            if not row or (time.time() - row[0]) > self.not_found_ttl_seconds:
+                return False
+            self.not_found_hits += 1 if count_stats else 0
+        log.debug('"{}" is known not to be in LGL.'.format(key))
+        return True
+
+    # This method will save a name and email that could not be found in LGL.
+    #
+    # Args -
+    #   name - the name of the constituent
+    #   email - the email address of the constituent (optional)
+    #   source - the source of the input file, like "Benevity" (optional)
+    def put_not_found(self, name, email=None, source=None):
+        if not self.enabled or self.not_found_ttl_seconds <= 0:
+            return
+        key = make_not_found_key(name=name, email=email, source=source)
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO not_found (lookup_key, updated) VALUES (?, ?)',
+                                     (key, time.time()))
+            self.not_found_saved += 1
+
+    # This method will forget all the donors that were not found in LGL so they are searched for again.  This
+    # should be used after the missing donors have been added to LGL.
+    def clear_not_found(self):
+        if not self.enabled:
+            return
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM not_found')
+
+    # This method will remove a single name/email from the cache.  This should be used when a constituent is
+    # merged or deleted in LGL and the cached ID is no longer correct.
+    #
+    # Args -
+    #   name - the name of the constituent
+    #   email - the email address of the constituent (optional)
+    def invalidate(self, name, email=None):
+        if not self.enabled:
+            return
+        key = make_key(name=name, email=email)
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM constituent_ids WHERE lookup_key = ?', (key,))
+
+    # This method will remove every entry that points at a constituent ID.
+    #
+    # Args -
+    #   constituent_id - the LGL constituent ID
+    def invalidate_constituent(self, constituent_id):
+        if not self.enabled:
+            return
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM constituent_ids WHERE constituent_id = ?', (str(constituent_id),))
+            self._connection.execute('DELETE FROM external_ids WHERE constituent_id = ?', (str(constituent_id),))
+
+    # This method will empty the cache, including the donors that were not found and the external keys.
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM constituent_ids')
+            self._connection.execute('DELETE FROM not_found')
+            self._connection.execute('DELETE FROM external_ids')
+
+    # This method will create a message with the number of hits and misses that can be shown to the user.
+    def get_stats_message(self):
+        return 'The constituent ID cache had {} hit(s) and {} miss(es), and {} donor(s) were found by their ' \
+               'source IDs.  {} donor(s) were skipped because they were not found in LGL recently and {} new ' \
+               'donor(s) were not found.'.format(self.hits, self.misses, self.external_hits, self.not_found_hits,
+                                                 self.not_found_saved)
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method creates the cache table if it doesn't exist yet.
+    def _create_tables(self):
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS constituent_ids ('
+                                     'lookup_key TEXT PRIMARY KEY, '
+                                     'constituent_id TEXT NOT NULL, '
+                                     'updated REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS constituent_ids_id '
+                                     'ON constituent_ids (constituent_id)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS external_ids ('
+                                     'external_key TEXT PRIMARY KEY, '
+                                     'constituent_id TEXT NOT NULL, '
+                                     'updated REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS external_ids_id '
+                                     'ON external_ids (constituent_id)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS not_found ('
+                                     'lookup_key TEXT PRIMARY KEY, '
+                                     'updated REAL NOT NULL)')
+
+
+# This function makes the cache key from a name and email.  Names are case insensitive and extra whitespace is
+# ignored so that "JOHN  SMITH" and "John Smith" share an entry.
+#
+# Args -
+#   name - the name of the constituent
+#   email - the email address of the constituent (optional)
+#
+# Returns - a string to use as the cache key
+def make_key(name, email=None):
+    name = ' '.join(str(name).lower().split()) if name and str(name) != cc.EMPTY_CELL else ''
+    email = str(email).lower().strip() if email and str(email) != cc.EMPTY_CELL else ''
+    return name + '|' + email
+
+
+# This function makes the key for a donor that was not found.  It is the cache key with the source in front of it.
+#
+# Args -
+#   name - the name of the constituent
+#   email - the email address of the constituent (optional)
+#   source - the source of the input file, like "Benevity" (optional)
+#
+# Returns - a string to use as the key
+def make_not_found_key(name, email=None, source=None):
+    return (source or '') + '|' + make_key(name=name, email=email)
+
+
+# This function makes the key for an ID that a source uses for a donor, like a Stripe customer ID.  Case and extra
+# whitespace are ignored.
+#
+# Args -
+#   source - the source of the input file, like "Stripe"
+#   key_name - the name of the column with the ID, like "Customer ID"
+#   value - the ID
+#
+# Returns - a string to use as the key or '' if there is no ID
+def make_external_key(source, key_name, value):
+    value = str(value).lower().strip() if value is not None else ''
+    if not value or value == cc.EMPTY_CELL or value in NOT_SHARED_VALUES:
+        return ''
+    return '{}|{}|{}'.format(source, key_name, value)
+
+
+# Test that the cache saves, expires, and invalidates IDs.
+def run_cache_test():
+    cache = LglCache(cache_file=':memory:')
+    cache.put_constituent_id(name='Carolyn and Andy Limeri', email='', constituent_id=956522)
+    log.debug('The ID is {}.'.format(cache.get_constituent_id(name='CAROLYN AND ANDY LIMERI')))
+    cache.invalidate(name='Carolyn and Andy Limeri')
+    log.debug('The ID after invalidation is {}.'.format(cache.get_constituent_id(name='Carolyn and Andy Limeri')))
+    external_key = make_external_key(source='Stripe', key_name='Customer ID', value='cus_ABC123')
+    cache.put_external_id(external_key=external_key, constituent_id=956522)
+    log.debug('The ID for "{}" is {}.'.format(external_key, cache.get_external_id(external_key=external_key)))
+    cache.put_not_found(name='Bad Name', source='Benevity')
+    log.debug('"Bad Name" is not found for Benevity: {}, for Stripe: {}.'.format(
+        cache.is_not_found(name='Bad Name', source='Benevity'), cache.is_not_found(name='Bad Name', source='Stripe')))
+    log.debug(cache.get_stats_message())
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_cache_test()
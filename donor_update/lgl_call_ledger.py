@@ -0,0 +1,94 @@
+# This class keeps a ledger of the calls made to LGL in a SQLite database that every copy of donor_etl on this
+# computer uses.  LGL's limit of 300 calls every 5 minutes is for the API token, not for the program, so when the
+# GUI and the command line are run at the same time they have to share the calls.  Each copy of the program used to
+# count only its own calls, so together they went over the limit.
+#
+# Each call is saved with the time it was made and a hash of the API token (the token itself isn't saved).  Before a
+# call is made, the LglRateLimiter asks the ledger to reserve it.  The reservation counts the calls made in the
+# window by every program using the same token, and SQLite's locking makes sure that two programs can't both take
+# the last spot.
+#
+# The ledger settings are in the optional "rate_limit" section of the donor_etl.properties file.  An example is below:
+#
+# [rate_limit]
+# ledger_file: lgl_ledger.db
+# shared: yes
+
+import hashlib
+import logging
+import sqlite3
+import threading
+
+DEFAULT_LEDGER_FILE = 'lgl_ledger.db'
+LOCK_TIMEOUT = 30  # The number of seconds to wait for another program to finish with the ledger.
+
+log = logging.getLogger()
+
+
+class LglCallLedger:
+
+    def __init__(self, ledger_file=DEFAULT_LEDGER_FILE, api_token=''):
+        self.ledger_file = ledger_file
+        self.token_key = make_token_key(api_token=api_token)
+        self._lock = threading.Lock()
+        # The connection manages its own transactions so that a reservation can lock the ledger before it counts.
+        self._connection = sqlite3.connect(ledger_file, timeout=LOCK_TIMEOUT, isolation_level=None,
+                                           check_same_thread=False)
+        self._create_tables()
+
+    # This method will reserve a call if fewer than max_calls calls have been made in the last period seconds by
+    # all the programs using the same token.
+    #
+    # Args -
+    #   max_calls - the number of calls allowed in the window
+    #   period - the length of the window in seconds
+    #   now - the time of the call
+    #
+    # Returns - 0 if the call was reserved, otherwise the number of seconds until the oldest call leaves the window
+    # Raises - sqlite3.Error if the ledger can't be used
+    def reserve(self, max_calls, period, now):
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')  # Other programs wait here until this reservation is done.
+            try:
+                self._connection.execute('DELETE FROM calls WHERE token_key = ? AND called <= ?',
+                                         (self.token_key, now - period))
+                (count, oldest) = self._connection.execute('SELECT COUNT(*), MIN(called) FROM calls '
+                                                           'WHERE token_key = ?', (self.token_key,)).fetchone()
+                if count < max_calls:
+                    self._connection.execute('INSERT INTO calls (token_key, called) VALUES (?, ?)',
+                                             (self.token_key, now))
+                    wait_time = 0
+                else:
+                    wait_time = oldest + period - now
+                self._connection.execute('COMMIT')
+            except sqlite3.Error:
+                self._connection.execute('ROLLBACK')
+                raise
+        return wait_time
+
+    # This method gets the times of the calls made in the last period seconds by all the programs using the token.
+    #
+    # Returns - a list of times, oldest first
+    def get_call_times(self, period, now):
+        with self._lock:
+            rows = self._connection.execute('SELECT called FROM calls WHERE token_key = ? AND called > ? '
+                                            'ORDER BY called', (self.token_key, now - period)).fetchall()
+        return [row[0] for row in rows]
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method creates the ledger table if it doesn't exist yet.
+    def _create_tables(self):
+        with self._lock:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS calls (token_key TEXT NOT NULL, called REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS calls_token_called ON calls (token_key, called)')
+
+
+# This function makes the key used for a token in the ledger.  It is a hash so the token can't be read from the file.
+#
+# Args -
+#   api_token - the LGL API token
+#
+# Returns - a string to use as the key
+def make_token_key(api_token):
+    return hashlib.sha256(str(api_token).encode('utf-8')).hexdigest()[:16]
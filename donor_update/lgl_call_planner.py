@@ -0,0 +1,141 @@
+# This module plans the calls to LGL before a run starts.  All the input files are read before the first call to LGL
+# is made, so it is possible to work out how many calls the run will need and how long it will take.  LGL only allows
+# 300 calls every 5 minutes, so a big run can spend most of its time waiting.  Knowing that up front lets the user
+# decide whether to run now, run later, or split up the files (see the --dry-run option in donor_etl.py).
+#
+# The plan counts:
+#   - the searches for the unique donors that aren't already known.  A donor is unique for each source, the same way
+#     the ConstituentResolver looks them up (in the cache, the mirror, or found by their
+#     external keys).  Each donor is counted by the expected number of search steps, based on how often each step
+#     has found donors from the same source (see LglSearchStats.get_expected_calls),
+#   - the calls for the details of each donor when the addresses are checked for variances, unless the mirror
+#     already has fresh details for the donor.  Donors that still need a search are counted as if they will be
+#     found, so this is the most the variance checks can need, and
+#   - the extra calls made by the file readers, like the calls Stripe makes to look for recurring donations.
+#
+# The time is worked out from the calls left in the current window (see LglRateLimiter.get_remaining), the pauses
+# needed to stay under LGL's limit, and the time a call usually takes.
+
+import logging
+import math
+
+import constituent_resolver
+import lgl_api
+
+SECONDS_PER_CALL = 0.5  # About how long one call to LGL takes, including the network.
+
+log = logging.getLogger()
+
+
+class LglCallPlan:
+
+    def __init__(self):
+        self.files = 0  # The number of input files in the plan.
+        self.donors = 0  # The number of unique donors in all the input files, counted once for each source.
+        self.known_donors = 0  # The donors that don't need a search (known, or not found on an earlier search).
+        self.search_calls = 0.0  # The expected number of search calls.
+        self.detail_calls = 0  # The calls for donor details when checking variances.
+        self.extra_calls = 0  # The extra calls made by the file readers (like Stripe's donation calls).
+        self.remaining_calls = lgl_api.rate_limiter.max_calls  # The calls that can be made right now.
+        self.max_calls = lgl_api.rate_limiter.max_calls
+        self.period = lgl_api.rate_limiter.period
+        self.max_workers = constituent_resolver.DEFAULT_MAX_WORKERS
+
+    # This method gets the total number of calls expected, rounded up.
+    def get_total_calls(self):
+        return int(math.ceil(self.search_calls)) + self.detail_calls + self.extra_calls
+
+    # This method gets the number of times the run is expected to wait for LGL's call limit.
+    def get_pauses(self):
+        calls_over = self.get_total_calls() - max(self.remaining_calls, 0)
+        if calls_over <= 0:
+            return 0
+        return int(math.ceil(calls_over / self.max_calls))
+
+    # This method estimates how many seconds the run will spend calling LGL.  The searches are made by the resolver's
+    # worker threads at the same time.  The other calls are made one at a time.  Each pause for the call limit can
+    # take up to a whole window.
+    def get_eta_seconds(self):
+        call_seconds = (math.ceil(self.search_calls) * SECONDS_PER_CALL / max(self.max_workers, 1) +
+                        (self.detail_calls + self.extra_calls) * SECONDS_PER_CALL)
+        return call_seconds + self.get_pauses() * self.period
+
+    # This method will create a message with the plan that can be shown to the user.
+    def get_message(self):
+        (minutes, seconds) = divmod(int(round(self.get_eta_seconds())), 60)
+        return ('The {} file(s) have {} unique donor(s) and {} of them do not need a search.  About {} call(s) to LGL '
+                'are needed: {} search(es), {} variance check(s), and {} donation lookup(s).  The variance checks '
+                'count every donor who still needs a search as if they will be found.  {} call(s) can be made '
+                'right now and the run should wait for the LGL call limit {} time(s).  The LGL calls should take '
+                'about {} minute(s) and {} second(s).'.format(self.files, self.donors, self.known_donors,
+                                                              self.get_total_calls(), int(math.ceil(self.search_calls)),
+                                                              self.detail_calls, self.extra_calls,
+                                                              max(self.remaining_calls, 0), self.get_pauses(),
+                                                              minutes, seconds))
+
+
+# This function will plan the calls to LGL for a run.  No calls are made to LGL.
+#
+# Args -
+#   file_readers - the DonorFileReader objects for the input files.  initialize_donor_data must already have been
+#       called for each of them.
+#   check_variances - True if the addresses will be checked for variances
+#
+# Returns - an LglCallPlan object
+def make_plan(file_readers, check_variances):
+    log.debug('Entering with {} file readers.'.format(len(file_readers)))
+    resolver = constituent_resolver.get_resolver()
+    lgl = lgl_api.get_lgl_api()
+    plan = LglCallPlan()
+    plan.remaining_calls = lgl_api.rate_limiter.get_remaining()
+    plan.max_workers = lgl.config.getint('resolver', 'max_workers', fallback=constituent_resolver.DEFAULT_MAX_WORKERS)
+    donors = {}
+    for file_reader in file_readers:
+        try:
+            # The resolver looks donors up once for each source, so they are counted the same way here.
+            estimates = resolver.estimate(lookups=file_reader.get_constituent_lookups(),
+                                          source=file_reader.SOURCE_NAME, external_keys=file_reader.get_external_keys())
+            donors.update({(file_reader.SOURCE_NAME, key): estimate for (key, estimate) in estimates.items()})
+            plan.extra_calls += file_reader.count_extra_lgl_calls()
+        except KeyError as e:
+            # A column is missing.  The file will report the problem when its fields are mapped.
+            log.debug('The file "{}" could not be planned ({}).'.format(file_reader.input_file, e))
+            continue
+        plan.files += 1
+    plan.donors = len(donors)
+    detail_ids = set()
+    for (cid, expected_calls) in donors.values():
+        plan.search_calls += expected_calls
+        if cid or expected_calls == 0:
+            plan.known_donors += 1
+        if not check_variances:
+            continue
+        if not cid:
+            plan.detail_calls += 1 if expected_calls > 0 else 0
+        elif str(cid) not in detail_ids and not lgl.mirror.is_fresh(constituent_id=cid):
+            detail_ids.add(str(cid))
+            plan.detail_calls += 1
+    return plan
+
+
+# Test the plan message with made up numbers.  No calls are made to LGL.
+def run_call_plan_test():
+    plan = LglCallPlan()
+    plan.files = 2
+    plan.donors = 700
+    plan.known_donors = 250
+    plan.search_calls = 612.4
+    plan.detail_calls = 120
+    plan.extra_calls = 35
+    plan.remaining_calls = 200
+    log.debug(plan.get_message())
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_call_plan_test()
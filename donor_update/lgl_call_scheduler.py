@@ -0,0 +1,101 @@
+# This class decides which calls to LGL go first when there are more calls waiting than LGL's call limit allows.
+# Every call used to be made in the order the program happened to reach it, so a big variance check or Stripe's
+# recurring donation lookups could use up the call budget while the searches that the output file actually needs
+# waited for the next window.
+#
+# Each call now has a priority:
+#   - RESOLUTION - searches that find the LGL IDs for the output file.  These always go first.
+#   - ENRICHMENT - calls that add to the output file, like Stripe's donation history lookups.
+#   - VERIFICATION - calls for the donor details used to check for variances.
+#
+# A call only goes to the LglRateLimiter when no call with a higher priority is waiting for it, so the leftover budget
+# is used by the lower priority calls.  donor_etl.py also makes the enrichment and verification calls in a second pass
+# after the output file has been written (see DonorFileReader.enrich_output), so the file LGL imports is ready as
+# soon as possible.
+
+import logging
+import threading
+
+RESOLUTION = 0
+ENRICHMENT = 1
+VERIFICATION = 2
+PRIORITY_NAMES = {RESOLUTION: 'ID resolution', ENRICHMENT: 'enrichment', VERIFICATION: 'verification'}
+WAIT_CHECK = 1.0  # The number of seconds between checks for higher priority calls, in case a notify is missed.
+
+log = logging.getLogger()
+
+
+class LglCallScheduler:
+
+    def __init__(self, limiter):
+        self.limiter = limiter  # The LglRateLimiter that keeps the calls under LGL's limit.
+        self.calls = dict.fromkeys(PRIORITY_NAMES, 0)  # The number of calls made for each priority.
+        self._waiting = dict.fromkeys(PRIORITY_NAMES, 0)  # The number of calls waiting for each priority.
+        self._condition = threading.Condition()
+
+    # This method will wait until a call with the priority can be made.  It waits for the calls with a higher
+    # priority first and then for the rate limiter.  It should be called just before each call to LGL.
+    #
+    # Args -
+    #   priority - (opt) RESOLUTION, ENRICHMENT or VERIFICATION.  Defaults to RESOLUTION.
+    #
+    # Returns - the number of seconds the caller waited for the rate limiter
+    def acquire(self, priority=RESOLUTION):
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while self._has_higher_priority_calls(priority=priority):
+                    self._condition.wait(timeout=WAIT_CHECK)
+            except BaseException:
+                self._waiting[priority] -= 1
+                raise
+        try:
+            return self.limiter.acquire()
+        finally:
+            with self._condition:
+                self._waiting[priority] -= 1
+                self.calls[priority] += 1
+                self._condition.notify_all()
+
+    # This method will create a message with the number of calls made for each priority that can be shown to the user.
+    def get_stats_message(self):
+        counts = ['{} {}'.format(self.calls[priority], PRIORITY_NAMES[priority]) for priority in sorted(self.calls)]
+        return 'The LGL calls were made for: {}.'.format(', '.join(counts))
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method tells if a call with a higher priority is waiting.  The caller must hold the condition.
+    def _has_higher_priority_calls(self, priority):
+        return any(count > 0 for (waiting_priority, count) in self._waiting.items() if waiting_priority < priority)
+
+
+# Test that a lower priority call waits for the higher priority calls.
+def run_call_scheduler_test():
+    import lgl_rate_limiter
+    import time
+    scheduler = LglCallScheduler(limiter=lgl_rate_limiter.LglRateLimiter(max_calls=2, period=1))
+    order = []
+
+    def make_call(priority, name):
+        scheduler.acquire(priority=priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=make_call, args=(RESOLUTION, 'search {}'.format(count))) for count in range(4)]
+    threads.append(threading.Thread(target=make_call, args=(VERIFICATION, 'details')))
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    log.debug('The calls were made in the order {} in {:.1f} second(s).  {}'.format(order, time.time() - start,
+                                                                                  scheduler.get_stats_message()))
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_call_scheduler_test()
@@ -0,0 +1,124 @@
+# This class writes the CSV file that is imported into LGL.  The output used to be turned into one big string with
+# DataFrame.to_csv and then written to the file, so for a while the program held the data twice: once in the
+# DataFrame and once as the text of the whole file.
+#
+# The writer takes the columns of the file when it is created and writes the header with the first rows.  Each
+# DonorTable (see donor_table.py) given to write_table is written CHUNK_ROWS rows at a time, straight to the file, so
+# only one chunk of text is in memory at a time.  The tables are written in the order they are given, one after
+# another, and each one is filled out to the columns of the file the same way donor_table.merge does it.
+#
+# When the writer is closed, the file is flushed and synced to the disk.  If atomic is on, the rows are written to a
+# temporary file next to the output file, and the temporary file is renamed to the output file only after it has
+# been synced.  A crash or an error while writing then leaves the last complete output file instead of half a file.
+#
+# The settings are in the optional "output" section of the donor_etl.properties file.  An example is below:
+#
+# [output]
+# atomic: yes
+# chunk_rows: 5000
+
+import logging
+import os
+
+import pandas
+
+import donor_table
+
+CHUNK_ROWS = 5000
+TEMP_SUFFIX = '.tmp'
+
+log = logging.getLogger()
+
+
+class LglCsvWriter:
+
+    def __init__(self, output_file, columns, atomic=True, chunk_rows=CHUNK_ROWS):
+        self.output_file = output_file
+        self.columns = list(columns)  # The columns of the file, in the order they are written.
+        self.atomic = atomic
+        self.chunk_rows = max(1, chunk_rows)
+        self.rows = 0  # The number of rows written so far.
+        self._write_file = output_file + TEMP_SUFFIX if atomic else output_file
+        self._csv_file = open(self._write_file, 'w')
+        self._header_written = False
+
+    def __enter__(self):
+        return self
+
+    # The file is closed (and renamed if atomic is on) if the rows were all written.  If there was an error, the
+    # temporary file is removed and the output file is left as it was.
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    # This method will write the rows of a table to the file, one chunk at a time.  Columns that the table doesn't
+    # have are written as empty values.  Columns that the table has, but that aren't columns of the file, are left out.
+    #
+    # Args -
+    #   table - a DonorTable
+    def write_table(self, table):
+        frame = table.frame
+        for start in range(0, len(frame.index), self.chunk_rows):
+            chunk = frame.iloc[start:start + self.chunk_rows].reindex(columns=self.columns,
+                                                                      fill_value=donor_table.EMPTY_VALUE)
+            self._write_chunk(chunk=chunk)
+            self.rows += len(chunk.index)
+
+    # This method will finish the file.  The header is written if no rows were written, the file is flushed and synced
+    # to the disk, and then it is closed.  If atomic is on, the temporary file is renamed to the output file.
+    def close(self):
+        if self._csv_file.closed:
+            return
+        if not self._header_written:
+            self._write_chunk(chunk=pandas.DataFrame(columns=self.columns))
+        self._csv_file.flush()
+        os.fsync(self._csv_file.fileno())
+        self._csv_file.close()
+        if self.atomic:
+            os.replace(self._write_file, self.output_file)
+        log.debug('The output file "{}" was written with {} row(s).'.format(self.output_file, self.rows))
+
+    # This method will stop writing the file.  If atomic is on, the temporary file is removed so the output file is
+    # left as it was.
+    def abort(self):
+        if not self._csv_file.closed:
+            self._csv_file.close()
+        if self.atomic and os.path.exists(self._write_file):
+            os.remove(self._write_file)
+        log.debug('The output file "{}" was not finished.'.format(self.output_file))
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method writes a chunk of rows to the file.  The header is written with the first chunk.
+    def _write_chunk(self, chunk):
+        chunk.to_csv(self._csv_file, header=not self._header_written, index=False, line_terminator='\n')
+        self._header_written = True
+
+
+# Test that two tables with different columns are written to one file in small chunks.
+def run_csv_writer_test():
+    import tempfile
+    first = donor_table.DonorTable.from_columns({'Gift amount': {0: 10, 1: 20, 2: 30},
+                                                 'Gift type': {0: 'Gift', 1: 'Gift', 2: 'Gift'}})
+    second = donor_table.DonorTable.from_columns({'Gift amount': {0: 40},
+                                                  'Gift note': {0: 'Via Fidelity Charitable.'}})
+    output_file = os.path.join(tempfile.mkdtemp(), 'lgl.csv')
+    with LglCsvWriter(output_file=output_file, columns=donor_table.get_merged_columns(tables=[first, second]),
+                      chunk_rows=2) as writer:
+        writer.write_table(table=first)
+        writer.write_table(table=second)
+    with open(output_file) as csv_file:
+        log.debug('The output file has:\n{}'.format(csv_file.read()))
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_csv_writer_test()
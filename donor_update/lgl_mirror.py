@@ -0,0 +1,355 @@
+# This class manages a local copy (a mirror) of the constituents in Little Green Light (LGL).  Most of our calls to
+# LGL are searches for a donor's name or email address.  Once the mirror has been synced, those searches can be
+# answered from an indexed SQLite database on this computer instead of calling LGL.  The constituent details used
+# by the ConstituentDataValidator are stored as well, so the variance checks can also be done without calling LGL.
+#
+# The mirror is filled by paging through LGL's constituents list (see sync).  Run donor_etl with --sync_mirror to do
+# this.  The first sync copies everything.  After that, only the constituents that were updated in LGL since the
+# last sync (the "watermark", which is the newest updated_at date in the mirror) are copied.  Deleted constituents
+# are only noticed by a full sync, so a full sync is done again once the last one is full_sync_days old.
+#
+# Constituent details in the mirror are trusted by the ConstituentDataValidator for max_age_days after the mirror
+# (or that constituent) was last synced.  After that, the details are retrieved from LGL again (see is_fresh).
+#
+# The mirror settings are in the optional "mirror" section of the donor_etl.properties file.  An example is below:
+#
+# [mirror]
+# mirror_file: lgl_mirror.db
+# enabled: yes
+# full_sync_days: 90
+# max_age_days: 7
+
+import datetime
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import column_constants as cc
+
+DEFAULT_MIRROR_FILE = 'lgl_mirror.db'
+DEFAULT_FULL_SYNC_DAYS = 90
+DEFAULT_MAX_AGE_DAYS = 7
+SECONDS_PER_DAY = 24 * 60 * 60
+PAGE_SIZE = 100  # The number of constituents retrieved with each call to LGL.
+NOISE_WORDS = ['and', 'or', '&']
+
+log = logging.getLogger()
+
+
+class LglMirror:
+
+    def __init__(self, mirror_file=DEFAULT_MIRROR_FILE, enabled=True, full_sync_days=DEFAULT_FULL_SYNC_DAYS,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.mirror_file = mirror_file
+        self.enabled = enabled
+        self.full_sync_seconds = full_sync_days * SECONDS_PER_DAY
+        self.max_age_seconds = max_age_days * SECONDS_PER_DAY
+        self._connection = None
+        self._lock = threading.RLock()  # The mirror is used by all the threads resolving constituent IDs.
+        if self.enabled:
+            self._connection = sqlite3.connect(mirror_file, check_same_thread=False)
+            self._create_tables()
+
+    # This property is True if the mirror is turned on and it has been synced at least once.
+    @property
+    def available(self):
+        return self.enabled and self.get_info(key='last_sync') is not None
+
+    # This method will bring the mirror up to date with LGL.  A full sync is done if the mirror is empty, if the last
+    # full sync is more than full_sync_days old, or if it is asked for.  Otherwise, only the constituents that were
+    # updated since the watermark are copied.
+    #
+    # Args -
+    #   lgl - the LglApi object used to make the calls
+    #   full - (opt) True will copy every constituent even if an incremental sync is possible
+    #
+    # Returns - the number of constituents stored
+    def sync(self, lgl, full=False):
+        log.debug('Entering')
+        if not self.enabled:
+            return 0
+        last_full_sync = self.get_info(key='last_full_sync')
+        watermark = self.get_info(key='watermark')
+        if full or not last_full_sync or not watermark or \
+                (time.time() - float(last_full_sync)) > self.full_sync_seconds:
+            return self.sync_all(lgl=lgl)
+        return self.sync_changes(lgl=lgl, watermark=watermark)
+
+    # This method will copy every constituent in LGL into the mirror.  It pages through LGL's constituents list
+    # PAGE_SIZE constituents at a time.
+    #
+    # Args -
+    #   lgl - the LglApi object used to make the calls
+    #
+    # Returns - the number of constituents stored
+    def sync_all(self, lgl):
+        log.debug('Entering')
+        sync_start = time.time()
+        (count, finished) = self._store_pages(get_page=lgl.get_constituents, synced=sync_start)
+        if not finished:
+            # The constituents that weren't copied may still be in LGL, so nothing is deleted and the next run
+            # tries the full sync again.
+            log.warning('The full sync of the mirror stopped after {} constituents because a call to LGL failed.  '
+                        'The mirror was not marked as synced.'.format(count))
+            return count
+        # Anything that wasn't returned by LGL has been deleted (or merged) since the last full sync.
+        with self._lock, self._connection:
+            stale_ids = [row[0] for row in self._connection.execute('SELECT id FROM constituents WHERE synced < ?',
+                                                                     (sync_start,))]
+            for constituent_id in stale_ids:
+                self._delete_constituent(constituent_id=constituent_id)
+        self.set_info(key='last_full_sync', value=str(sync_start))
+        self.set_info(key='last_sync', value=str(sync_start))
+        return count
+
+    # This method will copy the constituents that were updated in LGL since the watermark into the mirror.  LGL's
+    # search only works with dates, so the search starts the day before the watermark.  Copying a few constituents
+    # twice is better than missing any.
+    #
+    # Args -
+    #   lgl - the LglApi object used to make the calls
+    #   watermark - the newest updated_at value in the mirror (eg: '2022-06-10T12:40:36Z')
+    #
+    # Returns - the number of constituents stored
+    def sync_changes(self, lgl, watermark):
+        log.debug('Entering with watermark "{}"'.format(watermark))
+        sync_start = time.time()
+        updated_from = datetime.datetime.strptime(watermark[:10], '%Y-%m-%d') - datetime.timedelta(days=1)
+
+        def get_page(offset, limit):
+            return lgl.get_updated_constituents(updated_from=updated_from.strftime('%Y-%m-%d'),
+                                                offset=offset, limit=limit)
+
+        (count, finished) = self._store_pages(get_page=get_page, synced=sync_start)
+        if not finished:
+            # Some changes weren't copied, so the rest of the mirror can't be trusted to be up to date.
+            log.warning('The sync of the changes to the mirror stopped after {} constituents because a call to LGL '
+                        'failed.  The mirror was not marked as synced.'.format(count))
+            return count
+        self.set_info(key='last_sync', value=str(sync_start))
+        log.debug('{} constituents were updated since "{}".'.format(count, watermark))
+        return count
+
+    # This method will tell if the mirror's copy of a constituent can be trusted.  It can be if the constituent
+    # was stored, or the whole mirror was synced, less than max_age_days ago.  A sync would have replaced the
+    # constituent if it had changed in LGL.
+    #
+    # Args -
+    #   constituent_id - the LGL ID of the constituent
+    #
+    # Returns - True if the constituent is in the mirror and is fresh, False otherwise
+    def is_fresh(self, constituent_id):
+        if not self.enabled:
+            return False
+        with self._lock:
+            row = self._connection.execute('SELECT synced FROM constituents WHERE id = ?',
+                                           (int(constituent_id),)).fetchone()
+        if not row:
+            return False
+        last_synced = max(row[0], float(self.get_info(key='last_sync') or 0))
+        return (time.time() - last_synced) <= self.max_age_seconds
+
+    # This method will add or replace one constituent in the mirror.  The constituent is the dict returned by LGL
+    # (see LglApi.get_constituent_info for the format).
+    #
+    # Args -
+    #   constituent - the constituent data from LGL
+    #   synced - (opt) the time the data was retrieved from LGL.  Defaults to now.
+    def store_constituent(self, constituent, synced=None):
+        if not self.enabled or 'id' not in constituent:
+            return
+        if synced is None:
+            synced = time.time()
+        constituent_id = constituent['id']
+        with self._lock, self._connection:
+            self._delete_constituent(constituent_id=constituent_id)
+            self._connection.execute('INSERT INTO constituents (id, first_name, last_name, addressee, sort_name, '
+                                     'spouse_name, org_name, updated_at, synced, data) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (constituent_id, constituent.get('first_name'), constituent.get('last_name'),
+                                      constituent.get('addressee'), constituent.get('sort_name'),
+                                      constituent.get('spouse_name'), constituent.get('org_name'),
+                                      constituent.get('updated_at'), synced, json.dumps(constituent)))
+            for name_key in get_name_keys(constituent=constituent):
+                self._connection.execute('INSERT INTO constituent_names (name_key, constituent_id) VALUES (?, ?)',
+                                         (name_key, constituent_id))
+            for email in constituent.get(cc.LGL_API_EMAIL) or []:
+                if email.get('address'):
+                    self._connection.execute('INSERT INTO constituent_emails (email, constituent_id) VALUES (?, ?)',
+                                             (email['address'].lower().strip(), constituent_id))
+
+    # This method will get the stored data for a constituent.
+    #
+    # Args -
+    #   constituent_id - the LGL ID of the constituent
+    #
+    # Returns - the constituent data in the same format as LglApi.get_constituent_info or None if it isn't stored
+    def get_constituent(self, constituent_id):
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._connection.execute('SELECT data FROM constituents WHERE id = ?',
+                                           (int(constituent_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # This method will find the IDs of the constituents with an email address.
+    #
+    # Args -
+    #   email - the email address
+    #
+    # Returns - a list of constituent IDs.  The list is empty if no constituent has the email address.
+    def find_ids_by_email(self, email):
+        if not self.enabled or not email or str(email) == cc.EMPTY_CELL:
+            return []
+        with self._lock:
+            rows = self._connection.execute('SELECT DISTINCT constituent_id FROM constituent_emails WHERE email = ?',
+                                            (str(email).lower().strip(),)).fetchall()
+        return [row[0] for row in rows]
+
+    # This method will find the IDs of the constituents with a name.  The name is normalized the same way as the
+    # names in the mirror (see normalize_name), so "Carolyn and Andy Limeri" matches "Carolyn & Andy Limeri".
+    #
+    # Args -
+    #   name - the name of the constituent
+    #
+    # Returns - a list of constituent IDs.  The list is empty if no constituent has the name.
+    def find_ids_by_name(self, name):
+        name_key = normalize_name(name)
+        if not self.enabled or not name_key:
+            return []
+        with self._lock:
+            rows = self._connection.execute('SELECT DISTINCT constituent_id FROM constituent_names WHERE name_key = ?',
+                                            (name_key,)).fetchall()
+        return [row[0] for row in rows]
+
+    # This method will get every name in the mirror.  It is used to build the NameIndex (see name_index.py).
+    #
+    # Returns - a list of (constituent_id, name) tuples.  A constituent has one tuple for each of its names.
+    def get_names(self):
+        if not self.enabled:
+            return []
+        with self._lock:
+            return self._connection.execute('SELECT constituent_id, name_key FROM constituent_names').fetchall()
+
+    # This method will get a value that describes the mirror, like the time of the last sync.
+    #
+    # Returns - the value as a string or None if it has not been set
+    def get_info(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._connection.execute('SELECT value FROM mirror_info WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    # This method will save a value that describes the mirror.
+    def set_info(self, key, value):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO mirror_info (key, value) VALUES (?, ?)', (key, value))
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method will store every constituent returned by a paged LGL call.  A call that fails returns an
+    # empty dict (see LglApi._lgl_api), which stops the paging before every constituent has been stored.  The
+    # watermark is only moved when every page was stored, because only then has every constituent updated before it
+    # been copied.
+    #
+    # Args -
+    #   get_page - a function that takes the offset and limit and returns a page of constituents from LGL
+    #   synced - the time the sync started
+    #
+    # Returns - a (count, finished) tuple.  count is the number of constituents stored.  finished is True if every
+    #   page was returned and the paging reached total_items.
+    def _store_pages(self, get_page, synced):
+        offset = 0
+        count = 0
+        newest = self.get_info(key='watermark')
+        while True:
+            data = get_page(offset=offset, limit=PAGE_SIZE)
+            if 'total_items' not in data:
+                return count, False
+            items = data.get('items', [])
+            for constituent in items:
+                self.store_constituent(constituent=constituent, synced=synced)
+                updated_at = constituent.get('updated_at')
+                if updated_at and (not newest or updated_at > newest):
+                    newest = updated_at
+            count += len(items)
+            offset += len(items)
+            log.debug('{} of {} constituents have been stored.'.format(count, data['total_items']))
+            if offset >= data['total_items']:
+                if newest:
+                    self.set_info(key='watermark', value=newest)
+                return count, True
+            if not items:
+                return count, False
+
+    # This private method removes a constituent and its index entries.  The caller must hold the lock and be in
+    # a transaction.
+    def _delete_constituent(self, constituent_id):
+        self._connection.execute('DELETE FROM constituents WHERE id = ?', (constituent_id,))
+        self._connection.execute('DELETE FROM constituent_names WHERE constituent_id = ?', (constituent_id,))
+        self._connection.execute('DELETE FROM constituent_emails WHERE constituent_id = ?', (constituent_id,))
+
+    # This private method creates the mirror tables if they don't exist yet.
+    def _create_tables(self):
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS constituents ('
+                                     'id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, addressee TEXT, '
+                                     'sort_name TEXT, spouse_name TEXT, org_name TEXT, updated_at TEXT, '
+                                     'synced REAL NOT NULL, data TEXT NOT NULL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS constituent_names ('
+                                     'name_key TEXT NOT NULL, constituent_id INTEGER NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS constituent_names_key '
+                                     'ON constituent_names (name_key)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS constituent_names_id '
+                                     'ON constituent_names (constituent_id)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS constituent_emails ('
+                                     'email TEXT NOT NULL, constituent_id INTEGER NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS constituent_emails_email '
+                                     'ON constituent_emails (email)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS constituent_emails_id '
+                                     'ON constituent_emails (constituent_id)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS mirror_info (key TEXT PRIMARY KEY, value TEXT)')
+
+
+# This function will normalize a name so that small differences in the way it is written don't matter.  The name
+# is made lower case, punctuation is removed, and the noise words ("and", "or", "&") are dropped.
+#
+# Args -
+#   name - the name to normalize
+#
+# Returns - the normalized name, for example "Carolyn & Andy Limeri" becomes "carolyn andy limeri"
+def normalize_name(name):
+    if not name or str(name) == cc.EMPTY_CELL:
+        return ''
+    name = re.sub(r'[^\w\s&]', '', str(name).lower())
+    return ' '.join(word for word in name.split() if word not in NOISE_WORDS)
+
+
+# This function will get all the names a constituent could be known by in the input files.  These are the first and
+# last name (with and without the middle name), the addressee, the sort name ("Limeri, Carolyn" is stored as
+# "carolyn limeri"), the spouse name, and the organization name.
+#
+# Args -
+#   constituent - the constituent data from LGL
+#
+# Returns - a set of normalized names
+def get_name_keys(constituent):
+    first_name = constituent.get('first_name') or ''
+    middle_name = constituent.get('middle_name') or ''
+    last_name = constituent.get('last_name') or ''
+    names = [first_name + ' ' + last_name,
+             first_name + ' ' + middle_name + ' ' + last_name,
+             constituent.get('addressee'),
+             constituent.get('spouse_name'),
+             constituent.get('org_name')]
+    sort_name = constituent.get('sort_name') or ''
+    if ',' in sort_name:
+        (sort_last, sort_first) = sort_name.split(',', 1)
+        names.append(sort_first + ' ' + sort_last)
+    else:
+        names.append(sort_name)
+    return set(name_key for name_key in (normalize_name(name) for name in names) if name_key)
@@ -0,0 +1,257 @@
+# This class keeps the calls to LGL under LGL's limit of 300 calls every 5 minutes.  It replaces the LglCallTracker,
+# which kept every call time forever and waited a fixed time after every 299 calls.
+#
+# The limiter uses a sliding window: it keeps the times of the calls made in the last PERIOD seconds in a deque,
+# dropping the old ones from the front as the window moves.  A call can be made as long as there are fewer than
+# MAX_CALLS times in the window.  When the window is full, the caller waits exactly until the oldest call in the
+# window is PERIOD seconds old, which frees one spot.
+#
+# The limiter is shared by all the threads making calls, so one budget covers everything.  Code that uses asyncio can
+# call acquire_async instead of acquire so that waiting doesn't block the event loop.
+#
+# Other copies of donor_etl can be using the same API token at the same time.  If a ledger is set (see
+# lgl_call_ledger.py), the window is kept in the ledger instead of the deque so that all the programs share one
+# budget.  If the ledger can't be used, the limiter goes back to counting only this program's calls.
+#
+# The times in the window are also saved to a state file (see set_state_file) every few calls and when the program
+# ends.  When the program is started again, the saved times are loaded so that a run that is restarted right after
+# another one knows how many calls are really left instead of starting at zero and going over the limit.  The ledger
+# already survives a restart, so the state file matters when the ledger is turned off or can't be used.
+
+import asyncio
+import atexit
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+MAX_CALLS = 299  # One less than LGL's limit to leave a little room.
+PERIOD = 305  # A few seconds more than LGL's 5 minutes, in case the clocks don't quite agree.
+DEFAULT_STATE_FILE = 'lgl_rate_limit.state'
+SAVE_EVERY = 10  # The state file is saved after this many calls.
+
+log = logging.getLogger()
+
+
+class LglRateLimiter:
+
+    def __init__(self, max_calls=MAX_CALLS, period=PERIOD):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = 0  # The number of calls allowed so far.
+        self.wait_seconds = 0.0  # The total time callers have waited for the limiter.
+        self._times = collections.deque()  # The times of the calls in the window, oldest first.
+        self._ledger = None  # The LglCallLedger shared with other programs, if there is one.
+        self._state_file = None  # The file the window is saved to, if there is one.
+        self._lock = threading.RLock()
+
+    # This method will make the limiter share its window with other programs through a ledger.
+    #
+    # Args -
+    #   ledger - the LglCallLedger object or None to only count this program's calls
+    def set_ledger(self, ledger):
+        with self._lock:
+            self._ledger = ledger
+
+    # This method will load the window saved by an earlier run and save the window to the same file from now on.
+    # The file is saved every SAVE_EVERY calls and when the program ends.
+    #
+    # Args -
+    #   state_file - the path of the state file
+    def set_state_file(self, state_file):
+        with self._lock:
+            first_time = self._state_file is None
+            self._state_file = state_file
+            self.load_state()
+        if first_time:
+            atexit.register(self.save_state)
+
+    # This method will load the call times saved in the state file.  Times that are already outside the window are
+    # ignored.  A missing or unreadable file is treated as no calls.
+    def load_state(self):
+        with self._lock:
+            if not self._state_file or not os.path.exists(self._state_file):
+                return
+            try:
+                with open(self._state_file) as state_file:
+                    saved_times = json.load(state_file)
+            except (OSError, ValueError) as e:
+                log.warning('The rate limit state file "{}" could not be read ({}).'.format(self._state_file, e))
+                return
+            now = time.time()
+            times = sorted(set(self._times) | set(float(t) for t in saved_times if now - self.period < t <= now))
+            self._times = collections.deque(times[-self.max_calls:])
+            log.debug('{} call(s) from an earlier run are in the window.'.format(len(self._times)))
+
+    # This method will save the call times in the window to the state file.  The file is written to a temporary
+    # file first and then renamed, so a crash while saving doesn't leave half a file.
+    def save_state(self):
+        with self._lock:
+            if not self._state_file:
+                return
+            self._prune(now=time.time())
+            temp_file = self._state_file + '.tmp'
+            try:
+                with open(temp_file, 'w') as state_file:
+                    json.dump(list(self._times), state_file)
+                os.replace(temp_file, self._state_file)
+            except OSError as e:
+                log.warning('The rate limit state file "{}" could not be saved ({}).'.format(self._state_file, e))
+
+    # This method will wait until a call can be made without going over the limit and then count the call.  It
+    # should be called just before each call to LGL.
+    #
+    # Returns - the number of seconds the caller waited
+    # Side effects: A delay may be inserted because too many calls have been made.
+    def acquire(self):
+        waited = 0.0
+        while True:
+            wait_time = self._reserve()
+            if wait_time <= 0:
+                return waited
+            self._log_wait(wait_time=wait_time)
+            time.sleep(wait_time)
+            waited += wait_time
+
+    # This method is the same as acquire, but it can be awaited by asyncio code.
+    #
+    # Returns - the number of seconds the caller waited
+    async def acquire_async(self):
+        waited = 0.0
+        while True:
+            wait_time = self._reserve()
+            if wait_time <= 0:
+                return waited
+            self._log_wait(wait_time=wait_time)
+            await asyncio.sleep(wait_time)
+            waited += wait_time
+
+    # This method gets the number of calls that can be made right now without waiting.
+    def get_remaining(self):
+        with self._lock:
+            now = time.time()
+            if self._ledger:
+                try:
+                    return self.max_calls - len(self._ledger.get_call_times(period=self.period, now=now))
+                except sqlite3.Error:
+                    pass
+            self._prune(now=now)
+            return self.max_calls - len(self._times)
+
+    # This method will create a message with the number of calls and waiting time that can be shown to the user.
+    def get_stats_message(self):
+        return '{} call(s) were made to LGL with {:.0f} second(s) of waiting for the call limit.'.format(
+            self.calls, self.wait_seconds)
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method counts a call if there is room for it in the window.
+    #
+    # Returns - 0 if the call was counted, otherwise the number of seconds until the oldest call leaves the window
+    def _reserve(self):
+        with self._lock:
+            now = time.time()
+            if self._ledger:
+                wait_time = self._reserve_in_ledger(now=now)
+                if wait_time is not None:
+                    if wait_time <= 0:
+                        self._count_call()
+                    self.wait_seconds += max(wait_time, 0)
+                    return wait_time
+            self._prune(now=now)
+            if len(self._times) < self.max_calls:
+                self._times.append(now)
+                self._count_call()
+                return 0
+            wait_time = self._times[0] + self.period - now
+            self.wait_seconds += max(wait_time, 0)
+            return wait_time
+
+    # This private method reserves a call in the ledger.  The call is also added to the deque so that the limiter
+    # still knows about it if it has to stop using the ledger.
+    #
+    # Returns - the same as _reserve, or None if the ledger couldn't be used
+    def _reserve_in_ledger(self, now):
+        try:
+            wait_time = self._ledger.reserve(max_calls=self.max_calls, period=self.period, now=now)
+        except sqlite3.Error as e:
+            log.warning('The shared call ledger "{}" could not be used ({}).  Only the calls made by this program '
+                        'will be counted.'.format(self._ledger.ledger_file, e))
+            self._ledger = None
+            return None
+        if wait_time <= 0:
+            self._prune(now=now)
+            self._times.append(now)
+        return wait_time
+
+    # This private method counts a call and saves the window every SAVE_EVERY calls.  The caller must hold the lock.
+    def _count_call(self):
+        self.calls += 1
+        if self.calls % SAVE_EVERY == 0:
+            self.save_state()
+
+    # This private method drops the call times that are older than the window.  The caller must hold the lock.
+    def _prune(self, now):
+        window_start = now - self.period
+        while self._times and self._times[0] <= window_start:
+            self._times.popleft()
+
+    # This private method tells the user why the program is waiting.
+    def _log_wait(self, wait_time):
+        log.info('{} calls to LGL have been made in the last {} seconds.  The program will wait {:.1f} second(s) '
+                 'so that it does not go over the number of calls allowed by LGL.'.format(self.max_calls,
+                                                                                           self.period, wait_time))
+
+
+# Test that the limiter waits once the window is full.
+def run_rate_limiter_test():
+    limiter = LglRateLimiter(max_calls=3, period=1)
+    start = time.time()
+    for count in range(7):
+        limiter.acquire()
+    log.debug('7 calls took {:.1f} second(s).  {}'.format(time.time() - start, limiter.get_stats_message()))
+
+    async def make_calls():
+        await asyncio.gather(*[limiter.acquire_async() for count in range(4)])
+
+    start = time.time()
+    asyncio.run(make_calls())
+    log.debug('4 async calls took {:.1f} second(s).  {} call(s) are left.'.format(time.time() - start,
+                                                                               limiter.get_remaining()))
+
+    # Two limiters (like two programs) sharing a ledger share the window.
+    import lgl_call_ledger
+    import tempfile
+    ledger_file = os.path.join(tempfile.mkdtemp(), lgl_call_ledger.DEFAULT_LEDGER_FILE)
+    limiters = [LglRateLimiter(max_calls=3, period=1) for count in range(2)]
+    for limiter in limiters:
+        limiter.set_ledger(lgl_call_ledger.LglCallLedger(ledger_file=ledger_file, api_token='test'))
+    start = time.time()
+    for count in range(3):
+        for limiter in limiters:
+            limiter.acquire()
+    log.debug('6 calls from 2 limiters took {:.1f} second(s).'.format(time.time() - start))
+
+    # A new limiter (like a restarted program) picks up the calls saved by the last one.
+    state_file = os.path.join(tempfile.mkdtemp(), DEFAULT_STATE_FILE)
+    limiter = LglRateLimiter(max_calls=3, period=1)
+    limiter.set_state_file(state_file=state_file)
+    limiter.acquire()
+    limiter.acquire()
+    limiter.save_state()
+    restarted_limiter = LglRateLimiter(max_calls=3, period=1)
+    restarted_limiter.set_state_file(state_file=state_file)
+    log.debug('The restarted limiter has {} call(s) left.'.format(restarted_limiter.get_remaining()))
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_rate_limiter_test()
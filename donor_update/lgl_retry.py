@@ -0,0 +1,238 @@
+# This class decides what to do when a call to LGL fails.  The program used to stop as soon as LGL said too many
+# calls had been made (error 429), which threw away all the work done so far in the run.  Most failures like that
+# only last a moment, so the RetryPolicy tries the call again instead:
+#
+#   - Errors that can go away on their own (429, the 5xx server errors, timeouts, and dropped connections) are
+#     retried.  Any other error is returned to the caller right away since trying again won't help.
+#   - Before each retry, the policy waits for as long as LGL asks in the Retry-After (or rate limit reset) header.
+#     If LGL doesn't say, the wait doubles after each try (1, 2, 4, 8, ... seconds) with some randomness (jitter)
+#     so that the threads making calls don't all retry at the same moment.
+#   - A call that still fails after its retries is given back to the caller (LglCallError), so the caller can carry
+#     on with the next call.
+#   - If breaker_threshold calls in a row fail even after their retries, LGL is probably down or the call limit has
+#     been used up.  The "circuit breaker" then pauses every call for breaker_pause seconds and tells the user, instead
+#     of ending the program.  If calls are still failing after max_pauses pauses in a row, LGL is given up on
+#     (LglUnavailableError).
+#
+# The number of retries and the time spent waiting are counted so they can be shown at the end of the run.
+#
+# The settings are in the optional "retry" section of the donor_etl.properties file.  An example is below:
+#
+# [retry]
+# max_retries: 5
+# base_delay: 1
+# max_delay: 60
+# breaker_threshold: 3
+# breaker_pause: 300
+# max_pauses: 3
+
+import datetime
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+
+import display_data
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_PAUSE = 300.0
+DEFAULT_MAX_PAUSES = 3
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRY_HEADERS = ['Retry-After', 'RateLimit-Reset', 'X-RateLimit-Reset']
+
+log = logging.getLogger()
+ml = display_data.DisplayData()
+
+
+# This exception is raised when a call to LGL still fails after all its retries.
+class LglCallError(Exception):
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# This exception is raised when calls to LGL keep failing even after the circuit breaker has paused max_pauses times.
+class LglUnavailableError(LglCallError):
+    pass
+
+
+class RetryPolicy:
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 breaker_threshold=DEFAULT_BREAKER_THRESHOLD, breaker_pause=DEFAULT_BREAKER_PAUSE,
+                 max_pauses=DEFAULT_MAX_PAUSES):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_pause = breaker_pause
+        self.max_pauses = max_pauses
+        self.retries = 0  # The number of calls that were tried again.
+        self.wait_seconds = 0.0  # The time spent waiting before retries and in breaker pauses.
+        self.breaker_opens = 0  # The number of times the circuit breaker paused the calls.
+        self._failures = 0  # The number of calls in a row that failed after all their retries.
+        self._pauses = 0  # The number of breaker pauses in a row without a successful call.
+        self._paused_until = 0.0  # No calls are made until this time while the breaker is open.
+        self._lock = threading.Lock()  # The policy is shared by all the threads making calls.
+
+    # This method will make a call and retry it if it fails with an error that may go away.
+    #
+    # Args -
+    #   request - a function with no arguments that makes the call and returns the response
+    #
+    # Returns - the response.  It is either successful or has an error that isn't worth retrying.
+    # Raises - LglCallError if the call still fails after its retries, or LglUnavailableError if calls are still
+    #   failing after the circuit breaker has paused max_pauses times
+    def call(self, request):
+        (response, error) = self._try_with_retries(request=request)
+        if error is None:
+            self._record_success()
+            return response
+        self._record_failure(error=error, response=response)
+        raise LglCallError('The call to LGL failed with {} after {} retries.'.format(error, self.max_retries),
+                           status_code=response.status_code if response is not None else None)
+
+    # This method will create a message with the retry counts that can be shown to the user.
+    def get_stats_message(self):
+        return 'Calls to LGL were retried {} time(s) with {:.0f} second(s) of waiting.  LGL calls were paused {} ' \
+               'time(s).'.format(self.retries, self.wait_seconds, self.breaker_opens)
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method makes a call and retries it up to max_retries times.
+    #
+    # Returns - a (response, error) tuple.  error is None if the response can be returned to the caller.  Otherwise
+    #   it describes the last failure and response is the last response (or None if there wasn't one).
+    def _try_with_retries(self, request):
+        response = None
+        error = None
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_breaker()
+            try:
+                response = request()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                response = None
+                error = '{}: {}'.format(type(e).__name__, e)
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response, None
+                error = 'status code {}'.format(response.status_code)
+            if attempt == self.max_retries:
+                break
+            delay = self._get_delay(attempt=attempt, response=response)
+            log.info('The call to LGL failed with {}.  It will be tried again in {:.1f} second(s).'.format(error,
+                                                                                                          delay))
+            with self._lock:
+                self.retries += 1
+                self.wait_seconds += delay
+            time.sleep(delay)
+        return response, error
+
+    # This private method works out how long to wait before the next retry.  LGL's headers are used if it sent any.
+    # Otherwise the wait is base_delay doubled for each attempt, up to max_delay, with jitter.
+    def _get_delay(self, attempt, response):
+        header_delay = _get_header_delay(response=response)
+        if header_delay is not None:
+            return min(header_delay, self.breaker_pause)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # This private method waits while the circuit breaker is open.
+    def _wait_for_breaker(self):
+        with self._lock:
+            wait_time = self._paused_until - time.time()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    # This private method resets the failure counts after a successful call.
+    def _record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._pauses = 0
+
+    # This private method counts a call that failed after all its retries.  If enough calls have failed in a row,
+    # the circuit breaker is opened so that all calls pause for breaker_pause seconds.
+    #
+    # Raises - LglUnavailableError if the breaker has already paused max_pauses times in a row
+    def _record_failure(self, error, response):
+        status_code = response.status_code if response is not None else None
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.breaker_threshold:
+                return
+            if self._pauses >= self.max_pauses:
+                raise LglUnavailableError('LGL is still failing with {} after {} pause(s).'.format(error,
+                                                                                                   self._pauses),
+                                          status_code=status_code)
+            if self._paused_until > time.time():
+                return  # Another thread has already opened the breaker.
+            self._failures = 0
+            self._pauses += 1
+            self.breaker_opens += 1
+            self.wait_seconds += self.breaker_pause
+            self._paused_until = time.time() + self.breaker_pause
+        log.warning(ml.save('Little Green Light is not responding ({}).  The calls to LGL will pause for {:.0f} '
+                            'second(s) and then start again.'.format(error, self.breaker_pause)))
+
+
+# This private function gets the number of seconds LGL asked us to wait from the response headers.  Retry-After can
+# be a number of seconds or a date.  The rate limit reset headers can be a number of seconds or a Unix time.
+#
+# Returns - the number of seconds or None if there is no header
+def _get_header_delay(response):
+    if response is None or not getattr(response, 'headers', None):
+        return None
+    for header in RETRY_HEADERS:
+        value = response.headers.get(header)
+        if not value:
+            continue
+        try:
+            seconds = float(value)
+            if seconds > 1000000000:  # This is a Unix time, not a number of seconds.
+                seconds -= time.time()
+            return max(0.0, seconds)
+        except ValueError:
+            pass
+        try:
+            retry_time = email.utils.parsedate_to_datetime(value)
+            return max(0.0, (retry_time - datetime.datetime.now(tz=retry_time.tzinfo)).total_seconds())
+        except (TypeError, ValueError):
+            log.debug('The {} header "{}" could not be read.'.format(header, value))
+    return None
+
+
+# Test that failed calls are retried and that the breaker pauses.
+def run_retry_test():
+    class FakeResponse:
+        def __init__(self, status_code, headers=None):
+            self.status_code = status_code
+            self.headers = headers or {}
+
+    responses = [FakeResponse(503), FakeResponse(429, {'Retry-After': '0.2'}), FakeResponse(200)]
+    policy = RetryPolicy(base_delay=0.1)
+    response = policy.call(request=lambda: responses.pop(0))
+    log.debug('The final status code is {}.  {}'.format(response.status_code, policy.get_stats_message()))
+
+    policy = RetryPolicy(max_retries=1, base_delay=0.1, breaker_threshold=1, breaker_pause=0.5, max_pauses=1)
+    for _ in range(3):
+        try:
+            policy.call(request=lambda: FakeResponse(429))
+        except LglCallError as e:
+            log.debug('The call failed with "{}" ({}).  {}'.format(e, type(e).__name__, policy.get_stats_message()))
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_retry_test()
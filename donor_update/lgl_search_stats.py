@@ -0,0 +1,237 @@
+# This class keeps track of which LGL search steps find donors for each source of donor files (Benevity, Stripe,
+# ...).  LglApi.find_constituent tries the email and then several rewrites of the name (see name_parser.py) until one
+# of them finds the donor.  Each try is a call to LGL, so it is worth knowing which tries actually work.  For example,
+# Benevity has the first and last names in separate columns, so splitting run together words almost never finds
+# anything for a Benevity donor.
+#
+# The number of tries and hits for each source and step are saved in the constituent ID cache file so they build up
+# from one run to the next.  The searches are made by many threads at once, so the counts are kept in memory during
+# the run and written to the file in one transaction when the program ends (see save).  A problem with the file is
+# logged and never stops a search.  They are used to:
+#   - try the steps for a source in the order of how often they find something, and
+#   - skip a step for a source once it has been tried min_attempts times and almost never finds anything.
+#
+# A step is only tried when the steps before it missed, so its counts only describe the donors the other steps
+# couldn't find, and a skipped step would never be tried again to find out if that has changed.  So a skipped step
+# is still tried for explore_rate of the donors (5% by default).  Those tries are counted like any other, and the
+# step is used again once it finds more than SKIP_HIT_RATE of the donors it's tried for.
+#
+# The settings are in the optional "search" section of the donor_etl.properties file.  An example is below:
+#
+# [search]
+# adaptive: yes
+# min_attempts: 50
+# explore_rate: 0.05
+
+import atexit
+import logging
+import random
+import sqlite3
+import threading
+
+import lgl_cache
+
+DEFAULT_MIN_ATTEMPTS = 50
+DEFAULT_EXPLORE_RATE = 0.05
+SKIP_HIT_RATE = 0.02  # A step that finds less than 2% of the donors it's tried for is skipped.
+UNKNOWN_SOURCE = 'Unknown'
+
+log = logging.getLogger()
+
+
+class LglSearchStats:
+
+    def __init__(self, stats_file=lgl_cache.DEFAULT_CACHE_FILE, adaptive=True, min_attempts=DEFAULT_MIN_ATTEMPTS,
+                 explore_rate=DEFAULT_EXPLORE_RATE):
+        self.stats_file = stats_file
+        self.adaptive = adaptive
+        self.min_attempts = min_attempts
+        self.explore_rate = explore_rate  # The share of the searches that still try a skipped step.
+        self._run_stats = {}  # The counts for this run in the form {(source, step): [attempts, hits]}
+        self._unsaved_stats = {}  # The counts that haven't been saved yet, in the same form as _run_stats.
+        self._lock = threading.RLock()  # The stats are updated by all the threads resolving constituent IDs.
+        self._connection = sqlite3.connect(stats_file, check_same_thread=False)
+        self._create_tables()
+        atexit.register(self.save)
+
+    # This method will save the result of one search step.
+    #
+    # Args -
+    #   source - the source of the donor file (eg: "Benevity")
+    #   step - the search step (eg: "email" or one of the name_parser.STEP_* values)
+    #   hit - True if the step found exactly one constituent.  A search that finds several can't give the donor an ID,
+    #       so it isn't a hit.
+    def record(self, source, step, hit):
+        source = source or UNKNOWN_SOURCE
+        with self._lock:
+            for stats in (self._run_stats, self._unsaved_stats):
+                counts = stats.setdefault((source, step), [0, 0])
+                counts[0] += 1
+                counts[1] += 1 if hit else 0
+
+    # This method will add the counts recorded since the last save to the statistics file in one transaction.  It is
+    # called when the program ends.  If the file can't be written, the counts are kept for the next save.
+    def save(self):
+        with self._lock:
+            if not self._unsaved_stats:
+                return
+            try:
+                with self._connection:
+                    for ((source, step), (attempts, hits)) in self._unsaved_stats.items():
+                        self._connection.execute('INSERT OR IGNORE INTO search_steps (source, step, attempts, hits) '
+                                                 'VALUES (?, ?, 0, 0)', (source, step))
+                        self._connection.execute('UPDATE search_steps SET attempts = attempts + ?, hits = hits + ? '
+                                                 'WHERE source = ? AND step = ?', (attempts, hits, source, step))
+            except sqlite3.Error as e:
+                log.warning('The LGL search statistics could not be saved to "{}" ({}).'.format(self.stats_file, e))
+                return
+            self._unsaved_stats = {}
+
+    # This method will put the search steps for a source in the order they should be tried.  Steps with a higher
+    # hit rate are tried first.  A step that hasn't been tried much yet is given the benefit of the doubt.  Steps that
+    # have been tried min_attempts times and have a hit rate below SKIP_HIT_RATE are dropped, except for explore_rate
+    # of the searches.  If that would drop every step, the first step is kept so that every donor gets at least one
+    # search.
+    #
+    # Args -
+    #   source - the source of the donor file (eg: "Benevity")
+    #   steps - the steps in their default order
+    #   explore - (opt) False will always drop the skipped steps.  It is used to estimate calls.  Defaults to True.
+    #
+    # Returns - a list of steps
+    def get_step_order(self, source, steps, explore=True):
+        if not self.adaptive or not steps:
+            return list(steps)
+        counts = self._get_counts(source=source or UNKNOWN_SOURCE)
+        scored_steps = []
+        for (default_index, step) in enumerate(steps):
+            (attempts, hits) = counts.get(step, (0, 0))
+            if self._is_unproductive(attempts=attempts, hits=hits, explore=explore):
+                continue
+            # The hit rate starts at 1/2 and moves towards the real rate as the step is tried more often.
+            scored_steps.append(((hits + 1) / (attempts + 2), -default_index, step))
+        if not scored_steps:
+            return [steps[0]]
+        scored_steps.sort(reverse=True)
+        return [step for (_, _, step) in scored_steps]
+
+    # This method will estimate the number of calls a search will take.  The steps are tried in order until one finds
+    # something, so each step is only tried if all the steps before it missed.  The hit rates are the same ones used by
+    # get_step_order.
+    #
+    # Args -
+    #   source - the source of the donor file (eg: "Benevity")
+    #   steps - the steps that will be tried, in order
+    #
+    # Returns - the expected number of calls
+    def get_expected_calls(self, source, steps):
+        counts = self._get_counts(source=source or UNKNOWN_SOURCE)
+        expected_calls = 0.0
+        chance_of_trying = 1.0
+        for step in steps:
+            (attempts, hits) = counts.get(step, (0, 0))
+            expected_calls += chance_of_trying
+            chance_of_trying *= 1 - (hits + 1) / (attempts + 2)
+        return expected_calls
+
+    # This method will tell if a step should be skipped for a source because it almost never finds anything.  The
+    # step is still tried for explore_rate of the searches.
+    #
+    # Args -
+    #   source - the source of the donor file (eg: "Benevity")
+    #   step - the search step
+    #   explore - (opt) False will always skip the step if it is unproductive.  Defaults to True.
+    #
+    # Returns - True if the step should be skipped
+    def should_skip(self, source, step, explore=True):
+        if not self.adaptive:
+            return False
+        (attempts, hits) = self._get_counts(source=source or UNKNOWN_SOURCE).get(step, (0, 0))
+        return self._is_unproductive(attempts=attempts, hits=hits, explore=explore)
+
+    # This method will create a report of the search steps used in this run and in all runs so far.  It can be shown
+    # to the user.
+    #
+    # Returns - a string with one line for each source and step
+    def get_report(self):
+        with self._lock:
+            all_stats = self._get_all_counts()
+            run_stats = {key: tuple(counts) for (key, counts) in self._run_stats.items()}
+        if not all_stats:
+            return 'No LGL searches have been made.'
+        lines = ['LGL search step results (this run / all runs):']
+        for ((source, step), (attempts, hits)) in sorted(all_stats.items(), key=lambda item: (item[0][0],
+                                                                                                -item[1][1])):
+            (run_attempts, run_hits) = run_stats.get((source, step), (0, 0))
+            lines.append('  {} - {}: {} of {} / {} of {} ({:.0%})'.format(source, step, run_hits, run_attempts,
+                                                                         hits, attempts, hits / attempts))
+        return '\n'.join(lines)
+
+    # This method will forget the statistics so the step order starts over.
+    def clear(self):
+        with self._lock, self._connection:
+            self._run_stats = {}
+            self._unsaved_stats = {}
+            self._connection.execute('DELETE FROM search_steps')
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method gets the counts for a source, saved and not saved yet, in the form {step: (attempts, hits)}.
+    def _get_counts(self, source):
+        return {step: counts for ((count_source, step), counts) in self._get_all_counts().items()
+                if count_source == source}
+
+    # This private method gets the counts for every source and step, saved and not saved yet, in the form
+    # {(source, step): (attempts, hits)}.  If the file can't be read, only the counts from this run are used.
+    def _get_all_counts(self):
+        with self._lock:
+            try:
+                rows = self._connection.execute('SELECT source, step, attempts, hits FROM search_steps').fetchall()
+            except sqlite3.Error as e:
+                log.debug('The LGL search statistics could not be read from "{}" ({}).'.format(self.stats_file, e))
+                rows = []
+            counts = {(source, step): (attempts, hits) for (source, step, attempts, hits) in rows}
+            for (key, (attempts, hits)) in self._unsaved_stats.items():
+                (saved_attempts, saved_hits) = counts.get(key, (0, 0))
+                counts[key] = (saved_attempts + attempts, saved_hits + hits)
+        return counts
+
+    # This private method tells if a step has been tried enough times to know that it almost never finds anything.
+    # It is False for explore_rate of the calls if explore is True, so the step gets tried now and then.
+    def _is_unproductive(self, attempts, hits, explore=True):
+        if attempts < self.min_attempts or hits / attempts >= SKIP_HIT_RATE:
+            return False
+        return not explore or random.random() >= self.explore_rate
+
+    # This private method creates the statistics table if it doesn't exist yet.
+    def _create_tables(self):
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS search_steps ('
+                                     'source TEXT NOT NULL, step TEXT NOT NULL, '
+                                     'attempts INTEGER NOT NULL, hits INTEGER NOT NULL, '
+                                     'PRIMARY KEY (source, step))')
+
+
+# Test that the statistics reorder and skip steps.
+def run_search_stats_test():
+    stats = LglSearchStats(stats_file=':memory:', min_attempts=10)
+    for count in range(20):
+        stats.record(source='Benevity', step='full', hit=count % 4 != 0)
+        stats.record(source='Benevity', step='split_words', hit=False)
+        stats.record(source='Benevity', step='no_initials', hit=count % 2 == 0)
+    log.debug('The Benevity step order is {}.'.format(
+        stats.get_step_order(source='Benevity', steps=['full', 'no_initials', 'split_words'])))
+    log.debug('Skip the Benevity email search: {}.'.format(stats.should_skip(source='Benevity', step='email')))
+    stats.save()
+    stats.record(source='Benevity', step='full', hit=True)
+    log.debug(stats.get_report())
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_search_stats_test()
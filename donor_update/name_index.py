@@ -0,0 +1,260 @@
+# This class is an in-memory index of constituent names used to find the best matches for a donor's name without
+# calling LGL.  LglApi.find_constituent tries up to five rewrites of a name, and each one is a call to LGL that counts
+# against the 300 calls every 5 minutes.  The index is built from the names in the local mirror (see lgl_mirror.py)
+# and ranks every constituent that shares something with the name being searched for.  LGL is only searched if the
+# index doesn't find a clear winner.
+#
+# Each name is broken into three kinds of keys:
+#   - tokens: the words in the name after noise words ("and", "fund", ...), suffixes ("jr", "iii", ...) and
+#     initials are removed,
+#   - trigrams: every three letter piece of the tokens, which catches typos and names that are run together
+#     ("RichardCederman"),
+#   - phonetic keys: the Soundex code of every token, which catches names that sound the same ("Carolyn", "Caroline").
+#
+# A match is scored from 0 to 1 using the overlap of each kind of key.  Tokens that aren't the same still count for
+# part of a match if they sound the same or share most of their trigrams.
+#
+# Scoring every constituent that shares one trigram with a name would score most of the mirror for every donor, since
+# common trigrams (like "son" or " ma") are in thousands of names.  So only the SEARCH_KEYS rarest keys of the name
+# are looked up, a constituent must share at least MIN_SHARED_KEYS of them, and only the MAX_CANDIDATES constituents
+# that share the most keys are scored.
+#
+# The matches are only suggestions.  LglApi reports them with the donor instead of using them as the donor's ID,
+# unless fuzzy_match is turned on in the "search" section of the donor_etl.properties file.
+
+import collections
+import functools
+import logging
+import re
+import threading
+
+import column_constants as cc
+
+NOISE_WORDS = ['and', 'or', '&', 'fund', 'the', 'of', 'in', 'memory', 'honor', 'family', 'mr', 'mrs', 'ms', 'dr']
+SUFFIXES = ['jr', 'sr', 'i', 'ii', 'iii', 'iv']
+MATCH_THRESHOLD = 0.85  # The score the best match needs to be used without asking LGL.
+MATCH_MARGIN = 0.1  # How much better the best match has to be than the second best match.
+TOKEN_WEIGHT = 0.6
+TRIGRAM_WEIGHT = 0.25
+PHONETIC_WEIGHT = 0.15
+SOUNDS_ALIKE_SCORE = 0.85  # The token score for two different words with the same Soundex code.
+SEARCH_KEYS = 12  # The number of the rarest trigrams and phonetic keys of a name that are looked up.
+MIN_SHARED_KEYS = 3  # The number of those keys a constituent must share with the name to be scored.
+MAX_CANDIDATES = 100  # The most constituents that are scored for one search.
+NAME_KEYS_CACHE_SIZE = 100000  # The most names whose keys are remembered so they are only broken up once.
+
+log = logging.getLogger()
+
+
+class NameIndex:
+
+    def __init__(self):
+        self._names = {}  # {constituent_id: [name_keys, ...]}
+        self._trigram_index = {}  # {trigram: set(constituent_id, ...)}
+        self._phonetic_index = {}  # {soundex code: set(constituent_id, ...)}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    # This method will add a constituent's name to the index.  A constituent can have more than one name (the
+    # addressee, the sort name, the org name, ...).
+    #
+    # Args -
+    #   constituent_id - the LGL ID of the constituent
+    #   name - one of the constituent's names
+    def add(self, constituent_id, name):
+        (tokens, trigrams, phonetics) = get_name_keys(name)
+        if not tokens:
+            return
+        with self._lock:
+            self._names.setdefault(constituent_id, []).append(name)
+            for trigram in trigrams:
+                self._trigram_index.setdefault(trigram, set()).add(constituent_id)
+            for phonetic in phonetics:
+                self._phonetic_index.setdefault(phonetic, set()).add(constituent_id)
+
+    # This method will find the constituents whose names are most like a name.  Only the constituents that share
+    # enough of the name's rarest keys are scored (see the comment at the top of the file).
+    #
+    # Args -
+    #   name - the name to look for
+    #   limit - (opt) the maximum number of candidates to return
+    #
+    # Returns - a list of (score, constituent_id) tuples with the best score first.  The score is between 0 and 1.
+    def search(self, name, limit=5):
+        (tokens, trigrams, phonetics) = get_name_keys(name)
+        if not tokens:
+            return []
+        shared_keys = collections.Counter()
+        with self._lock:
+            buckets = [self._trigram_index.get(trigram, ()) for trigram in trigrams] + \
+                      [self._phonetic_index.get(phonetic, ()) for phonetic in phonetics]
+            buckets = sorted((bucket for bucket in buckets if bucket), key=len)[:SEARCH_KEYS]
+            for bucket in buckets:
+                shared_keys.update(bucket)
+            min_shared = min(MIN_SHARED_KEYS, len(buckets))
+            candidates = [(constituent_id, list(self._names[constituent_id]))
+                          for (constituent_id, count) in shared_keys.most_common(MAX_CANDIDATES)
+                          if count >= min_shared]
+        scores = []
+        for (constituent_id, names) in candidates:
+            score = max(self._score(keys=(tokens, trigrams, phonetics), name=candidate_name)
+                        for candidate_name in names)
+            scores.append((score, constituent_id))
+        scores.sort(key=lambda score: score[0], reverse=True)
+        return scores[:limit]
+
+    # This method will find the one constituent that clearly matches a name.
+    #
+    # Args -
+    #   name - the name to look for
+    #
+    # Returns - the constituent ID or '' if there is no clear match
+    def find_best_match(self, name):
+        return pick_best_match(self.search(name=name, limit=2))
+
+    # This method will score how well a name matches each of a list of names.  It is used to choose between the
+    # constituents returned by an LGL search.
+    #
+    # Args -
+    #   name - the name being looked for
+    #   candidates - a list of (constituent_id, candidate_name) tuples
+    #
+    # Returns - a list of (score, constituent_id) tuples with the best score first
+    def rank(self, name, candidates):
+        keys = get_name_keys(name)
+        scores = [(self._score(keys=keys, name=candidate_name), constituent_id)
+                  for (constituent_id, candidate_name) in candidates]
+        scores.sort(key=lambda score: score[0], reverse=True)
+        return scores
+
+    # ----- P R I V A T E   M E T H O D S ----- #
+
+    # This private method scores how well a name matches the keys of the name being searched for.
+    def _score(self, keys, name):
+        (tokens, trigrams, phonetics) = keys
+        (name_tokens, name_trigrams, name_phonetics) = get_name_keys(name)
+        if not name_tokens:
+            return 0.0
+        # Each word in either name is matched to the most similar word in the other name.
+        token_score = (sum(max(_token_similarity(token, name_token) for name_token in name_tokens)
+                           for token in tokens) +
+                       sum(max(_token_similarity(name_token, token) for token in tokens)
+                           for name_token in name_tokens)) / (len(tokens) + len(name_tokens))
+        trigram_score = 2 * len(trigrams & name_trigrams) / (len(trigrams) + len(name_trigrams))
+        phonetic_score = len(phonetics & name_phonetics) / len(phonetics | name_phonetics)
+        return TOKEN_WEIGHT * token_score + TRIGRAM_WEIGHT * trigram_score + PHONETIC_WEIGHT * phonetic_score
+
+
+# This function picks the constituent from a ranked list of candidates if it is a clear winner.  The best candidate
+# must score at least MATCH_THRESHOLD and be at least MATCH_MARGIN better than the next best candidate.
+#
+# Args -
+#   scores - a list of (score, constituent_id) tuples with the best score first
+#
+# Returns - the constituent ID or '' if there is no clear winner
+def pick_best_match(scores):
+    if not scores or scores[0][0] < MATCH_THRESHOLD:
+        return ''
+    if len(scores) > 1 and (scores[0][0] - scores[1][0]) < MATCH_MARGIN:
+        return ''
+    return scores[0][1]
+
+
+# This private function scores how similar two words are.  The same word scores 1, words that sound alike score
+# SOUNDS_ALIKE_SCORE, and other words score by how many of their trigrams they share.
+def _token_similarity(word_1, word_2):
+    if word_1 == word_2:
+        return 1.0
+    if soundex(word_1) == soundex(word_2):
+        return SOUNDS_ALIKE_SCORE
+    trigrams_1 = set(word_1[i:i + 3] for i in range(len(word_1) - 2))
+    trigrams_2 = set(word_2[i:i + 3] for i in range(len(word_2) - 2))
+    if not trigrams_1 or not trigrams_2:
+        return 0.0
+    return 2 * len(trigrams_1 & trigrams_2) / (len(trigrams_1) + len(trigrams_2))
+
+
+# This function breaks a name into its tokens, trigrams, and phonetic keys.  The keys of the most recently used names
+# are remembered, so the names in the index are only broken up once.  lru_cache is safe to use from the resolver's
+# threads and never holds more than NAME_KEYS_CACHE_SIZE names.
+#
+# Args -
+#   name - the name
+#
+# Returns - a (tokens, trigrams, phonetic keys) tuple
+@functools.lru_cache(maxsize=NAME_KEYS_CACHE_SIZE)
+def get_name_keys(name):
+    tokens = get_tokens(name)
+    trigrams = set()
+    for token in tokens:
+        padded = ' ' + token + ' '
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    phonetics = set(soundex(token) for token in tokens)
+    return tokens, frozenset(trigrams), frozenset(phonetics)
+
+
+# This function will break a name into the words that matter for matching.  Words that are run together, like
+# "RichardCederman", are split on the capital letters, punctuation is removed, and noise words, suffixes, and
+# initials are dropped.
+#
+# Args -
+#   name - the name
+#
+# Returns - a frozenset of lower case words
+def get_tokens(name):
+    if not name or str(name) == cc.EMPTY_CELL:
+        return frozenset()
+    name = re.sub(r'([a-z])([A-Z])', r'\1 \2', str(name))  # Split words that are run together.
+    name = re.sub(r'[^\w\s]', ' ', name.lower())
+    return frozenset(word for word in name.split()
+                     if len(word) > 1 and word not in NOISE_WORDS and word not in SUFFIXES)
+
+
+# This function computes the Soundex code of a word.  Words that sound alike get the same code (eg: "Robert" and
+# "Rupert" are both R163).
+#
+# Args -
+#   word - a lower case word
+#
+# Returns - the four character Soundex code
+@functools.lru_cache(maxsize=None)
+def soundex(word):
+    codes = {'b': '1', 'f': '1', 'p': '1', 'v': '1',
+             'c': '2', 'g': '2', 'j': '2', 'k': '2', 'q': '2', 's': '2', 'x': '2', 'z': '2',
+             'd': '3', 't': '3', 'l': '4', 'm': '5', 'n': '5', 'r': '6'}
+    letters = [letter for letter in word.lower() if letter.isalpha()]
+    if not letters:
+        return word
+    result = letters[0].upper()
+    last_code = codes.get(letters[0], '')
+    for letter in letters[1:]:
+        code = codes.get(letter, '')
+        if code and code != last_code:
+            result += code
+        if letter not in 'hw':  # H and W don't separate letters with the same code.
+            last_code = code
+    return (result + '000')[:4]
+
+
+# Test the name index with some of the names that give the LGL search trouble.
+def run_name_index_test():
+    index = NameIndex()
+    index.add(constituent_id=956522, name='Carolyn & Andy Limeri')
+    index.add(constituent_id=956522, name='Limeri, Carolyn')
+    index.add(constituent_id=1, name='Louise M. Ryan')
+    index.add(constituent_id=2, name='Richard Cederman')
+    index.add(constituent_id=3, name='Derek P. Carver')
+    for name in ['Carolyn and Andy Limeri', 'Caroline Limeri', 'Louise M.Ryan & RichardCederman', 'DEREK P CARVER']:
+        log.debug('"{}": {}'.format(name, index.search(name=name)))
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_name_index_test()
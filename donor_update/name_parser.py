@@ -0,0 +1,204 @@
+# This module parses the donor names in the input files and makes the list of search terms used to find them in LGL.
+# LglApi.find_constituent used to rewrite a name with a fixed series of regexes, calling LGL after each rewrite.  A
+# name like "D.H. and A.G. Talamo" could take four or five calls before one of them found anything.  Now the name is
+# parsed once into its parts:
+#   - the people in it ("Carolyn and Andy Limeri" is two people who share a last name),
+#   - initials ("D.H.", "M."), which LGL usually doesn't have,
+#   - suffixes ("Jr", "III"), and
+#   - organization markers ("Fund", "Bank", ...), which mean the name isn't a person at all.
+#
+# The search variants are made from those parts, variants that are the same search are dropped, and the rest are put
+# in the order that is most likely to find the constituent (see STEP_ORDER).  The caller stops at the first hit.
+#
+# A variant that leaves part of the name out always keeps at least two words.  "J. Smith" is never searched as just
+# "Smith", because a last name that only one constituent in LGL has would be taken as the donor.
+
+import logging
+import re
+
+import column_constants as cc
+
+# The steps that make search variants.  The default order is the order most likely to find a match.
+STEP_FULL = 'full'  # The whole name without noise words or punctuation.
+STEP_NO_INITIALS = 'no_initials'  # The name without initials or suffixes.
+STEP_PRIMARY = 'primary'  # The first and last name of the first person in the name.
+STEP_SPLIT_WORDS = 'split_words'  # Words that are run together ("RichardCederman") split apart.
+STEP_SECOND_PERSON = 'second_person'  # The first and last name of the second person in the name.
+STEP_ORDER = [STEP_FULL, STEP_NO_INITIALS, STEP_PRIMARY, STEP_SPLIT_WORDS, STEP_SECOND_PERSON]
+# The steps that leave part of the name out.  A constituent found by one of them may not be the donor, so the ID is
+# not saved in the cache (see LglApi.find_constituent_id).
+REDUCED_STEPS = [STEP_NO_INITIALS, STEP_PRIMARY, STEP_SPLIT_WORDS, STEP_SECOND_PERSON]
+MIN_REDUCED_WORDS = 2  # A step that leaves part of the name out must still search for at least this many words.
+
+CONJUNCTIONS = ['and', 'or', '&', '+']
+PREFIXES = ['mr', 'mrs', 'ms', 'dr']
+SUFFIXES = ['jr', 'sr', 'ii', 'iii', 'iv']
+ORG_MARKERS = ['fund', 'bank', 'foundation', 'trust', 'inc', 'llc', 'church', 'corp', 'corporation', 'company',
+               'association', 'charitable', 'giving', 'program', 'society']
+ORG_NOISE_WORDS = ['fund']  # Org words that LGL doesn't have in its names.
+MEMORIAL_PATTERN = re.compile(r'^\s*in (memory|honor) of\s+', re.IGNORECASE)
+
+log = logging.getLogger()
+
+
+class ParsedName:
+
+    def __init__(self, raw_name):
+        self.raw_name = raw_name
+        self.all_words = []  # The words in the name, including initials and suffixes, in their original order.
+        self.words = []  # The words in the name that aren't initials, suffixes, or noise words.
+        self.initials = []  # The words that are initials.
+        self.suffixes = []  # The words that are suffixes like "Jr".
+        self.people = []  # A list of (first_name, middle_names, last_name) tuples, one for each person in the name.
+        self.is_org = False  # True if the name has a word like "Fund" or "Bank".
+
+    def __repr__(self):
+        return 'ParsedName(people={}, initials={}, suffixes={}, is_org={})'.format(self.people, self.initials,
+                                                                                   self.suffixes, self.is_org)
+
+
+# This function will break a name into its parts.
+#
+# Args -
+#   name - the name from the input file
+#
+# Returns - a ParsedName object
+def parse_name(name):
+    parsed = ParsedName(raw_name=name)
+    if not name or str(name) == cc.EMPTY_CELL:
+        return parsed
+    text = str(name)
+    # If the whole string is upper case, make it title case (first letter of every word is capital).
+    if text.isupper():
+        text = text.title()
+    text = MEMORIAL_PATTERN.sub('', text)
+    text = re.sub(r'\.(?=\w)', '. ', text)  # "M.Ryan" is "M. Ryan" and "D.H." is "D. H."
+    text = text.replace('&', ' & ').replace(',', ' ')
+
+    groups = [[]]  # The words for each person.  A conjunction starts a new person.
+    for word in text.split():
+        plain = word.replace('.', '').lower()
+        if not plain:
+            continue
+        if plain in CONJUNCTIONS:
+            if groups[-1]:
+                groups.append([])
+            continue
+        if plain in PREFIXES:
+            continue
+        if plain in SUFFIXES:
+            parsed.suffixes.append(word.replace('.', ''))
+            parsed.all_words.append(word.replace('.', ''))
+            continue
+        if plain in ORG_MARKERS:
+            parsed.is_org = True
+        if _is_initials(word):
+            initials = [letter for letter in word if letter.isalpha()]
+            parsed.initials.extend(initials)
+            parsed.all_words.extend(initials)
+            continue
+        word = word.replace('.', '')
+        parsed.all_words.append(word)
+        parsed.words.append(word)
+        groups[-1].append(word)
+
+    groups = [group for group in groups if group]
+    if parsed.is_org or not groups:
+        return parsed
+    # A person with only one name shares the last name of the person after them ("Carolyn and Andy Limeri").  If
+    # nobody has a first and last name, the one name is a last name ("D.H. and A.G. Talamo").
+    shared_last_name = groups[-1][-1] if len(groups[-1]) > 1 else ''
+    for group in groups:
+        if len(group) > 1:
+            parsed.people.append((group[0], group[1:-1], group[-1]))
+        elif shared_last_name:
+            parsed.people.append((group[0], [], shared_last_name))
+        else:
+            parsed.people.append(('', [], group[0]))
+    return parsed
+
+
+# This function will make the list of search terms to try for a name in the order they should be tried.  Search
+# terms that would be the same search in LGL (they only differ by case or spacing) are only listed once.
+#
+# Args -
+#   name - the name from the input file
+#   step_order - (opt) the order to try the steps in.  Defaults to STEP_ORDER.
+#
+# Returns - a list of (step, search_terms) tuples
+def get_search_variants(name, step_order=None):
+    parsed = parse_name(name)
+    variants = _make_variants(parsed)
+    search_variants = []
+    seen = set()
+    for step in step_order or STEP_ORDER:
+        search_terms = variants.get(step, '')
+        key = ' '.join(search_terms.lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            search_variants.append((step, search_terms))
+    log.debug('The search variants for "{}" are {}.'.format(name, search_variants))
+    return search_variants
+
+
+# ----- P R I V A T E   F U N C T I O N S ----- #
+
+# This private function makes one search variant for each step.  A step that doesn't apply to the name isn't in the
+# dict.
+#
+# Returns - a dict in the format {step: search_terms}
+def _make_variants(parsed):
+    variants = {}
+    if parsed.is_org:
+        variants[STEP_FULL] = ' '.join(word for word in parsed.words if word.lower() not in ORG_NOISE_WORDS)
+        return variants
+    words = parsed.words
+    variants[STEP_FULL] = ' '.join(parsed.all_words)
+    if not words:
+        return variants  # There is nothing but initials, so they are the only thing to search for.
+    variants[STEP_NO_INITIALS] = ' '.join(words)
+    if parsed.people:
+        (first_name, _, last_name) = parsed.people[0]
+        variants[STEP_PRIMARY] = ' '.join(name for name in (first_name, last_name) if name)
+    if len(parsed.people) > 1:
+        (first_name, _, last_name) = parsed.people[1]
+        if first_name:
+            variants[STEP_SECOND_PERSON] = first_name + ' ' + last_name
+    split_words = [re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', word) for word in words]
+    # Names like "McGrath" and "DeLuca" are left alone.
+    split_words = [word if re.match(r'^(Mc|Mac|De|Di|La|Le|Van|Von)\s', word) is None else word.replace(' ', '', 1)
+                   for word in split_words]
+    variants[STEP_SPLIT_WORDS] = ' '.join(split_words)
+    # A bare last name (or first name) could match the wrong constituent, so it is only searched as the full name.
+    return {step: search_terms for (step, search_terms) in variants.items()
+            if step == STEP_FULL or len(search_terms.split()) >= MIN_REDUCED_WORDS}
+
+
+# This private function tells if a word is one or more initials, like "P", "P." or "D.H.".  A short word that is all
+# capitals, like "DH", is also initials, unless it is a suffix.
+def _is_initials(word):
+    letters = word.replace('.', '')
+    if not letters.isalpha():
+        return False
+    if len(letters) == 1:
+        return True
+    return ('.' in word and len(letters) <= 3) or (letters.isupper() and len(letters) <= 2)
+
+
+# Test the parser with some of the names that give the LGL search trouble.
+def run_name_parser_test():
+    for name in ['Carolyn and Andy Limeri', 'D.H. and A.G. Talamo', 'Louise M.Ryan & RichardCederman',
+                 'DEREK P CARVER', 'Pamela McGrath', 'In Memory of Nathan Kaitz', 'John Smith Jr.',
+                 'The Fidelity Charitable Fund', 'Mary Louise Parker', 'J. Smith', 'AJ Smith', 'D.H. Lawrence']:
+        log.debug('"{}": {}'.format(name, parse_name(name)))
+        log.debug('"{}": {}'.format(name, get_search_variants(name)))
+
+
+if __name__ == '__main__':
+    console_formatter = logging.Formatter('%(module)s.%(funcName)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter)
+    log.addHandler(console_handler)
+    log.setLevel(logging.DEBUG)
+
+    run_name_parser_test()